@@ -0,0 +1,128 @@
+"""Keeps concurrent `ectl setup` processes from building the same
+build directory at once.
+
+The first process to take a build's lock builds it, recording make's
+progress in a file next to the lock.  Other processes wait on the
+lock, printing that progress; once they get the lock, they find the
+pkg already built and reuse it.
+"""
+from __future__ import print_function
+import os
+import re
+import sys
+import time
+import subprocess
+import llnl.util.lock
+
+# Seconds between progress reports while waiting for a lock
+POLL_INTERVAL = 10.
+
+# Lines of make output worth reporting to waiters: [ 45%] ...
+makeProgressRE = re.compile(r'\s*\[\s*(\d+)%\]')
+
+class BuildLock(object):
+    """Exclusive lock on one build directory, as a context manager.
+
+    lockfile:
+        Name of the lock file (created if needed).
+    progress:
+        File where the lock holder records its progress (see run_make).
+    timeout:
+        Give up waiting after this many seconds (None = wait forever).
+    what:
+        What the lock guards, for messages (eg: 'download of X').
+
+    After entering, `waited` tells whether another process held the
+    lock first (and so might have done the build already)."""
+
+    def __init__(self, lockfile, progress=None, timeout=None, poll=POLL_INTERVAL, out=sys.stdout, what='build'):
+        self.lockfile = lockfile
+        self.what = what
+        self.progress = progress
+        self.timeout = timeout
+        self.poll = poll
+        self.out = out
+        self.waited = False
+
+        if not os.path.exists(lockfile):
+            try:
+                os.makedirs(os.path.dirname(lockfile))
+            except OSError:
+                pass
+            with open(lockfile, 'a'):
+                pass
+        self.lock = llnl.util.lock.Lock(lockfile)
+
+    def holder(self):
+        """pid and host of the process holding the lock, as written by llnl.util.lock"""
+        try:
+            with open(self.lockfile, 'r') as fin:
+                return fin.read().strip()
+        except IOError:
+            return ''
+
+    def read_progress(self):
+        if self.progress is None:
+            return None
+        try:
+            with open(self.progress, 'r') as fin:
+                return fin.read().strip()
+        except IOError:
+            return None
+
+    def __enter__(self):
+        start = time.time()
+        last_progress = None
+        while True:
+            try:
+                # Short timeout: llnl.util.lock busy-waits
+                self.lock.acquire_write(timeout=.05)
+                break
+            except llnl.util.lock.LockError:
+                pass
+
+            if not self.waited:
+                self.out.write('%s%s in progress by another process (%s); waiting...\n' % (
+                    self.what[0].upper(), self.what[1:], self.holder()))
+                self.waited = True
+            progress = self.read_progress()
+            if progress is not None and progress != last_progress:
+                self.out.write('    %s\n' % progress)
+                last_progress = progress
+            self.out.flush()
+
+            if self.timeout is not None and time.time() - start > self.timeout:
+                raise llnl.util.lock.LockError(
+                    'Timed out waiting for %s lock %s' % (self.what, self.lockfile))
+            time.sleep(self.poll)
+
+        if self.waited:
+            self.out.write('Got %s lock after %.0f s\n' % (self.what, time.time() - start))
+        return self
+
+    def __exit__(self, *args):
+        self.lock.release_write()
+
+
+def run_make(cmd, progress=None, out=sys.stdout, **kwargs):
+    """Runs make, echoing its output, and records the most recent
+    progress line ([ xx%] ...) in the file `progress`.
+    Raises subprocess.CalledProcessError on failure."""
+
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT, **kwargs)
+    for line in proc.stdout:
+        line = line.decode(errors='replace')
+        out.write(line)
+        if progress is not None and makeProgressRE.match(line) is not None:
+            with open(progress, 'w') as pout:
+                pout.write(line)
+    out.flush()
+    ret = proc.wait()
+
+    if progress is not None:
+        with open(progress, 'w') as pout:
+            pout.write('make finished: exit status %d\n' % ret)
+
+    if ret != 0:
+        raise subprocess.CalledProcessError(ret, cmd)
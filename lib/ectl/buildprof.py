@@ -0,0 +1,158 @@
+"""Profiles ModelE builds: which targets took longest to compile, and
+the serial critical path through the build.
+
+`make` is run with SHELL set to a small shim, which runs each recipe
+command under /bin/sh and logs when it started and ended.  The shim is
+a /bin/sh script that runs the Python part (ectl-profile-shell.py); so
+the Python interpreter's path may be long (eg: in a Spack tree) or
+contain spaces, which a #! line could not handle.  Command-line
+variables are passed down to recursive makes, so this sees every
+command of a CMake-generated build without re-running CMake.  Each
+command costs one extra Python startup, so builds run a little slower
+while profiled.
+
+The log goes in <build>/build_profile.jsonl, one JSON object per
+command: {"start", "end", "cwd", "cmd"}.
+"""
+from __future__ import print_function
+import os
+import sys
+import re
+import json
+import shlex
+import bisect
+import ectl.timing
+
+PROFILE = 'build_profile.jsonl'
+SHIM = 'ectl-profile-shell'
+
+SHELL_TEMPLATE = '''#!/bin/sh
+# Written by ectl.buildprof: runs a make recipe line, and logs its timing
+exec {python} -S {shim_py} "$@"
+'''
+
+SHIM_TEMPLATE = '''# Written by ectl.buildprof: the Python part of ectl-profile-shell
+import os, sys, json, time, subprocess
+start = time.time()
+ret = subprocess.call(['/bin/sh'] + sys.argv[1:], close_fds=False)    # Keep the jobserver
+end = time.time()
+line = json.dumps({{'start': start, 'end': end, 'cwd': os.getcwd(), 'cmd': sys.argv[-1]}})
+fd = os.open({log!r}, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+os.write(fd, (line + '\\n').encode())
+os.close(fd)
+sys.exit(ret if ret >= 0 else 128 - ret)
+'''
+
+def make_args(build):
+    """Starts a new profile of a build.
+    Returns: Arguments to add to the make command line."""
+    log = os.path.join(build, PROFILE)
+    shim = os.path.join(build, SHIM)
+    if os.path.exists(log):
+        os.remove(log)
+    with open(shim + '.py', 'w') as out:
+        out.write(SHIM_TEMPLATE.format(log=log))
+    with open(shim, 'w') as out:
+        out.write(SHELL_TEMPLATE.format(python=shlex.quote(sys.executable),
+            shim_py=shlex.quote(shim + '.py')))
+    os.chmod(shim, 0o755)
+    return ['SHELL=' + shim]
+
+# Recipe lines that run make recursively: they last as long as the
+# sub-make, and are left out of the profile.
+submakeRE = re.compile(r'(^|&&|;)\s*(\S*/)?g?make\s')
+
+def read_profile(build):
+    """Returns: [{start, end, cwd, cmd}] of the commands in the last
+    profiled build (except recursive makes), in order of start."""
+    jobs = list()
+    with open(os.path.join(build, PROFILE)) as fin:
+        for line in fin:
+            try:
+                job = json.loads(line)
+            except ValueError:
+                continue    # Interrupted write
+            if submakeRE.search(job['cmd']) is None:
+                jobs.append(job)
+    jobs.sort(key=lambda job: job['start'])
+    return jobs
+
+def compiled_file(cmd):
+    """Determines the output of a compile command.
+    Returns: The (object) file compiled, or None if cmd is not a compile."""
+    try:
+        args = shlex.split(cmd)
+    except ValueError:
+        return None
+    if '-c' not in args:
+        return None
+    for i,arg in enumerate(args[:-1]):
+        if arg == '-o':
+            return args[i+1]
+    return None
+
+def target_name(job, build):
+    """Short name for what a command made: the file it compiled, else
+    the command itself."""
+    target = compiled_file(job['cmd'])
+    if target is None:
+        return job['cmd'].strip().split('\n')[0][:60]
+    target = os.path.join(job['cwd'], target)
+    if target.startswith(build + os.sep):
+        target = os.path.relpath(target, build)
+    return target
+
+def timeline(jobs, build):
+    """Converts a profile to an ectl.timing.Timeline.  make doesn't say
+    what each command waited for; so each command is assumed to have
+    waited on the latest one to end before it started."""
+    names = list()
+    seen = set()
+    for i,job in enumerate(jobs):
+        name = target_name(job, build)
+        if name in seen:
+            name = '{} ({})'.format(name, i)
+        seen.add(name)
+        names.append(name)
+
+    by_end = sorted(range(len(jobs)), key=lambda i: jobs[i]['end'])
+    ends = [jobs[i]['end'] for i in by_end]
+    tl = ectl.timing.Timeline()
+    for name,job in zip(names, jobs):
+        nbefore = bisect.bisect_right(ends, job['start'])
+        after = [names[by_end[nbefore-1]]] if nbefore > 0 else []
+        tl.add(name, job['start'], job['end'], after=after)
+    return tl
+
+def report(build, nslowest=15, out=sys.stdout):
+    """Prints the slowest compiles and the critical path of the last
+    profiled build."""
+    jobs = read_profile(build)
+    if len(jobs) == 0:
+        return
+    tl = timeline(jobs, build)
+    wall = max(job['end'] for job in jobs) - min(job['start'] for job in jobs)
+    busy = sum(job['end'] - job['start'] for job in jobs)
+
+    compiles = [name for name,job in zip(tl.order, jobs) if compiled_file(job['cmd']) is not None]
+    compiles.sort(key=lambda name: tl.steps[name][0] - tl.steps[name][1])
+
+    out.write('-------- Build profile: {}\n'.format(os.path.join(build, PROFILE)))
+    out.write('    {} commands ({} compiles); {:.1f}s wall, {:.1f}s busy; average parallelism {:.1f}\n'.format(
+        len(jobs), len(compiles), wall, busy, busy / wall if wall > 0 else 1.))
+    out.write('Slowest compiles:\n')
+    for name in compiles[:nslowest]:
+        start, end, _ = tl.steps[name]
+        out.write('    {:8.1f}s  {}\n'.format(end - start, name))
+
+    path = tl.critical_path()
+    path_seconds = sum(tl.steps[name][1] - tl.steps[name][0] for name in path)
+    out.write('Critical path: {} commands, {:.1f}s of {:.1f}s\n'.format(len(path), path_seconds, wall))
+    for name in path:
+        start, end, _ = tl.steps[name]
+        if end - start >= .05 * path_seconds:
+            out.write('    {:8.1f}s  {}\n'.format(end - start, name))
+    out.flush()
+
+if __name__ == '__main__':
+    report(os.path.abspath(sys.argv[1]))
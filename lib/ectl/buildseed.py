@@ -0,0 +1,158 @@
+"""Seeds a new build directory from the most similar existing one.
+
+A new build hash usually means the rundeck's defines (or sources, or
+components) changed a little.  Rather than compiling from scratch, we
+clone the nearest existing build directory of the same source tree and
+let CMake and make's dependency tracking rebuild only what changed.
+
+Every finished build records what it was built from in BUILD_INFO.
+"""
+from __future__ import print_function
+import os
+import json
+import shutil
+import subprocess
+import llnl.util.lock
+
+BUILD_INFO = 'ectl-build.json'
+
+# Don't seed from builds less similar than this (0..1)
+MIN_SIMILARITY = .5
+
+# Binary build products; never need relocating
+_binary_exts = ('.o', '.mod', '.smod', '.a', '.so', '.nc')
+
+def build_info(rd_build, src):
+    """Describes a build, in JSON-compatible form.
+    rd_build: ectl.rundeck.Build"""
+    return {
+        'src' : os.path.realpath(src),
+        'sources' : sorted(rd_build.sources),
+        'components' : dict(rd_build.components),
+        'defines' : dict(rd_build.defines),
+    }
+
+def read_build_info(build):
+    try:
+        with open(os.path.join(build, BUILD_INFO), 'r') as fin:
+            return json.load(fin)
+    except (IOError, ValueError):
+        return None
+
+def write_build_info(build, info):
+    with open(os.path.join(build, BUILD_INFO), 'w') as out:
+        json.dump(info, out, indent=1, sort_keys=True)
+
+def _features(info):
+    ret = set(('source', x) for x in info['sources'])
+    ret.update(('component', k, json.dumps(v, sort_keys=True)) for k,v in info['components'].items())
+    ret.update(('define', k, json.dumps(v)) for k,v in info['defines'].items())
+    return ret
+
+def similarity(info0, info1):
+    """Jaccard similarity of the sources, components and defines of two builds."""
+    f0 = _features(info0)
+    f1 = _features(info1)
+    if len(f0 | f1) == 0:
+        return 1.
+    return float(len(f0 & f1)) / len(f0 | f1)
+
+def nearest_build(builds, info, exclude=None):
+    """Finds the existing build (of the same source tree) most similar to info.
+    Returns: (build, similarity, build_info) or (None, 0, None)"""
+    best = (None, 0., None)
+    if not os.path.isdir(builds):
+        return best
+    for leaf in os.listdir(builds):
+        build = os.path.join(builds, leaf)
+        if build == exclude or not os.path.isdir(build):
+            continue
+        other = read_build_info(build)
+        if other is None or other['src'] != info['src']:
+            continue
+        sim = similarity(info, other)
+        if sim > best[1]:
+            best = (build, sim, other)
+    return best
+
+# ----------------------------------------------------------
+def clone_tree(src, dst):
+    """Copies a build tree, preserving mtimes.  Uses copy-on-write
+    (reflinks) where the filesystem supports it.
+
+    (Hardlinks are not safe: compilers overwrite object files in place,
+    which would corrupt the build we cloned from.)"""
+    try:
+        subprocess.check_call(['cp', '-a', '--reflink=auto', src, dst])
+    except (OSError, subprocess.CalledProcessError):
+        shutil.rmtree(dst, ignore_errors=True)
+        shutil.copytree(src, dst, symlinks=True)
+
+def relocate_tree(build, old_path, new_path, max_size=1<<22):
+    """Rewrites absolute paths of the old build directory in a cloned
+    build's text files (CMakeCache.txt, Makefiles, depend files, ...).
+    Modification times are kept, so make does not see them as changed.
+    Returns: Number of files rewritten."""
+    old = old_path.encode()
+    new = new_path.encode()
+    nfiles = 0
+    for root, dirs, files in os.walk(build):
+        for file in files:
+            fname = os.path.join(root, file)
+            if file.endswith(_binary_exts) or os.path.islink(fname):
+                continue
+            st = os.stat(fname)
+            if st.st_size > max_size:
+                continue
+            with open(fname, 'rb') as fin:
+                content = fin.read()
+            if old not in content or b'\0' in content:
+                continue
+            with open(fname, 'wb') as out:
+                out.write(content.replace(old, new))
+            os.utime(fname, ns=(st.st_atime_ns, st.st_mtime_ns))
+            nfiles += 1
+    return nfiles
+
+def seed_build(builds, build, info, min_similarity=MIN_SIMILARITY):
+    """Creates build by cloning the nearest existing build, if there is
+    one similar enough.
+    Returns: BUILD_INFO of the build we seeded from (with 'build' and
+        'similarity' added), or None if build was not seeded."""
+
+    seed, sim, seed_info = nearest_build(builds, info, exclude=build)
+    if seed is None or sim < min_similarity:
+        return None
+
+    # Don't copy a build that is in the middle of being built
+    lock = llnl.util.lock.Lock(seed + '.lock') if os.path.exists(seed + '.lock') else None
+    if lock is not None:
+        try:
+            lock.acquire_read(timeout=.05)
+        except llnl.util.lock.LockError:
+            print('Nearest build %s is busy; not seeding from it' % seed)
+            return None
+    try:
+        print('Seeding build from %s (similarity %.2f)' % (seed, sim))
+        clone_tree(seed, build)
+    finally:
+        if lock is not None:
+            lock.release_read()
+
+    n = relocate_tree(build, seed, build)
+    print('    relocated %d files' % n)
+    os.remove(os.path.join(build, BUILD_INFO))
+
+    seed_info['build'] = seed
+    seed_info['similarity'] = sim
+    return seed_info
+
+def report_saved(seed_info, make_seconds):
+    """Prints how much compile time seeding saved, compared to the
+    time the seed build originally took from scratch."""
+    full = seed_info.get('full_make_seconds')
+    if full is None:
+        print('Seeded build: make took %.0f s' % make_seconds)
+    else:
+        print('Seeded build: make took %.0f s vs. %.0f s from scratch; saved %.0f s' %
+            (make_seconds, full, full - make_seconds))
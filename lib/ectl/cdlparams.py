@@ -1,14 +1,15 @@
 from __future__ import print_function
 import ectl.paths
 from spack.util import executable
-import netCDF4
 import os
 from ectl import pathutil
 from giss import ioutil
 
-def resolve_cdls_in_dir(config_dir, download_dir=None):
+def resolve_cdls_in_dir(config_dir, download_dir=None, search_path=None):
     """Converts .cdl auxillary Rundeck files to .nc; and resolves input
-    files in them as well."""
+    files in them as well.
+    search_path: [dir] or pathutil.PathIndex
+        Where to look for input files (default: MODELE_FILE_PATH)"""
 
     cdl_files = [
         os.path.join(config_dir, x)
@@ -18,17 +19,20 @@ def resolve_cdls_in_dir(config_dir, download_dir=None):
     good = True
     for ifname in cdl_files:
         ofname = os.path.splitext(ifname)[0] + '.nc'
-        resolve_cdl(ifname, ofname, download_dir=download_dir)
+        resolve_cdl(ifname, ofname, download_dir=download_dir, search_path=search_path)
 
     return good
 
 
-def resolve_cdl(ifname, ofname, download_dir=None, keep_partial=False):
+def resolve_cdl(ifname, ofname, download_dir=None, keep_partial=False, search_path=None):
     """ifname:
         Input file name (xyz.cdl)
     ofname
         Output file name (xyz.nc)
+    search_path: [dir] or pathutil.PathIndex
+        Where to look for input files (default: MODELE_FILE_PATH)
     """
+    import netCDF4    # Slow to import
     ncgen = executable.which('ncgen')
     if ioutil.needs_regen((ofname,), (ifname,)):
         ncgen('-o', ofname, '-k', 'nc4', ifname)
@@ -37,6 +41,19 @@ def resolve_cdl(ifname, ofname, download_dir=None, keep_partial=False):
         # (see similar logic in rundeck/__init__.py)
         _good = True
         with netCDF4.Dataset(ofname, 'a') as nc:
+            # Missing input files are downloaded together
+            input_files = list()
+            for var_name in nc.variables:
+                var = nc.variables[var_name]
+                for aname in var.ncattrs():
+                    aval = getattr(var, aname)
+                    if isinstance(aval, str) and aval.startswith('input-file:'):
+                        input_files.append((aname, aval[11:]))
+            if search_path is None:
+                search_path = ectl.paths.default_file
+            resolved = pathutil.search_or_download_files(input_files,
+                search_path, download_dir=download_dir)
+
             for var_name in nc.variables:
                 var = nc.variables[var_name]
                 for aname in var.ncattrs():
@@ -44,17 +61,12 @@ def resolve_cdl(ifname, ofname, download_dir=None, keep_partial=False):
                     if not isinstance(aval, str):
                         continue
                     if aval.startswith('input-file:'):
-                        fname0 = aval[11:]
-                        try:
-                            fname1 = pathutil.search_or_download_file(
-                                aname, fname0,
-                                ectl.paths.default_file,
-                                download_dir=download_dir)
-                            setattr(var, aname, fname1)
-                        except Exception as e:
-                            # Errors were already reported in search_or_download_file
-                            print(e)
+                        fname1 = resolved[aval[11:]]
+                        if isinstance(fname1, Exception):
+                            # Errors were already reported in search_or_download_files
                             _good = False
+                        else:
+                            setattr(var, aname, fname1)
                     elif aval.startswith('output-file:'):
                         fname0 = aval[12:]
                         fname1 = os.path.abspath(fname0)
@@ -25,6 +25,7 @@
 import os
 import re
 import sys
+import ast
 
 import llnl.util.tty as tty
 from llnl.util.lang import attr_setdefault
@@ -72,6 +73,40 @@ def get_command(name):
     return getattr(get_module(name), get_cmd_function_name(name))
 
 
+descriptionRE = re.compile(r'^%s\s*=\s*(.*?)\s*$' % DESCRIPTION, re.MULTILINE)
+def get_description(name):
+    """Reads a command's description out of its source file, without
+    importing the module (and everything it imports)."""
+    fname = os.path.join(command_path, name + '.py')
+    with open(fname, 'r') as fin:
+        match = descriptionRE.search(fin.read())
+    if match is None:
+        return ""
+    try:
+        return ast.literal_eval(match.group(1))
+    except (ValueError, SyntaxError):
+        # Not a plain string literal; do it the slow way
+        return get_module(name).description
+
+
+def find_command(argv):
+    """Returns the subcommand named on a command line, or None."""
+    for arg in argv[1:]:
+        if not arg.startswith('-'):
+            return arg if arg in commands else None
+    return None
+
+
+def add_subparsers(subparsers, argv=sys.argv):
+    """Adds a subparser for every command, but imports (and sets up
+    the arguments of) only the command named in argv."""
+    selected = find_command(argv)
+    for cmd in commands:
+        subparser = subparsers.add_parser(cmd, help=get_description(cmd))
+        if cmd == selected:
+            get_module(cmd).setup_parser(subparser)
+
+
 
 def elide_list(line_list, max_num=10):
     """Takes a long list and limits it to a smaller number of elements,
@@ -5,7 +5,6 @@ import hashlib
 import argparse
 import llnl.util.tty as tty
 import ectl
-import ectl.setup
 import ectl.cmd
 from ectl import pathutil,rundeck,rundir,xhash,launchers
 from ectl.rundeck import legacy
@@ -30,6 +29,8 @@ def setup_parser(subparser):
 
 
 def cp(parser, args, unknown_args):
+    import ectl.setup    # Heavy; import only when needed
+
     if len(unknown_args) > 0:
         raise ValueError('Unkown arguments: %s' % unknown_args)
 
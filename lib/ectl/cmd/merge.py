@@ -21,5 +21,5 @@ def do_merge(run):
 
     with ectl.util.working_dir(os.path.join(run, 'config')):
         git('add', 'rundeck.R')
-        git('commit', 'rundeck.R', '-m', 'Fixed conflicts')
-        git('commit')
+        # Also concludes a `git merge` left by older versions of ectl setup
+        git('commit', '-m', 'Fixed conflicts', fail_on_error=False)
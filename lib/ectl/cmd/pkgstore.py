@@ -0,0 +1,36 @@
+from __future__ import print_function
+import os
+from ectl import pathutil
+import ectl.config
+import ectl.pkgstore
+
+description = 'Lists (and garbage-collects) the shared pkg store of an ectl root.'
+
+def setup_parser(subparser):
+    subparser.add_argument('dir', nargs='?', default='.',
+        help='Directory inside the Ectl root')
+    subparser.add_argument('--gc', action='store_true', dest='gc', default=False,
+        help='Remove pkgs that no run directory refers to')
+    subparser.add_argument('--dry-run', '-n', action='store_true', dest='dry_run', default=False,
+        help='With --gc: only report what would be removed')
+
+def pkgstore(parser, args, unknown_args):
+    if len(unknown_args) > 0:
+        raise ValueError('Unkown arguments: %s' % unknown_args)
+
+    # Find the root of the ectl tree
+    ectl_conf = pathutil.search_up(os.path.abspath(args.dir),
+        lambda path: pathutil.has_file(path, 'ectl.conf'))
+    if ectl_conf is None:
+        raise ValueError('Could not find ectl.conf starting from %s' % args.dir)
+    config = ectl.config.Config(os.path.split(ectl_conf)[0])
+    if config.pkgstore is None:
+        raise ValueError('No pkgstore set in %s' % os.path.join(config.ectl, 'ectl.conf'))
+    store = ectl.pkgstore.PkgStore(config.pkgstore)
+
+    print('pkgstore: %s' % store.root)
+    for pkg_hash,count in store.refcounts().items():
+        print('    %s  %d run(s)' % (pkg_hash, count))
+
+    if args.gc:
+        store.gc(dry_run=args.dry_run)
@@ -0,0 +1,38 @@
+from __future__ import print_function
+import os
+
+description = 'Build pkgs ahead of time for runs whose source has changed.'
+
+def setup_parser(subparser):
+    subparser.add_argument('--ectl', action='store', dest='ectl', default='.',
+        help='Root of ectl tree: ectl/runs, ectl/builds, ectl/pkgs')
+    subparser.add_argument('--watch', action='store', dest='watch', default=None,
+        help='Keep running, checking for changed source every this many seconds')
+    subparser.add_argument('--max-builds', action='store', dest='max_builds', default='1',
+        help='Most pkgs to build at once')
+    subparser.add_argument('--jobs', '-j', action='store', dest='jobs', default=None,
+        help='Number of cores to use for each build.')
+    subparser.add_argument('--budget', action='store', dest='budget', default=None,
+        help='Disk space prebuilt pkgs not yet used by any run may take (eg: 50G); oldest are deleted first')
+    subparser.add_argument('--nice', action='store', dest='nice', default='19',
+        help='Niceness to build with')
+    subparser.add_argument('--hash-deps', action='store_true', dest='hash_deps', default=False,
+        help='Name package dir after only the sources the rundeck compiles, not the whole source tree.')
+    subparser.add_argument('--python', action='store', dest='python', default='python3',
+        help='Name of Python command to use running build/setup scripts')
+    subparser.add_argument('--pythonpath', action='store', dest='pythonpath', default=None,
+        help='PYTHONPATH to use when running Python')
+
+
+def prebuild(parser, args, unknown_args):
+    import ectl.prebuild    # Heavy; import only when needed
+
+    ectl.prebuild.prebuild(
+        os.path.abspath(args.ectl),
+        watch=None if args.watch is None else float(args.watch),
+        nice=int(args.nice),
+        max_builds=int(args.max_builds),
+        jobs=None if args.jobs is None else int(args.jobs),
+        budget=None if args.budget is None else ectl.prebuild.parse_size(args.budget),
+        hash_deps=args.hash_deps,
+        python=args.python, pythonpath=args.pythonpath, extra_cmake_args=unknown_args)
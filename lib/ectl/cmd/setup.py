@@ -16,7 +16,6 @@ import re
 import datetime
 import sys
 from spack.util import executable
-import ectl.setup
 
 description = 'Setup a ModelE run.'
 
@@ -41,16 +40,26 @@ def setup_parser(subparser):
         help="Don't unpack the build system from pyar.")
     subparser.add_argument('--jobs', '-j', action='store', dest='jobs',
         help='Number of cores to use when building.')
+    subparser.add_argument('--hash-deps', action='store_true', dest='hash_deps', default=False,
+        help='Name package dir after only the sources the rundeck compiles, not the whole source tree.')
     subparser.add_argument('--python', action='store', dest='python', default='python3',
         help='Name of Python command to use running build/setup scripts')
     subparser.add_argument('--pythonpath', action='store', dest='pythonpath', default=None,
         help='PYTHONPATH to use when running Python')
+    subparser.add_argument('--timing', action='store_true', dest='timing', default=False,
+        help='Print how long each step of setup took, and the critical path.')
+    subparser.add_argument('--profile-build', action='store_true', dest='profile_build', default=False,
+        help='Time each command of the build; print the slowest compiles and the critical path.')
 
 
 def setup(parser, args, unknown_args):
+    import ectl.setup    # Heavy; import only when needed
+
     args.run = os.path.abspath(args.run)
     ectl.setup.setup(
         args.run, rundeck=args.rundeck, src=args.src,
         jobs=None if args.jobs is None else int(args.jobs),
         pkgbuild=args.pkgbuild, rebuild=args.rebuild, unpack=args.unpack,
-        python=args.python, pythonpath=args.pythonpath, extra_cmake_args=unknown_args, build=args.build)
+        python=args.python, pythonpath=args.pythonpath, extra_cmake_args=unknown_args, build=args.build,
+        hash_deps=args.hash_deps, timing=args.timing,
+        profile_build=args.profile_build)
@@ -0,0 +1,40 @@
+from __future__ import print_function
+import os
+import llnl.util.tty as tty
+
+description = 'Create and setup an ensemble of runs from a base run and a parameter table.'
+
+def setup_parser(subparser):
+    subparser.add_argument(
+        'base', help='Directory of base run (already setup)')
+    subparser.add_argument(
+        'table', help='Parameter table: a header line "run param1 param2...", then one line per run')
+    subparser.add_argument('--runs', action='store', dest='runs', default=None,
+        help='Directory in which to create the runs (default: next to the base run)')
+    subparser.add_argument('--procs', '-p', action='store', dest='procs', default=None,
+        help='Number of runs to setup at once')
+    subparser.add_argument('--jobs', '-j', action='store', dest='jobs', default=None,
+        help='Total number of cores to use building, across all builds')
+    subparser.add_argument('--hash-deps', action='store_true', dest='hash_deps', default=False,
+        help='Name package dir after only the sources the rundeck compiles, not the whole source tree.')
+    subparser.add_argument('--python', action='store', dest='python', default='python3',
+        help='Name of Python command to use running build/setup scripts')
+    subparser.add_argument('--pythonpath', action='store', dest='pythonpath', default=None,
+        help='PYTHONPATH to use when running Python')
+
+
+def sweep(parser, args, unknown_args):
+    import ectl.sweep    # Heavy; import only when needed
+
+    failed = ectl.sweep.sweep(
+        args.base, args.table,
+        runs_dir=None if args.runs is None else os.path.abspath(args.runs),
+        procs=None if args.procs is None else int(args.procs),
+        jobs=None if args.jobs is None else int(args.jobs),
+        python=args.python, pythonpath=args.pythonpath,
+        extra_cmake_args=unknown_args, hash_deps=args.hash_deps)
+
+    if len(failed) > 0:
+        for run,err in failed:
+            tty.error('%s: %s' % (run, err))
+        return 1
@@ -1,15 +1,23 @@
 from __future__ import print_function
 import os
 from ectl import pathutil
-import re
 import subprocess
 import sys
 
-mpiRE_str = \
-    r'(mpirun \(Open MPI\) (\d+)\.(\d+)\.(\d+).*)|'+ \
-    r'(Intel\(R\) MPI Library for Linux\* OS, Version (\d+) Update (\d+) Build (\d+) \(id: (\d+)\).*)'
-print(mpiRE_str)
-mpiRE = re.compile(mpiRE_str, re.MULTILINE)
+def read_conf(fname):
+    """Reads the `key = value` entries of an ectl.conf file into a dict.
+    Blank lines and comments (#) are ignored."""
+    conf = dict()
+    if not os.path.exists(fname):
+        return conf
+    with open(fname, 'r') as fin:
+        for line in fin:
+            line = line.partition('#')[0].strip()
+            if len(line) == 0:
+                continue
+            key,_,val = line.partition('=')
+            conf[key.strip()] = val.strip()
+    return conf
 
 class Config(object):
     """General configuration of where things are stored in this Ectl
@@ -22,7 +30,22 @@ class Config(object):
         self.builds = None      # Where to create build directories, if needed
         self.pkgs = None        # Where to create pkg directories, if needed
         self.keepalive = None
-
+        self.pkgstore = None    # Shared, content-addressed pkg store (optional)
+
+        self._init(ectl, run)
+        if self.ectl is not None:
+            self._read_conf()
+
+    def _read_conf(self):
+        """Reads settings from <ectl>/ectl.conf.
+            pkgstore = <dir>
+                Shared pkg store; relative to the ectl root."""
+        conf = read_conf(os.path.join(self.ectl, 'ectl.conf'))
+        if 'pkgstore' in conf:
+            self.pkgstore = os.path.abspath(os.path.join(self.ectl,
+                os.path.expanduser(conf['pkgstore'])))
+
+    def _init(self, ectl, run):
         # We are given an ectl root... EASY!
         if ectl is not None:
             print('Getting config from ectl')
@@ -42,14 +65,15 @@ class Config(object):
             self.runs = os.path.abspath(os.path.join(run, '..'))
 
             build = pathutil.follow_link(os.path.join(run, 'build'))
-            pkg = pathutil.follow_link(os.path.join(run, 'pkg'))
+            # Don't resolve all the way: <pkgs>/<hash> might link into a pkgstore
+            pkg = pathutil.read_link(os.path.join(run, 'pkg'))
 
 
             if build is not None and pkg is not None:
                 self.builds = os.path.abspath(os.path.join(build, '..'))
                 workspace_build = os.path.abspath(os.path.join(self.builds, '..'))
 
-                self.pkgs = os.path.abspath(os.path.join(pkg, '..'))
+                self.pkgs = os.path.realpath(os.path.dirname(pkg))
                 workspace_pkg = os.path.abspath(os.path.join(self.pkgs, '..'))
 
                 if workspace_build == workspace_pkg:
@@ -0,0 +1,637 @@
+"""Downloads ModelE input files from the NCCS portal, several at once.
+
+Files are fetched by a few worker threads.  Each thread keeps its HTTP
+connections open between files (keep-alive), and streams each file to
+disk in large blocks.  One progress line covers all the downloads;
+failures are reported per file, without stopping the others.
+
+Downloads survive dropped connections: they resume (HTTP Range) from
+the partial <name>.tmp, within the same process or a later one.  Once
+complete and checked, a file is renamed into place and a checksum
+sidecar (<name>.ectlsum) written; later setups trust the file on one
+stat() (see check_file()).
+
+The download directory is shared: concurrent `ectl setup` and `ectl
+run` processes take a per-file lock (<download_dir>/.ectl_locks) before
+downloading, so each file is downloaded once; the others wait, then
+find it there.  Files with the same contents (md5) as a file already
+downloaded are hard-linked to it, rather than stored twice (see
+<download_dir>/.ectl_checksums.json).
+
+A name that the portal redirects to <name>/ is a directory of input
+files.  Its listing is read once, and its files downloaded several at
+once, each resumed and checked as above (see fetch_dir()).
+
+ECTL_DOWNLOAD_URL overrides where files are downloaded from (eg: a
+mirror, or a local server for testing).
+"""
+from __future__ import print_function
+import os
+import re
+import sys
+import json
+import time
+import socket
+import ssl
+import hashlib
+import threading
+import http.client
+import urllib.parse
+import collections
+import concurrent.futures
+from contextlib import contextmanager
+from giss import ioutil
+import ectl.buildlock
+
+BASE_URL = os.environ.get('ECTL_DOWNLOAD_URL',
+    'https://portal.nccs.nasa.gov/GISS_modelE/modelE_input_data/')
+
+# Number of files to download at once
+MAX_WORKERS = 4
+
+# Bytes read from the network per write to disk
+BLOCK_SIZE = 1 << 20
+
+MAX_REDIRECTS = 5
+
+# Times to resume a download after its connection drops
+RETRIES = 5
+
+# Seconds between checks on a file another process is downloading
+LOCK_POLL = 1.
+
+class IsDirectory(Exception):
+    """The server redirected a file name to a directory listing."""
+    pass
+
+def url_of(sval, base_url=None):
+    return (base_url or BASE_URL).rstrip('/') + '/' + urllib.parse.quote(sval)
+
+class ConnectionPool(threading.local):
+    """HTTP(S) connections, one per server, kept open for reuse by the
+    thread that made them."""
+
+    def __init__(self, timeout=60.):
+        self.timeout = timeout
+        self.conns = dict()
+
+    def get(self, scheme, netloc):
+        """Returns: (conn, reused)"""
+        conn = self.conns.get((scheme, netloc))
+        if conn is not None:
+            return conn, True
+        klass = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        conn = klass(netloc, timeout=self.timeout)
+        self.conns[(scheme, netloc)] = conn
+        return conn, False
+
+    def discard(self, scheme, netloc):
+        conn = self.conns.pop((scheme, netloc), None)
+        if conn is not None:
+            conn.close()
+
+    def discard_url(self, url):
+        parts = urllib.parse.urlsplit(url)
+        self.discard(parts.scheme, parts.netloc)
+
+    def request(self, url, headers={}):
+        """GETs a URL, reusing an open connection if possible.
+        Returns: http.client.HTTPResponse (to be read to the end)"""
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        while True:
+            conn, reused = self.get(parts.scheme, parts.netloc)
+            try:
+                conn.request('GET', path, headers=headers)
+                return conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionError, http.client.BadStatusLine,
+                http.client.ImproperConnectionState):
+                # The server closed a kept-alive connection (or it was left
+                # mid-response); retry once on a new one
+                self.discard(parts.scheme, parts.netloc)
+                if not reused:
+                    raise
+            except Exception:
+                self.discard(parts.scheme, parts.netloc)
+                raise
+
+class Progress(object):
+    """One progress line for all downloads in progress."""
+
+    def __init__(self, nfiles, out=sys.stdout, interval=None):
+        self.nfiles = nfiles
+        self.out = out
+        self.tty = hasattr(out, 'isatty') and out.isatty()
+        self.interval = interval if interval is not None else (.5 if self.tty else 30.)
+        self.lock = threading.Lock()
+        self.ndone = 0
+        self.nfailed = 0
+        self.nbytes = 0
+        self.total = 0
+        self.start = time.time()
+        self.last = self.start
+
+    def started(self, size):
+        with self.lock:
+            self.total += size or 0
+
+    def add(self, nbytes):
+        with self.lock:
+            self.nbytes += nbytes
+            now = time.time()
+            if now - self.last >= self.interval:
+                self.last = now
+                self._write()
+
+    def message(self, msg):
+        """Prints a line, keeping the progress line below it."""
+        with self.lock:
+            if self.tty:
+                self.out.write('\r\033[K')
+            self.out.write(msg + '\n')
+            if self.tty:
+                self._write()
+            self.out.flush()
+
+    def done(self):
+        with self.lock:
+            self.ndone += 1
+
+    def failed(self):
+        with self.lock:
+            self.nfailed += 1
+
+    def finish(self):
+        with self.lock:
+            self._write()
+            if self.tty:
+                self.out.write('\n')
+            self.out.flush()
+
+    def _write(self):
+        seconds = max(time.time() - self.start, 1e-6)
+        line = 'Downloaded {}/{} files, {:.1f}/{:.1f} MB ({:.1f} MB/s)'.format(
+            self.ndone, self.nfiles, self.nbytes * 1e-6, self.total * 1e-6,
+            self.nbytes * 1e-6 / seconds)
+        if self.nfailed > 0:
+            line += '; {} failed'.format(self.nfailed)
+        if self.tty:
+            self.out.write('\r\033[K' + line)
+        else:
+            self.out.write(line + '\n')
+        self.out.flush()
+
+def _get(pool, url, headers={}):
+    """GETs a URL, following redirects.
+    Returns: (url, response)"""
+    for _ in range(MAX_REDIRECTS):
+        resp = pool.request(url, headers=headers)
+        if resp.status not in (301, 302, 303, 307, 308):
+            return url, resp
+        location = urllib.parse.urljoin(url, resp.getheader('Location', ''))
+        resp.read()
+        if location == url + '/':
+            raise IsDirectory(url)
+        url = location
+    raise IOError('Too many redirects: {}'.format(url))
+
+contentRangeRE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)')
+
+def _read_json(fname):
+    try:
+        with open(fname, 'r') as fin:
+            return json.load(fin)
+    except (IOError, ValueError):
+        return None
+
+def _write_json(fname, data):
+    with ioutil.AtomicOverwrite(fname) as fout:
+        json.dump(data, fout.out)
+        fout.commit()
+
+def _remove(fname):
+    try:
+        os.remove(fname)
+    except OSError:
+        pass
+
+def file_md5(fname, hash=None):
+    """md5 of a file's contents; or continues hash with them."""
+    hash = hash or hashlib.md5()
+    with open(fname, 'rb') as fin:
+        while True:
+            buf = fin.read(BLOCK_SIZE)
+            if not buf:
+                break
+            hash.update(buf)
+    return hash
+
+# ----------------------------------------------------------
+# Checksum sidecars: <file>.ectlsum records the stat and md5 of a
+# downloaded file, so it can be trusted later without reading it.
+SIDECAR = '.ectlsum'
+
+def _stat_key(fname):
+    st = os.stat(fname)
+    return [st.st_size, st.st_mtime_ns]
+
+def write_sidecar(file_name, md5, url=None, etag=None, last_modified=None):
+    _write_json(file_name + SIDECAR, {'stat': _stat_key(file_name), 'md5': md5,
+        'url': url, 'etag': etag, 'last_modified': last_modified})
+
+def check_file(file_name):
+    """Determines whether a (previously downloaded) file is intact.
+    Costs one stat() if it is unchanged since its sidecar was written;
+    otherwise, its contents are checked against the recorded md5.
+    Files without a sidecar are taken as good."""
+    sidecar = _read_json(file_name + SIDECAR)
+    if sidecar is None:
+        return True
+    try:
+        stat_key = _stat_key(file_name)
+    except OSError:
+        return False
+    if stat_key == sidecar['stat']:
+        return True
+    if stat_key[0] != sidecar['stat'][0]:
+        return False
+    if file_md5(file_name).hexdigest() != sidecar['md5']:
+        return False
+    sidecar['stat'] = stat_key    # Touched, but contents unchanged
+    try:
+        _write_json(file_name + SIDECAR, sidecar)
+    except OSError:
+        pass    # Read-only download directory: the sidecar is only an optimization
+    return True
+
+def _etag_md5(etag):
+    """Returns the md5 an ETag gives (some servers use the md5 of the
+    contents as ETag), or None."""
+    if etag is None:
+        return None
+    etag = etag.strip('"')
+    return etag.lower() if md5RE.match(etag) is not None else None
+
+md5RE = re.compile(r'^[0-9a-fA-F]{32}$')
+
+# Errors that mean the connection dropped, and a retry may succeed.
+# (Over HTTPS, a dropped connection is usually an SSLEOFError or
+# SSLZeroReturnError)
+DROPPED = (http.client.IncompleteRead, http.client.RemoteDisconnected,
+    ConnectionError, socket.timeout, ssl.SSLError)
+
+def _conditional_headers(file_name):
+    """Headers asking the server to send file_name only if it changed
+    since it was downloaded; None if it must be sent anyway."""
+    sidecar = _read_json(file_name + SIDECAR)
+    if sidecar is None or not check_file(file_name):
+        return None
+    headers = dict()
+    if sidecar.get('etag') is not None:
+        headers['If-None-Match'] = sidecar['etag']
+    if sidecar.get('last_modified') is not None:
+        headers['If-Modified-Since'] = sidecar['last_modified']
+    return headers if len(headers) > 0 else None
+
+def fetch(pool, url, file_name, progress, retries=None, if_changed=False):
+    """Downloads one URL to file_name.  Bytes arrive in file_name.tmp;
+    if the connection drops, the download resumes (HTTP Range) where it
+    left off; and a partial download left by an earlier process is
+    resumed too, if the server says the file has not changed since
+    (If-Range, with the ETag or Last-Modified recorded in
+    file_name.tmp.json).  The file is checked against Content-Length
+    (and the ETag, if it is an md5), then renamed into place, and its
+    checksum sidecar written.
+    if_changed:
+        If file_name was downloaded before (and is intact), download it
+        again only if it changed on the server.
+    Returns: Bytes downloaded, or None if unchanged"""
+
+    if retries is None:
+        retries = RETRIES
+    tmp_file_name = file_name + '.tmp'
+    partial_name = tmp_file_name + '.json'
+    partial = _read_json(partial_name)
+    if partial is None or partial.get('url') != url or not os.path.exists(tmp_file_name):
+        partial = None
+        _remove(tmp_file_name)
+
+    hash = None
+    nbytes = 0
+    started = False
+    for attempt in range(retries + 1):
+        offset = os.path.getsize(tmp_file_name) if partial is not None else 0
+        validator = None if partial is None else (partial.get('etag') or partial.get('last_modified'))
+        headers = dict()
+        if offset > 0 and validator is not None:
+            headers = {'Range': 'bytes={}-'.format(offset), 'If-Range': validator}
+        elif if_changed and partial is None and os.path.exists(file_name):
+            headers = _conditional_headers(file_name) or dict()
+
+        try:
+            url1, resp = _get(pool, url, headers)
+        except DROPPED:
+            pool.discard_url(url)
+            if attempt == retries:
+                raise
+            continue
+
+        try:
+            if resp.status == 206:
+                match = contentRangeRE.match(resp.getheader('Content-Range', ''))
+                if match is None or int(match.group(1)) != offset:
+                    resp.read()
+                    raise IOError('Bad Content-Range from {}: {}'.format(url1, resp.getheader('Content-Range')))
+                size = None if match.group(3) == '*' else int(match.group(3))
+                if offset > 0 and hash is None:
+                    hash = file_md5(tmp_file_name)    # Partial left by an earlier process
+            elif resp.status == 200:
+                length = resp.getheader('Content-Length')
+                size = None if length is None else int(length)
+                offset = 0
+                hash = hashlib.md5()
+            elif resp.status == 304 and os.path.exists(file_name):    # Not modified
+                resp.read()
+                return None
+            else:
+                resp.read()
+                if resp.status == 416:    # Range not satisfiable: start over
+                    partial = None
+                    _remove(tmp_file_name)
+                    continue
+                raise IOError('HTTP {} {}: {}'.format(resp.status, resp.reason, url1))
+
+            partial = {'url': url, 'etag': resp.getheader('ETag'),
+                'last_modified': resp.getheader('Last-Modified'), 'size': size}
+            _write_json(partial_name, partial)
+            if not started:
+                progress.started(None if size is None else size - offset)
+                started = True
+
+            buf = bytearray(BLOCK_SIZE)
+            view = memoryview(buf)
+            with open(tmp_file_name, 'ab' if offset > 0 else 'wb') as fout:
+                while True:
+                    n = resp.readinto(buf)
+                    if n == 0:
+                        break
+                    fout.write(view[:n])
+                    hash.update(view[:n])
+                    nbytes += n
+                    progress.add(n)
+        except DROPPED:
+            pool.discard_url(url1)
+            if attempt == retries:
+                raise
+            continue
+        except BaseException:
+            # The response may be half-read, leaving the connection unusable
+            pool.discard_url(url1)
+            raise
+
+        got = os.path.getsize(tmp_file_name)
+        if size is None or got == size:
+            break
+        if got > size:
+            _remove(tmp_file_name)
+            partial = None
+            raise IOError('Download of {} is longer than expected ({} > {} bytes)'.format(url1, got, size))
+        pool.discard_url(url1)    # Dropped early, without an error
+        if attempt == retries:
+            raise IOError('Truncated download ({} of {} bytes): {}'.format(got, size, url1))
+    else:
+        raise IOError('Could not download {}'.format(url))
+
+    md5 = hash.hexdigest()
+    etag_md5 = _etag_md5(partial['etag'])
+    if etag_md5 is not None and etag_md5 != md5:
+        _remove(tmp_file_name)
+        _remove(partial_name)
+        raise IOError('Checksum mismatch (ETag {}, got {}): {}'.format(partial['etag'], md5, url))
+
+    os.replace(tmp_file_name, file_name)
+    _remove(partial_name)
+    write_sidecar(file_name, md5, url=url, etag=partial['etag'],
+        last_modified=partial['last_modified'])
+    return nbytes
+
+# ----------------------------------------------------------
+# Directories of input files
+
+hrefRE = re.compile(r'''<a\s[^>]*?href\s*=\s*["']([^"'#?]*)["']''', re.IGNORECASE)
+
+def parse_listing(html, url):
+    """Members of an HTML directory listing (as made by Apache, or
+    Python's http.server): links to names within url.  Links to parent
+    directories, sort orders, etc. are left out.
+    Returns: [(name, is_dir)]"""
+    members = list()
+    for href in hrefRE.findall(html):
+        target = urllib.parse.urljoin(url, href)
+        if not target.startswith(url) or len(target) == len(url):
+            continue
+        name = urllib.parse.unquote(target[len(url):])
+        is_dir = name.endswith('/')
+        name = name.rstrip('/')
+        if '/' in name or (name, is_dir) in members:
+            continue
+        members.append((name, is_dir))
+    return members
+
+def list_dir(pool, url):
+    """Lists a directory on the server, and its subdirectories.
+    url:
+        Ends in /
+    Returns: [relative name] of the files in it"""
+    url1, resp = _get(pool, url)
+    html = resp.read()
+    if resp.status != 200:
+        raise IOError('HTTP {} {}: {}'.format(resp.status, resp.reason, url1))
+    charset = resp.headers.get_content_charset() or 'utf-8'
+    files = list()
+    for name, is_dir in parse_listing(html.decode(charset, errors='replace'), url1):
+        if is_dir:
+            files += [name + '/' + x for x in list_dir(pool, url1 + urllib.parse.quote(name) + '/')]
+        else:
+            files.append(name)
+    return files
+
+def fetch_dir(pool, url, dir_name, progress, max_workers=MAX_WORKERS):
+    """Downloads a directory of files, several at once.  The listing is
+    read once; then each member is fetched like a single file (resumed,
+    and checked), unless it is already there and unchanged on the
+    server.  A new directory is made as dir_name.tmp, and renamed into
+    place once complete.
+    url:
+        Ends in /
+    Returns: (files downloaded, bytes downloaded, files unchanged)"""
+    work_dir = dir_name if os.path.isdir(dir_name) else dir_name + '.tmp'
+    members = list_dir(pool, url)
+
+    def fetch1(member):
+        file_name = os.path.join(work_dir, *member.split('/'))
+        try:
+            os.makedirs(os.path.dirname(file_name))
+        except OSError:
+            pass
+        return fetch(pool, url + urllib.parse.quote(member), file_name, progress, if_changed=True)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(fetch1, members))    # Re-raises the first error
+
+    if work_dir != dir_name:
+        if len(members) == 0:
+            os.makedirs(work_dir, exist_ok=True)
+        os.replace(work_dir, dir_name)
+    fetched = [nbytes for nbytes in results if nbytes is not None]
+    return len(fetched), sum(fetched), len(results) - len(fetched)
+
+# ----------------------------------------------------------
+# Coordination between processes sharing a download directory
+LOCK_DIR = '.ectl_locks'
+CHECKSUMS = '.ectl_checksums.json'
+
+# Locks within this process (fcntl locks do not exclude threads of
+# the process holding them): {lockfile: threading.Lock}
+_thread_locks = collections.defaultdict(threading.Lock)
+_thread_locks_lock = threading.Lock()
+
+def lock_fname(download_dir, sval):
+    key = hashlib.md5(sval.encode()).hexdigest()[:16]
+    return os.path.join(download_dir, LOCK_DIR, key + '.lock')
+
+class _Messages(object):
+    """File-like: writes lines through a Progress"""
+    def __init__(self, progress):
+        self.progress = progress
+    def write(self, s):
+        if len(s.strip()) > 0:
+            self.progress.message(s.rstrip('\n'))
+    def flush(self):
+        pass
+
+@contextmanager
+def file_lock(lockfile, what, out=sys.stdout):
+    """Exclusive lock on a file, among threads and processes.
+    Yields: True if another process held it first"""
+    with _thread_locks_lock:
+        thread_lock = _thread_locks[lockfile]
+    with thread_lock:
+        lock = ectl.buildlock.BuildLock(lockfile, poll=LOCK_POLL, out=out, what=what)
+        with lock:
+            yield lock.waited
+
+def _same_file(fname0, fname1):
+    try:
+        return os.path.samefile(fname0, fname1)
+    except OSError:
+        return False
+
+def dedup(download_dir, sval, out=sys.stdout):
+    """Records a downloaded file's checksum; and if a file with the
+    same contents was downloaded before, replaces it with a hard link
+    to that one.
+    Returns: sval of the file now linked to, or None"""
+    file_name = os.path.join(download_dir, sval)
+    sidecar = _read_json(file_name + SIDECAR)
+    if sidecar is None:
+        return None
+    md5 = sidecar['md5']
+    index_name = os.path.join(download_dir, CHECKSUMS)
+
+    with file_lock(index_name + '.lock', 'update of ' + CHECKSUMS, out=out):
+        index = _read_json(index_name) or dict()    # {md5: [sval]}
+        others = [x for x in index.get(md5, [])
+            if x != sval and os.path.exists(os.path.join(download_dir, x))]
+
+        linked = None
+        for other in others:
+            other_name = os.path.join(download_dir, other)
+            if _same_file(other_name, file_name):
+                linked = other
+                break
+            other_sidecar = _read_json(other_name + SIDECAR)
+            if other_sidecar is None or other_sidecar['md5'] != md5 or not check_file(other_name):
+                continue
+            tmp = file_name + '.link'
+            try:
+                _remove(tmp)
+                os.link(other_name, tmp)
+                os.replace(tmp, file_name)
+            except OSError:
+                _remove(tmp)
+                continue    # Eg: another filesystem; keep the copy
+            write_sidecar(file_name, md5, url=sidecar.get('url'), etag=sidecar.get('etag'))
+            linked = other
+            break
+
+        index[md5] = others + [sval]
+        _write_json(index_name, index)
+    return linked
+
+def download_files(svals, download_dir, labels=None, max_workers=MAX_WORKERS, base_url=None, out=sys.stdout):
+    """Downloads input files into download_dir, several at once.
+    svals: [str]
+        Names of the files, relative to the download URL and download_dir
+    labels: {sval: str}
+        Names to report each file under (eg: rundeck parameter)
+    Returns: {sval: file name, or the Exception that kept it from downloading}"""
+    svals = list(dict.fromkeys(svals))    # Unique, in order
+    if len(svals) == 0:
+        return dict()
+    labels = labels or dict()
+    download_dir = os.path.abspath(download_dir)
+    pool = ConnectionPool()
+    progress = Progress(len(svals), out=out)
+
+    counts = collections.Counter()    # hit, miss, dedup
+    counts_lock = threading.Lock()
+    def count(key):
+        with counts_lock:
+            counts[key] += 1
+
+    def download1(sval):
+        label = labels.get(sval, sval)
+        file_name = os.path.join(download_dir, sval)
+        try:
+            os.makedirs(os.path.dirname(file_name))
+        except OSError:
+            pass
+        try:
+            with file_lock(lock_fname(download_dir, sval), 'download of ' + sval,
+                out=_Messages(progress)):
+                # Another process may have downloaded it while we waited
+                if os.path.exists(file_name) and check_file(file_name):
+                    progress.message('{}: {} was downloaded by another process'.format(label, sval))
+                    count('hit')
+                    progress.done()
+                    return file_name
+
+                try:
+                    nbytes = fetch(pool, url_of(sval, base_url), file_name, progress)
+                    progress.message('{}: Downloaded {} ({:.1f} MB)'.format(label, sval, nbytes * 1e-6))
+                    count('miss')
+                    other = dedup(download_dir, sval, out=_Messages(progress))
+                    if other is not None:
+                        progress.message('{}: {} is the same as {}; linked'.format(label, sval, other))
+                        count('dedup')
+                except IsDirectory:
+                    nfiles, nbytes, nsame = fetch_dir(pool, url_of(sval, base_url) + '/',
+                        file_name, progress, max_workers=max_workers)
+                    progress.message('{}: Downloaded directory {} ({} files, {:.1f} MB; {} unchanged)'.format(
+                        label, sval, nfiles, nbytes * 1e-6, nsame))
+                    count('miss')
+            progress.done()
+            return file_name
+        except Exception as e:
+            progress.message('{}: Failed to download {}: {}'.format(label, sval, e))
+            progress.failed()
+            return e
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = dict(zip(svals, executor.map(download1, svals)))
+    progress.finish()
+    out.write('Download cache {}: {} hits (downloaded by another process), {} misses ({} duplicates linked)\n'.format(
+        download_dir, counts['hit'], counts['miss'], counts['dedup']))
+    out.flush()
+    return results
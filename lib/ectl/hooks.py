@@ -0,0 +1,214 @@
+"""Runs setup hooks: functions named in the `setups` variable of a
+run's config/*.nc files, called at the end of `ectl setup` as
+fn(args_run, rd), in the run directory.
+
+A hook may declare what it reads and writes:
+
+    @ectl.hooks.declare(
+        inputs=lambda run, rd: [rd.params.files['TOPO'].rval],
+        outputs=['GIC'],
+        after=['ectl.xsetup.other.xsetup'])
+    def xsetup(args_run, rd): ...
+
+inputs, outputs:
+    Files (relative to the run directory), or a function of
+    (args_run, rd) returning them.
+after:
+    Dotted names of hooks that must run first.  A hook also runs after
+    any hook whose outputs are among its inputs.
+
+Declared hooks run concurrently in a process pool, as soon as the hooks
+they depend on are done.  A hook declaring both inputs and outputs is
+skipped if its inputs are unchanged (size, mtime) since it last ran
+and its outputs still exist.  Hooks declaring nothing keep the old
+behavior: they run one at a time, in order, after everything listed
+before them and before everything listed after.
+"""
+from __future__ import print_function
+import os
+import json
+import time
+import importlib
+import multiprocessing
+import concurrent.futures
+from giss import ioutil
+
+# Inputs of each hook when it last ran (in the run directory)
+HOOKS_STATE = '.setup_hooks.json'
+
+def declare(inputs=None, outputs=None, after=()):
+    """Decorator: declares what a setup hook reads, writes and needs
+    run first."""
+    def decorate(fn):
+        fn.hook_inputs = inputs
+        fn.hook_outputs = outputs
+        fn.hook_after = tuple(after)
+        return fn
+    return decorate
+
+def list_hooks(config_dir):
+    """Dotted names of the setup hooks declared in config/*.nc"""
+    import netCDF4    # Slow to import
+    names = list()
+    for fname in sorted(os.listdir(config_dir)):
+        if not fname.endswith('.nc'):
+            continue
+        with netCDF4.Dataset(os.path.join(config_dir, fname), 'r') as nc:
+            if 'setups' not in nc.variables:
+                continue
+            setups = nc.variables['setups']
+            for attr in setups.ncattrs():
+                names.append(getattr(setups, attr))
+    return names
+
+def get_fn(name):
+    path = name.split('.')
+    module = importlib.import_module('.'.join(path[:-1]))
+    return getattr(module, path[-1])
+
+def _files(decl, args_run, rd):
+    if decl is None:
+        return None
+    if callable(decl):
+        decl = decl(args_run, rd)
+    return [os.path.join(args_run, fname) for fname in decl]
+
+def _stat_key(fname):
+    try:
+        st = os.stat(fname)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+class Hook(object):
+    def __init__(self, name, args_run, rd):
+        self.name = name
+        fn = get_fn(name)
+        self.inputs = _files(getattr(fn, 'hook_inputs', None), args_run, rd)
+        self.outputs = _files(getattr(fn, 'hook_outputs', None), args_run, rd)
+        self.after = set(getattr(fn, 'hook_after', ()))
+        self.declared = (self.inputs is not None or self.outputs is not None
+            or hasattr(fn, 'hook_after'))
+
+    def stamp(self):
+        """What the hook's result depends on; None if not declared."""
+        if self.inputs is None or self.outputs is None:
+            return None
+        return [[fname, _stat_key(fname)] for fname in self.inputs]
+
+    def up_to_date(self, old_stamp):
+        stamp = self.stamp()
+        return stamp is not None and stamp == old_stamp \
+            and all(os.path.exists(fname) for fname in self.outputs)
+
+def dependencies(hooks):
+    """Returns {name: set(names of hooks that must run first)}"""
+    deps = dict((hook.name, set()) for hook in hooks)
+    for i,hook in enumerate(hooks):
+        for j,other in enumerate(hooks):
+            if i == j:
+                continue
+            if other.name in hook.after:
+                deps[hook.name].add(other.name)
+            elif hook.inputs is not None and other.outputs is not None \
+                and len(set(hook.inputs) & set(other.outputs)) > 0:
+                deps[hook.name].add(other.name)
+            elif (j < i) and not (hook.declared and other.declared):
+                # Undeclared hooks are barriers, in listed order
+                deps[hook.name].add(other.name)
+    return deps
+
+def _run_hook(name, args_run, rd):
+    """Runs one hook (in a worker process).  Returns: seconds taken"""
+    t0 = time.time()
+    with ioutil.pushd(args_run):
+        get_fn(name)(args_run, rd)
+    return time.time() - t0
+
+def _read_state(args_run):
+    try:
+        with open(os.path.join(args_run, HOOKS_STATE), 'r') as fin:
+            return json.load(fin)
+    except (IOError, ValueError):
+        return dict()
+
+def _write_state(args_run, state):
+    with ioutil.AtomicOverwrite(os.path.join(args_run, HOOKS_STATE)) as fout:
+        json.dump(state, fout.out, indent=1)
+        fout.commit()
+
+def run_hooks(names, args_run, rd, procs=None):
+    """Runs setup hooks, concurrently where their declarations allow.
+    names: [str]
+        Dotted names of the hook functions, in the order listed.
+    procs:
+        Most hooks to run at once (default: number of CPUs)."""
+    hooks = list()
+    for name in names:
+        if name not in (hook.name for hook in hooks):
+            hooks.append(Hook(name, args_run, rd))
+    if len(hooks) == 0:
+        return
+    deps = dependencies(hooks)
+    by_name = dict((hook.name, hook) for hook in hooks)
+    state = _read_state(args_run)
+
+    # Daemonic processes (eg: `ectl sweep` workers) cannot have children
+    procs = procs or multiprocessing.cpu_count()
+    if multiprocessing.current_process().daemon:
+        procs = 1
+
+    pending = [hook.name for hook in hooks]
+    done = set()
+    running = dict()    # future --> name
+    if procs > 1:
+        pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=min(procs, len(hooks)),
+            mp_context=multiprocessing.get_context('fork'))
+    else:
+        pool = _Serial()
+    with pool:
+        while len(pending) > 0 or len(running) > 0:
+            # Start (or skip) every hook whose dependencies are done;
+            # skipping one can make others ready.
+            ready = [name for name in pending if deps[name] <= done]
+            while len(ready) > 0:
+                for name in ready:
+                    pending.remove(name)
+                    if by_name[name].up_to_date(state.get(name)):
+                        print('Setup hook {}: inputs unchanged; skipped'.format(name))
+                        done.add(name)
+                    else:
+                        running[pool.submit(_run_hook, name, args_run, rd)] = name
+                ready = [name for name in pending if deps[name] <= done]
+
+            if len(running) == 0:
+                if len(pending) > 0:
+                    raise ValueError('Setup hooks have circular dependencies: {}'.format(pending))
+                break
+
+            finished, _ = concurrent.futures.wait(running,
+                return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                seconds = future.result()    # Re-raises the hook's exception
+                print('Setup hook {}: {:.1f}s'.format(name, seconds))
+                done.add(name)
+                stamp = by_name[name].stamp()
+                if stamp is not None:
+                    state[name] = stamp
+                    _write_state(args_run, state)
+
+class _Serial(object):
+    """Stands in for a process pool: runs each job when submitted."""
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        return False
+    def submit(self, fn, *args):
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
@@ -0,0 +1,78 @@
+"""A GNU make jobserver shared by several independent `make` processes.
+
+GNU make coordinates its sub-makes through a pipe holding one token per
+job slot.  Here we create that pipe ourselves and hand it to every make
+we start (through MAKEFLAGS), so all of them together run at most
+`njobs` jobs at once.
+
+Each make process also runs one job without taking a token, so the
+caller must hold a slot() while it runs make.
+
+GNU make 4.2 and later take the pipe as --jobserver-auth=R,W; older
+versions (back to 3.78) as --jobserver-fds=R,W.  Any other make would
+ignore the option and see only the bare -j, ie: unlimited jobs; so it
+is refused.
+"""
+import os
+import re
+import subprocess
+import contextlib
+
+versionRE = re.compile(r'GNU Make (\d+)\.(\d+)')
+
+def make_version(make='make'):
+    """Returns: (major, minor) version of GNU make, or None if make is
+    not GNU make (or cannot be run)."""
+    try:
+        out = subprocess.check_output([make, '--version'], stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    match = versionRE.search(out.decode(errors='replace'))
+    if match is None:
+        return None
+    return (int(match.group(1)), int(match.group(2)))
+
+def jobserver_option(version):
+    """The MAKEFLAGS option that hands a jobserver to this version of make"""
+    if version is None or version < (3, 78):
+        raise ValueError('A shared jobserver needs GNU make 3.78 or later (found %s)' %
+            ('no GNU make' if version is None else '%d.%d' % version))
+    return '--jobserver-auth' if version >= (4, 2) else '--jobserver-fds'
+
+class JobServer(object):
+    def __init__(self, njobs, make='make'):
+        if njobs < 1:
+            raise ValueError('A jobserver needs at least one job slot')
+        self.option = jobserver_option(make_version(make))
+        self.njobs = njobs
+        self.rfd, self.wfd = os.pipe()
+        for fd in self.fds:
+            os.set_inheritable(fd, True)
+        os.write(self.wfd, b'+' * njobs)
+
+    @property
+    def fds(self):
+        return (self.rfd, self.wfd)
+
+    def makeflags(self):
+        # No job count: an explicit -jN makes make ignore the jobserver
+        return '-j %s=%d,%d' % ((self.option,) + self.fds)
+
+    def env(self, env=None):
+        """Environment for running make under this jobserver."""
+        env = dict(os.environ if env is None else env)
+        env['MAKEFLAGS'] = self.makeflags()
+        return env
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Holds one job slot: the one make uses without a token."""
+        token = os.read(self.rfd, 1)
+        try:
+            yield
+        finally:
+            os.write(self.wfd, token)
+
+    def close(self):
+        os.close(self.rfd)
+        os.close(self.wfd)
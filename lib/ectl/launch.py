@@ -2,7 +2,7 @@ from __future__ import print_function
 import copy
 import os
 import re
-from ectl import pathutil,rundeck,rundir,xhash,launchers,mpivendors
+from ectl import pathutil,rundeck,rundir,xhash,launchers,mpivendors,probecache
 import ectl.cdlparams
 import sys
 from spack.util import executable
@@ -12,7 +12,6 @@ import ectl.util
 import shutil
 from ectl import iso8601
 import datetime
-import netCDF4
 import collections
 import math
 import traceback
@@ -40,6 +39,8 @@ def setup_parser(subparser):
 
     subparser.add_argument('--resume', '-r', action='store_true', dest='resume', default=False,
         help='Resume a run; do not look at rundeck.R, just resume same as last I file.')
+    subparser.add_argument('--reprobe', action='store_true', dest='reprobe', default=False,
+        help='Forget cached MPI vendor and ldd checks; probe the system again.')
 # --------------------------------------------------------------------
 def parse_date(str):
     if len(str) == 0:
@@ -50,6 +51,7 @@ def parse_date(str):
 # ---------------------------------------------------
 def rsf_type(rsf):
     """Determines whether a restart file is a .rsf or fort.X.nc file."""
+    import netCDF4    # Slow to import
 
     with netCDF4.Dataset(rsf, 'r') as nc:
         # This is only the case when using Lynch-Stieglitz landice
@@ -109,6 +111,9 @@ def run(args, cmd):
         else:
             raise ValueError('Invalid timespan %s' % args.timespan)
 
+    if getattr(args, 'reprobe', False):
+        probecache.clear()
+
     # ------ Parse Arguments
     # Launcher to use
     kwargs = dict()
@@ -295,6 +300,7 @@ def launch(run, launcher=None, force=False, ntasks=None, time=None, rundeck_modi
         print('First checkpoint file will be fort.{}.nc'.format(kdisk))
     else:
         print('***** Warm Start')
+        import netCDF4    # Slow to import
         with netCDF4.Dataset(rsf, 'r') as nc:
             itime = nc.variables['itime'][:]
             print('Restarting from {} (itime={}).'.format(rsf, itime))
@@ -321,8 +327,12 @@ def launch(run, launcher=None, force=False, ntasks=None, time=None, rundeck_modi
             config_dir = os.path.join(paths.run, 'config')
             rd = rundeck.load(os.path.join(config_dir, 'rundeck.R'), modele_root=paths.src)
             download_dir=ectl.paths.default_file[0]
+            workspace = ectl.config.Config(run=paths.run).workspace
+            file_path = ectl.paths.default_file if workspace is None else \
+                pathutil.PathIndex(ectl.paths.default_file,
+                    index_file=pathutil.index_fname(workspace))
             with ioutil.pushd(paths.run):
-                rd.params.files.resolve(file_path=ectl.paths.default_file,
+                rd.params.files.resolve(file_path=file_path,
                     download_dir=download_dir)
 
             # Copy stuff from INPUTZ_cold to INPUTZ if this is a cold start.
@@ -343,7 +353,8 @@ def launch(run, launcher=None, force=False, ntasks=None, time=None, rundeck_modi
 
                 # Convert .cdl files to .nc
                 # (while getting absolute path of files)
-                cdl_files_good = ectl.cdlparams.resolve_cdls_in_dir('.', download_dir=download_dir)
+                cdl_files_good = ectl.cdlparams.resolve_cdls_in_dir('.',
+                    download_dir=download_dir, search_path=file_path)
 
         # Set ISTART and restart file in I file
         rd.params.inputz.set('ISTART', str(start_type))
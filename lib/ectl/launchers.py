@@ -7,12 +7,11 @@ import string
 import tempfile
 import filecmp
 import shutil
-from ectl import pathutil
+from ectl import pathutil,probecache
 import ectl.config
 import copy
 import subprocess
 import signal
-from six import StringIO
 import time
 import ectl.util
 import spack.util.executable
@@ -38,28 +37,34 @@ class ExitReason(object):
 
 
 # --------------------------------------------------------
-# http://stackoverflow.com/questions/12902008/python-how-to-find-out-whether-hyperthreading-is-enabled
-cpusRE = re.compile(r'CPU\(s\):\s*(.*)')
-threadsRE = re.compile(r'Thread\(s\) per core:\s*(.*)')
-def detect_ncores():
-    buf = StringIO()
-    p = subprocess.Popen('lscpu', stdout=subprocess.PIPE)
-    output = p.stdout.read()
-    p.wait()
-    for line in output.split(b'\n'):
-        line = line.decode()
-        match = cpusRE.match(line)
-        if match is not None:
-            cpus = int(match.group(1))
-        else:
-            match = threadsRE.match(line)
-            if match is not None:
-                threads = int(match.group(1))
-    return cpus // threads
+def detect_ncores(cpus=None, sysfs='/sys/devices/system/cpu'):
+    """Counts the physical cores (not hyperthreads) this process may run on.
+    cpus:
+        CPUs (logical) to consider; default: this process's affinity"""
+    if cpus is None:
+        cpus = os.sched_getaffinity(0)
+
+    cores = set()
+    for cpu in cpus:
+        topology = os.path.join(sysfs, 'cpu%d' % cpu, 'topology')
+        try:
+            with open(os.path.join(topology, 'physical_package_id')) as fin:
+                package = fin.read().strip()
+            with open(os.path.join(topology, 'core_id')) as fin:
+                core = fin.read().strip()
+        except IOError:
+            # No topology info; count every logical CPU as a core
+            package,core = ('cpu', cpu)
+        cores.add((package, core))
+    return len(cores)
 # --------------------------------------------------------
 notFoundRE = re.compile(r'.*?=>\s+not found.*')
 def check_ldd(exe_fname):
-    """Using ldd, checks that a binary can load."""
+    """Using ldd, checks that a binary can load.
+    A successful check is cached until the binary (or the environment) changes."""
+    probecache.cached('ldd', [exe_fname], lambda: _check_ldd(exe_fname) or True)
+
+def _check_ldd(exe_fname):
 
     errors = list()
 
@@ -5,6 +5,7 @@ import math
 import sys
 import spack.util.executable
 from giss import ioutil
+from ectl import probecache
 
 class MPIVendor(object):
     """Superclass for MPI vendors"""
@@ -142,9 +143,17 @@ def construct_mpi_vendor(vendor, version):
 
 
 def mpi_vendor():
-    """Constructs an MPIVendor instance by poking around the system."""
+    """Constructs an MPIVendor instance by poking around the system.
+    The answer is cached, as long as the same mpirun is found."""
 
-    """Returns a tuple (MPIVendor, Version)"""
+    mpirun = spack.util.executable.which('mpirun')
+    exes = [] if mpirun is None else [mpirun.command]
+    vendor,version = probecache.cached('mpi_vendor', exes, probe_mpi_vendor)
+    return construct_mpi_vendor(vendor, tuple(version))
+
+def probe_mpi_vendor():
+    """Runs `mpirun -version` to determine the MPI vendor.
+    Returns: (vendor, version)"""
     proc = subprocess.Popen(['mpirun', '-version'],
         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     (sout, serr) = proc.communicate()
@@ -165,7 +174,7 @@ def mpi_vendor():
         version = (int(match.group(6)), int(match.group(7)), int(match.group(8)))
     else:
         raise RuntimeError("Cannot construct MPIVendor, don't know why")
-    return construct_mpi_vendor(vendor,version)
+    return vendor,version
 
 def read_mpi_vendor(logdir):
     """Constructs an MPIVendor instance by reading record from a log directory."""
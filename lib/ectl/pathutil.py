@@ -2,121 +2,245 @@ from __future__ import print_function
 import os
 import re
 import sys
-import urllib.request
-import subprocess
-import shutil
+import time
+import collections
+import json
 from giss import ioutil
 
+# Listings of directories on search paths, kept for the life of the
+# process (and between processes, in an index file if one is given to
+# PathIndex): {dir: (stat_key, {name: is_symlink})}
+_listings = dict()
+
+# Listings made this soon (seconds) after their directory changed are
+# not kept: it could change again within the same mtime tick.
+RACY_SECONDS = 2.
+
+# Downloaded files that matched their checksum sidecar, as
+# {fname: stat_key}: trusted on one stat() while unchanged, without
+# reading the sidecar.  Kept in the index file too, under VERIFIED.
+_verified = dict()
+VERIFIED = '.verified'    # (Not a directory name)
+
+def _listing(dir):
+    """Returns {name: is_symlink} for a directory (empty if it does
+    not exist).  Costs one stat() if the directory is unchanged since
+    it was last listed."""
+    try:
+        st = os.stat(dir)
+    except OSError:
+        _listings.pop(dir, None)
+        return dict()
+    stat_key = (st.st_mtime_ns, st.st_ino)
+
+    cached = _listings.get(dir)
+    if cached is not None and cached[0] == stat_key:
+        return cached[1]
+
+    try:
+        with os.scandir(dir) as entries:
+            listing = dict((entry.name, entry.is_symlink()) for entry in entries)
+    except OSError:
+        return dict()
+    if time.time() - st.st_mtime > RACY_SECONDS:
+        _listings[dir] = (stat_key, listing)
+    else:
+        _listings.pop(dir, None)
+    return listing
+
+def index_fname(workspace):
+    """Name of the file-path index, stored in the ectl workspace."""
+    return os.path.join(workspace, 'file_path_index.json')
+
+def _load_listings(index_file):
+    """Adds listings saved by an earlier process to this one's.
+    Returns: {dir: [stat_key, listing]} as read"""
+    try:
+        with open(index_file, 'r') as fin:
+            saved = json.load(fin)
+    except (IOError, ValueError):
+        return dict()
+    for fname,stat_key in saved.get(VERIFIED, {}).items():
+        _verified.setdefault(fname, stat_key)
+    for dir,value in saved.items():
+        if dir != VERIFIED and dir not in _listings:
+            stat_key, listing = value
+            _listings[dir] = (tuple(stat_key), listing)
+    return saved
+
+def _save_listings(index_file, saved, dirs):
+    """Saves listings of dirs (and _verified), if they changed since
+    they were read."""
+    changed = False
+    if saved.get(VERIFIED, {}) != _verified:
+        saved[VERIFIED] = dict(_verified)
+        changed = True
+    for dir in dirs:
+        cached = _listings.get(dir)
+        if cached is None:
+            changed = changed or saved.pop(dir, None) is not None
+        elif saved.get(dir) != [list(cached[0]), cached[1]]:
+            saved[dir] = [list(cached[0]), cached[1]]
+            changed = True
+    if not changed:
+        return
+    try:
+        with ioutil.AtomicOverwrite(index_file) as fout:
+            json.dump(saved, fout.out)
+            fout.commit()
+    except (IOError, OSError):
+        pass    # Read-only workspace: the index is only an optimization
+
+class PathIndex(object):
+    """A search path, indexed so plain file names can be looked up
+    without probing every directory.  Directories are read (or
+    validated against their mtime) once, when the index is made; so
+    make a new one for each batch of lookups, or refresh() it.
+
+    index_file:
+        Where to keep listings between processes (see index_fname()).
+        With an up-to-date index file, indexing costs one stat() per
+        directory."""
+
+    def __init__(self, search_path, index_file=None):
+        self.search_path = [os.path.abspath(path) for path in search_path]
+        self.index_file = index_file
+        self.refresh()
+
+    def refresh(self):
+        """Re-reads directories that changed (eg: after downloads)."""
+        if self.index_file is None:
+            self.listings = [_listing(path) for path in self.search_path]
+            return
+        self.saved = _load_listings(self.index_file)
+        self.listings = [_listing(path) for path in self.search_path]
+        self.save()
+
+    def save(self):
+        """Saves the index file (eg: after is_corrupt_download())."""
+        if self.index_file is not None:
+            _save_listings(self.index_file, self.saved, self.search_path)
+
+    def __iter__(self):
+        return iter(self.search_path)
+
+    def find(self, filename):
+        """Returns the absolute name of the first file on the path
+        called filename, or None."""
+        if os.sep in filename:
+            # Not a plain name; probe as before
+            for path in self.search_path:
+                fname = os.path.abspath(os.path.join(path, filename))
+                if os.path.exists(fname):
+                    return fname
+            return None
+
+        for path,listing in zip(self.search_path, self.listings):
+            is_symlink = listing.get(filename)
+            if is_symlink is None:
+                continue
+            fname = os.path.join(path, filename)
+            # Dangling symlinks don't count
+            if not is_symlink or os.path.exists(fname):
+                return fname
+        return None
+
 # http://code.activestate.com/recipes/52224-find-a-file-given-a-search-path/
 def search_file(filename, search_path):
     """Given a search path, find file
+    search_path: [dir] or PathIndex
     """
     if os.path.exists(filename):
         return os.path.abspath(filename)
 
-    for path in search_path:
-        fname = os.path.abspath(os.path.join(path, filename))
-        if os.path.exists(fname):
-            return fname
-    raise IOError('File not found in search path: {0}'.format(filename))
+    if not isinstance(search_path, PathIndex):
+        search_path = PathIndex(search_path)
+    fname = search_path.find(filename)
+    if fname is None:
+        raise IOError('File not found in search path: {0}'.format(filename))
+    return fname
 
 # ------------------------------------------
 def download_file(sval, download_dir, label=''):
-    # Try to download the file
-    # http://stackoverflow.com/questions/22676/how-do-i-download-a-file-over-http-using-python
-    file_name = os.path.join(download_dir, sval)
-    tmp_file_name = file_name + '.tmp'
-    url = 'https://portal.nccs.nasa.gov/GISS_modelE/modelE_input_data/' + sval
-
-    try:
-        # Make sure output directory exists
-        try:
-            os.makedirs(os.path.split(file_name)[0])
-        except:
-            pass
-
-        with open(tmp_file_name, 'wb') as fout:
-            u = urllib.request.urlopen(url)
-            meta = u.info()
-            file_size = int(meta['Content-Length'])
-            print('{}: Downloading1 [{} bytes] {}'.format(label, file_size, sval))
-
-            file_size_dl = 0
-            block_sz = 8192
-            while True:
-                buffer = u.read(block_sz)
-                if not buffer:
-                    print()
-                    break
-
-                file_size_dl += len(buffer)
-                fout.write(buffer)
-                status = r"%10d  [%3.2f%%]" % (file_size_dl, file_size_dl * 100. / file_size)
-                status = status + chr(8)*(len(status))
-                print(status, end='')
-                sys.stdout.flush()
-
-        # Downloaded the file OK; now put in final place
-        os.rename(tmp_file_name, file_name)
-
-        return file_name
-    except:
-        try:
-            os.remove(tmp_file_name)
-        except:
-            pass
-        raise
-
-def download_file_curl(sval, download_dir, label=''):
-    # Try to download the file
-    # http://stackoverflow.com/questions/22676/how-do-i-download-a-file-over-http-using-python
-    file_name = os.path.join(download_dir, sval)
-    url = 'https://portal.nccs.nasa.gov/GISS_modelE/modelE_input_data/' + sval
-
-    # Make sure output directory exists
-    try:
-        os.makedirs(os.path.split(file_name)[0])
-    except:
-        pass
-
-    print('{}: Downloading2 {}'.format(label, sval))
-    cmd = ['curl', '--fail', '--output', file_name, url]
-    subprocess.check_call(cmd)
-    return file_name
-
-def download_dir_wget(sval, download_dir, label=''):
-
-    file_name = os.path.join(download_dir, sval)
-    url = 'https://portal.nccs.nasa.gov/GISS_modelE/modelE_input_data/{}/'.format(sval)
-
-    print('{}: Downloading3 {}'.format(label, sval))
-    tmpdir_name = os.path.join(download_dir, sval + '_tmp')
-    shutil.rmtree(tmpdir_name, ignore_errors=True)
-    os.makedirs(tmpdir_name)
-    with ioutil.pushd(tmpdir_name):
-        cmd = ['wget', '--no-parent', '-r', url]
-        subprocess.check_call(cmd)
-
-    # Now copy (move) the downloaded files out of temporary location
-    src_dir = os.path.join(tmpdir_name, 'portal.nccs.nasa.gov', 'GISS_modelE', 'modelE_input_data', sval)
-    dest_dir = os.path.join(download_dir, sval)
-    os.rename(src_dir, dest_dir)
-    shutil.rmtree(tmpdir_name, ignore_errors=True)
-    return dest_dir
+    """Downloads one input file (see ectl.download)"""
+    from ectl import download
+    result = download.download_files([sval], download_dir, labels={sval: label})[sval]
+    if isinstance(result, Exception):
+        raise result
+    return result
 
 def download_file_or_dir(sval, download_dir, label=''):
-    fname = download_file_curl(sval, download_dir, label=label)
-    
-    with open(fname, 'r') as fin:
-        head = fin.read(400)
-    if '301 Moved Permanently' in head:
-        os.remove(fname)
-        fname = download_dir_wget(sval, download_dir, label=label)
-    return fname
+    # Some ModelE symlinks are entire directories of stuff;
+    # download_file() recognizes them.
+    return download_file(sval, download_dir, label=label)
 
 
-def search_or_download_file(param_name, file_name, search_path, download_dir=None):
+def _is_corrupt_download(fname, download_dir):
+    """Checks a file we downloaded earlier against its checksum sidecar.
+    The sidecar is read only if the directory listing shows one, and
+    the file changed since it last matched (see _verified)."""
+    from ectl import download
     download_dir = os.path.abspath(download_dir)
+    if not fname.startswith(download_dir + os.sep):
+        return False
+    dir,leaf = os.path.split(fname)
+    if leaf + download.SIDECAR not in _listing(dir):
+        return False    # Not downloaded by ectl; or a directory
+    try:
+        stat_key = download._stat_key(fname)
+    except OSError:
+        return False
+    if _verified.get(fname) == stat_key:
+        return False
+    if not download.check_file(fname):
+        _verified.pop(fname, None)
+        return True
+    _verified[fname] = stat_key
+    return False
+
+def search_or_download_files(files, search_path, download_dir=None):
+    """Finds files on a search path; missing files are downloaded
+    together (see ectl.download), rather than one at a time.
+    files: [(param_name, file_name)]
+    search_path: [dir] or PathIndex
+    Returns: {file_name: absolute name, or the Exception resolving it}"""
+    if not isinstance(search_path, PathIndex):
+        search_path = PathIndex(search_path)
+
+    results = dict()
+    missing = collections.OrderedDict()    # file_name --> param_name
+    for param_name, file_name in files:
+        if file_name in results or file_name in missing:
+            continue
+        try:
+            fname = search_file(file_name, search_path)
+            if download_dir is not None and _is_corrupt_download(fname, download_dir):
+                sys.stderr.write('{0}: {1} does not match its checksum; downloading again\n'.format(param_name, fname))
+                missing[file_name] = param_name
+            else:
+                results[file_name] = fname
+        except IOError as e:
+            if download_dir is None:
+                # We can't download, just report an error.
+                sys.stderr.write('{0}: {1}\n'.format(param_name, e))
+                results[file_name] = e
+            else:
+                missing[file_name] = param_name
+
+    search_path.save()    # Files newly verified
+
+    if len(missing) > 0:
+        from ectl import download
+        results.update(download.download_files(list(missing.keys()),
+            os.path.abspath(download_dir), labels=missing))
+        # Later lookups see the new files
+        search_path.refresh()
+    return results
+
+def search_or_download_file(param_name, file_name, search_path, download_dir=None):
+    """search_path: [dir] or PathIndex"""
+    if download_dir is not None:
+        download_dir = os.path.abspath(download_dir)
 
     try:
         return search_file(file_name, search_path)
@@ -128,7 +252,6 @@ def search_or_download_file(param_name, file_name, search_path, download_dir=Non
         else:
             # Could not resolve path; download it
             try:
-                #return download_file_curl(file_name, download_dir, label=param_name)
                 # Some ModelE symlinks are entire directories of stuff
                 return download_file_or_dir(file_name, download_dir, label=param_name)
             except KeyboardInterrupt as e2:
@@ -192,6 +315,14 @@ def follow_link(linkname, must_exist=False):
     return fname
 
 
+def read_link(linkname):
+    """Finds what a link points to, following only one level of links."""
+    if not os.path.islink(linkname):
+        return None
+    return os.path.abspath(os.path.join(
+        os.path.dirname(linkname), os.readlink(linkname)))
+
+
 class ChangePythonPath(object):
     """Context manager that temporarily changes sys.path"""
     def __init__(self, new_path):
@@ -0,0 +1,332 @@
+"""A content-addressed pkg store, shared between ectl roots.
+
+Layout of a store directory:
+    pkgs/<pkghash>/      Installed pkgs, named by pkg hash
+    objects/xx/<md5>     One hardlink per distinct file content
+    roots.txt            ectl roots that have linked pkgs from this store
+    store.lock           Shared by link() and dedup(); exclusive for gc()
+    locks/<pkghash>.lock Held while a pkg is being installed
+
+Each ectl root links <workspace>/pkgs/<pkghash> -> <store>/pkgs/<pkghash>.
+Identical files in different pkgs are hardlinked to the same object, so
+they take space only once.  Reference counts come from the `pkg`
+symlinks of run directories in the registered roots, and from the pkgs
+`ectl prebuild` has built ahead of time for them (not yet linked from
+any run; see ectl.prebuild).
+
+gc() leaves alone pkgs being installed, and pkgs linked or installed
+within the last GC_GRACE seconds: `ectl setup` links a pkg from the
+store before it builds it, and links it from the run only after.
+"""
+from __future__ import print_function
+import os
+import time
+import shutil
+import threading
+import collections
+from contextlib import contextmanager
+import llnl.util.lock
+import ectl.buildlock
+from ectl import srcdir
+
+# Unreferenced pkgs younger than this (seconds) are not collected
+GC_GRACE = 6 * 3600.
+
+# Seconds between tries for the store lock
+POLL_INTERVAL = 1.
+
+# Threads of a process share its fcntl locks (and closing any
+# descriptor of a lock file releases them all); so each process takes
+# the shared store lock once, for all its threads:
+# {lockfile: [llnl.util.lock.Lock, number of holders]}
+_shared_locks = dict()
+_shared_locks_guard = threading.Lock()
+
+def _touch(fname):
+    if not os.path.exists(fname):
+        try:
+            os.makedirs(os.path.dirname(fname))
+        except OSError:
+            pass
+        with open(fname, 'a'):
+            pass
+
+def _acquire(lock, write, what):
+    """Waits for a lock.  (Short timeouts: llnl.util.lock busy-waits)"""
+    waited = False
+    while True:
+        try:
+            if write:
+                lock.acquire_write(timeout=.05)
+            else:
+                lock.acquire_read(timeout=.05)
+            return
+        except llnl.util.lock.LockError:
+            pass
+        if not waited:
+            print('Waiting for %s...' % what)
+            waited = True
+        time.sleep(POLL_INTERVAL)
+
+class PkgStore(object):
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.pkgs = os.path.join(self.root, 'pkgs')
+        self.objects = os.path.join(self.root, 'objects')
+        self.roots_txt = os.path.join(self.root, 'roots.txt')
+
+    def pkg_dir(self, pkg_hash):
+        return os.path.join(self.pkgs, pkg_hash)
+
+    def pkg_lockfile(self, pkg_hash):
+        return os.path.join(self.root, 'locks', pkg_hash + '.lock')
+
+    # ---------------------------------------------------------
+    @contextmanager
+    def shared(self):
+        """Keeps gc() from running (eg: while linking a pkg)."""
+        lockfile = os.path.join(self.root, 'store.lock')
+        with _shared_locks_guard:
+            held = _shared_locks.get(lockfile)
+            if held is None:
+                _touch(lockfile)
+                lock = llnl.util.lock.Lock(lockfile)
+                _acquire(lock, False, 'pkgstore gc to finish')
+                held = _shared_locks[lockfile] = [lock, 0]
+            held[1] += 1
+        try:
+            yield
+        finally:
+            with _shared_locks_guard:
+                held[1] -= 1
+                if held[1] == 0:
+                    del _shared_locks[lockfile]
+                    held[0].release_read()
+
+    @contextmanager
+    def exclusive(self):
+        """Waits for link() and dedup() to finish, and keeps them out."""
+        lockfile = os.path.join(self.root, 'store.lock')
+        _touch(lockfile)
+        lock = llnl.util.lock.Lock(lockfile)
+        _acquire(lock, True, 'pkgstore users to finish')
+        try:
+            yield
+        finally:
+            lock.release_write()
+
+    @contextmanager
+    def pkg_lock(self, pkg_hash):
+        """Held while installing a pkg, so gc() leaves it alone.  The
+        grace period starts again when it is released."""
+        with ectl.buildlock.BuildLock(self.pkg_lockfile(pkg_hash),
+            what='install of pkg %s' % pkg_hash):
+            try:
+                yield
+            finally:
+                if os.path.isdir(self.pkg_dir(pkg_hash)):
+                    os.utime(self.pkg_dir(pkg_hash))
+
+    # ---------------------------------------------------------
+    def roots(self):
+        """ectl roots using this store."""
+        if not os.path.exists(self.roots_txt):
+            return []
+        with open(self.roots_txt, 'r') as fin:
+            return [line.strip() for line in fin if len(line.strip()) > 0]
+
+    def add_root(self, ectl_root):
+        """Registers an ectl root as a user of this store."""
+        ectl_root = os.path.realpath(ectl_root)
+        if ectl_root in self.roots():
+            return
+
+        lockfile = self.roots_txt + '.lock'
+        if not os.path.exists(lockfile):
+            with open(lockfile, 'w'):
+                pass
+        lock = llnl.util.lock.Lock(lockfile)
+        lock.acquire_write()
+        try:
+            if ectl_root not in self.roots():
+                with open(self.roots_txt, 'a') as out:
+                    out.write(ectl_root + '\n')
+        finally:
+            lock.release_write()
+
+    # ---------------------------------------------------------
+    def link(self, pkg_hash, local_pkg, ectl_root=None):
+        """Points a root's <pkgs>/<pkghash> at this store.
+        An existing (incomplete) local pkg directory is replaced.
+
+        Returns: The store's pkg directory; install into it."""
+        with self.shared():
+            return self._link(pkg_hash, local_pkg, ectl_root)
+
+    def _link(self, pkg_hash, local_pkg, ectl_root):
+        store_pkg = self.pkg_dir(pkg_hash)
+        try:
+            os.makedirs(store_pkg)
+        except OSError:
+            pass
+        os.utime(store_pkg)    # Starts its grace period (see gc())
+        if ectl_root is not None:
+            self.add_root(ectl_root)
+
+        if os.path.islink(local_pkg):
+            if os.path.realpath(local_pkg) == os.path.realpath(store_pkg):
+                return store_pkg
+            os.remove(local_pkg)
+        elif os.path.isdir(local_pkg):
+            shutil.rmtree(local_pkg)
+        else:
+            try:
+                os.makedirs(os.path.dirname(local_pkg))
+            except OSError:
+                pass
+
+        print('Linking pkg from store: %s' % store_pkg)
+        os.symlink(store_pkg, local_pkg)
+        return store_pkg
+
+    # ---------------------------------------------------------
+    def dedup(self, pkg_hash):
+        """Replaces files in a pkg with hardlinks to identical files
+        already in the store.
+        Returns: (nfiles, nlinked, bytes_saved)"""
+        with self.shared():
+            return self._dedup(pkg_hash)
+
+    def _dedup(self, pkg_hash):
+        nfiles = 0
+        nlinked = 0
+        saved = 0
+        for root, dirs, files in os.walk(self.pkg_dir(pkg_hash)):
+            for file in files:
+                fname = os.path.join(root, file)
+                if os.path.islink(fname) or file.endswith('.dedup'):
+                    continue
+                nfiles += 1
+
+                digest = srcdir.file_digest(fname)
+                obj = os.path.join(self.objects, digest[:2], digest)
+                if not os.path.exists(obj):
+                    try:
+                        os.makedirs(os.path.dirname(obj))
+                    except OSError:
+                        pass
+                    try:
+                        os.link(fname, obj)
+                        continue
+                    except FileExistsError:
+                        pass    # Another pkg being deduped stored it first
+
+                st = os.stat(fname)
+                if os.path.samefile(fname, obj):
+                    continue
+
+                # Swap in the shared copy atomically
+                # (after removing any tmp left by a killed run)
+                tmp = fname + '.dedup'
+                try:
+                    os.remove(tmp)
+                except FileNotFoundError:
+                    pass
+                os.link(obj, tmp)
+                os.rename(tmp, fname)
+                nlinked += 1
+                saved += st.st_size
+
+        print('Deduplicated %d of %d files in %s (%d bytes saved)' %
+            (nlinked, nfiles, pkg_hash, saved))
+        return nfiles, nlinked, saved
+
+    def unshare(self, pkg_hash):
+        """Gives a pkg private copies of its hardlinked files, so a
+        re-install cannot modify files shared with other pkgs."""
+        for root, dirs, files in os.walk(self.pkg_dir(pkg_hash)):
+            for file in files:
+                fname = os.path.join(root, file)
+                if os.path.islink(fname) or os.stat(fname).st_nlink <= 1:
+                    continue
+                tmp = fname + '.unshare'
+                shutil.copy2(fname, tmp)
+                os.rename(tmp, fname)
+
+    # ---------------------------------------------------------
+    def refcounts(self):
+        """Counts the run directories (in all registered roots) whose
+        `pkg` symlink leads to each pkg in the store; and the prebuilt
+        pkgs of those roots (which no run links yet).
+        Returns: {pkghash : count}"""
+        from ectl import prebuild
+
+        counts = collections.OrderedDict(
+            (pkg_hash, 0) for pkg_hash in sorted(os.listdir(self.pkgs))) \
+            if os.path.isdir(self.pkgs) else collections.OrderedDict()
+
+        prefix = os.path.realpath(self.pkgs) + os.sep
+        for ectl_root in self.roots():
+            for root, dirs, files in os.walk(ectl_root):
+                # Don't descend into the workspace (builds, pkgs, etc)
+                if 'ectl.conf' in files and 'ectl' in dirs:
+                    dirs.remove('ectl')
+                pkg = os.path.join(root, 'pkg')
+                if 'pkg' in dirs + files and os.path.islink(pkg):
+                    target = os.path.realpath(pkg)
+                    if target.startswith(prefix):
+                        pkg_hash = target[len(prefix):].split(os.sep)[0]
+                        counts[pkg_hash] = counts.get(pkg_hash, 0) + 1
+                if 'pkg' in dirs:
+                    dirs.remove('pkg')    # os.walk lists dir symlinks in dirs
+
+            # Prebuilt for runs that will be set up with them
+            for pkg in prebuild.read_state(os.path.join(ectl_root, 'ectl')):
+                target = os.path.realpath(pkg)
+                if target.startswith(prefix):
+                    pkg_hash = target[len(prefix):].split(os.sep)[0]
+                    counts[pkg_hash] = counts.get(pkg_hash, 0) + 1
+        return counts
+
+    def gc(self, dry_run=False, grace=GC_GRACE):
+        """Removes pkgs no run refers to, then objects no pkg uses.
+        Pkgs being installed, or linked or installed within the last
+        `grace` seconds, are kept.
+        Returns: [pkghash removed]"""
+        removed = list()
+        with self.exclusive():
+            now = time.time()
+            for pkg_hash,count in self.refcounts().items():
+                if count > 0:
+                    continue
+                try:
+                    age = now - os.stat(self.pkg_dir(pkg_hash)).st_mtime
+                except OSError:
+                    continue
+                if age < grace:
+                    print('Keeping unreferenced pkg %s: only %.0f s old' % (pkg_hash, age))
+                    continue
+
+                lockfile = self.pkg_lockfile(pkg_hash)
+                _touch(lockfile)
+                lock = llnl.util.lock.Lock(lockfile)
+                try:
+                    lock.acquire_write(timeout=.05)
+                except llnl.util.lock.LockError:
+                    print('Keeping unreferenced pkg %s: being installed' % pkg_hash)
+                    continue
+                try:
+                    print('Removing unreferenced pkg %s' % pkg_hash)
+                    if not dry_run:
+                        shutil.rmtree(self.pkg_dir(pkg_hash))
+                    removed.append(pkg_hash)
+                finally:
+                    lock.release_write()
+
+            if not dry_run:
+                for root, dirs, files in os.walk(self.objects):
+                    for file in files:
+                        fname = os.path.join(root, file)
+                        if os.stat(fname).st_nlink <= 1:
+                            os.remove(fname)
+        return removed
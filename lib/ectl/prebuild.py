@@ -0,0 +1,335 @@
+"""Builds pkgs ahead of time, for runs whose source has changed.
+
+After pulling new ModelE source, the next `ectl setup` of each run
+would have to build a new pkg.  `ectl prebuild` looks at the runs in an
+ectl root that are set up but not finished, computes the pkg each would
+get from its source as it is now (the same pkghash() as `ectl setup`,
+of its rundeck.R merged with any upstream changes to its template),
+and builds any that are missing, at low priority.  A later `ectl setup`
+finds the pkg already built, and uses it.
+
+Run it once (eg: from cron), or with --watch to keep polling.  Only one
+prebuild runs per ectl root at a time.
+
+Prebuilt pkgs that no run uses yet are recorded in
+<workspace>/prebuild.json.  When they take more than the disk budget,
+the oldest are deleted.  A pkg that a run has since been set up with
+belongs to that run, and is no longer prebuild's to delete.
+"""
+from __future__ import print_function
+import os
+import json
+import hashlib
+import time
+import shutil
+import traceback
+import collections
+import concurrent.futures
+import llnl.util.lock
+import ectl.config
+import ectl.rundeck
+import ectl.setup
+import ectl.pkgstore
+from ectl import rundir, launchers, xhash, pathutil
+from ectl.rundeck import merge as rundeck_merge
+from spack.util import executable
+from giss import ioutil
+
+PREBUILD_STATE = 'prebuild.json'
+PREBUILD_LOCK = 'prebuild.lock'
+PREBUILD_RUNDECKS = 'prebuild-rundecks'    # Merged rundecks, by digest
+
+class Target(object):
+    """A pkg that some run would be set up with now."""
+    def __init__(self, run, rundeck_R, rd, src, build, pkg, pkg_hash):
+        self.runs = [run]
+        self.rundeck_R = rundeck_R    # Merged rundeck the pkg is built from
+        self.rd = rd
+        self.src = src
+        self.build = build
+        self.pkg = pkg
+        self.pkg_hash = pkg_hash
+
+def find_runs(top, workspace):
+    """Run directories under top (not looking inside the workspace, or
+    inside runs)."""
+    runs = list()
+    for dir, dirs, files in os.walk(top):
+        if os.path.exists(os.path.join(dir, 'config', 'rundeck.R')) \
+            and os.path.islink(os.path.join(dir, 'src')):
+            runs.append(dir)
+            dirs[:] = []
+            continue
+        dirs[:] = sorted(x for x in dirs
+            if not x.startswith('.') and os.path.join(dir, x) != workspace)
+    return runs
+
+def merged_rundeck(config, run, old, git):
+    """The rundeck.R that `ectl setup` would merge for a run now (see
+    ectl.setup.merge_rundeck()), written to a scratch file in the
+    workspace; the run's config/ is left alone.  The file is kept: CMake
+    remembers it as the rundeck of the build.
+    old: rundir.FollowLinks
+    Returns: name of the scratch file"""
+    config_dir = os.path.join(run, 'config')
+    with open(os.path.join(config_dir, 'rundeck.R'), 'r') as fin:
+        lines = fin.readlines()
+    if rundeck_merge.has_conflicts(lines):
+        raise ValueError('rundeck.R has unresolved conflicts')
+
+    if old.rundeck is not None:
+        rundeck_src = pathutil.modele_root(old.rundeck) or old.src
+        template_path = [os.path.join(rundeck_src, 'templates')]
+        _, merged, nconflicts = ectl.setup.merge_upstream(
+            config_dir, lines, old.rundeck, template_path, git)
+        if nconflicts > 0:
+            raise ValueError('Conflicts merging {0} into rundeck.R'.format(old.rundeck))
+        if merged is not None:
+            lines = merged
+
+    contents = ''.join(lines)
+    scratch_dir = os.path.join(config.workspace, PREBUILD_RUNDECKS)
+    fname = os.path.join(scratch_dir,
+        hashlib.md5(contents.encode()).hexdigest() + '.R')
+    if not os.path.exists(fname):
+        try:
+            os.makedirs(scratch_dir)
+        except OSError:
+            pass
+        with ioutil.AtomicOverwrite(fname) as fout:
+            fout.out.write(contents)
+            fout.commit()
+    return fname
+
+def find_targets(config, runs, hash_deps=False):
+    """Pkgs that active runs would be set up with.
+    runs: [str]
+        Run directories (see find_runs())
+    Returns: [Target], one per pkg"""
+    targets = collections.OrderedDict()
+    git = executable.which('git')
+    for run in runs:
+        old = rundir.FollowLinks(run)
+        if old.src is None or old.pkgbuild:
+            continue    # pkgbuild pkgs are rebuilt in place; can't build ahead
+        status = rundir.Status(run).status
+        if status in (launchers.NONE, launchers.FINISHED):
+            continue
+        try:
+            rundeck_R = merged_rundeck(config, run, old, git)
+            # Search config/ for #includes, as `ectl setup` would
+            rd = ectl.rundeck.load(rundeck_R, modele_root=old.src,
+                template_path=[os.path.join(run, 'config'), os.path.join(old.src, 'templates')])
+            hasher = xhash.Hasher(memo=True)
+            build = os.path.join(config.builds, ectl.setup.buildhash(rd, old.src, hasher=hasher))
+            pkg_hash = ectl.setup.pkghash(rd, old.src,
+                workspace=config.workspace, deps=hash_deps, hasher=hasher)
+        except Exception as e:
+            print('{}: cannot determine pkg ({})'.format(run, e))
+            continue
+        pkg = os.path.join(config.pkgs, pkg_hash)
+        if pkg in targets:
+            targets[pkg].runs.append(run)
+        else:
+            targets[pkg] = Target(run, rundeck_R, rd, old.src, build, pkg, pkg_hash)
+    return list(targets.values())
+
+# ---------------------------------------------------------
+def parse_size(ssize):
+    """Parses a disk size: bytes, or with a suffix K, M, G or T."""
+    ssize = ssize.strip().upper().rstrip('B')
+    scale = 1
+    if len(ssize) > 0 and ssize[-1] in 'KMGT':
+        scale = 1024 ** ('KMGT'.index(ssize[-1]) + 1)
+        ssize = ssize[:-1]
+    return int(float(ssize) * scale)
+
+def read_state(workspace):
+    """Returns: {pkg: {'built': time, 'runs': [run]}}
+        Pkgs built by prebuild, not (yet) used by any run."""
+    try:
+        with open(os.path.join(workspace, PREBUILD_STATE), 'r') as fin:
+            return json.load(fin)
+    except (IOError, ValueError):
+        return dict()
+
+def write_state(workspace, state):
+    with ioutil.AtomicOverwrite(os.path.join(workspace, PREBUILD_STATE)) as fout:
+        json.dump(state, fout.out, indent=1, sort_keys=True)
+        fout.commit()
+
+def pkg_key(pkg):
+    """Names a pkg the same way, however its directory was reached;
+    without following it into a pkgstore."""
+    return os.path.join(os.path.realpath(os.path.dirname(pkg)), os.path.basename(pkg))
+
+def used_pkgs(runs):
+    """pkgs that run directories are set up with"""
+    used = set()
+    for run in runs:
+        pkg = pathutil.read_link(os.path.join(run, 'pkg'))
+        if pkg is not None:
+            used.add(pkg_key(pkg))
+    return used
+
+def disk_usage(path):
+    """Bytes used by the files in a directory tree (hardlinks once).
+    Symlinks (eg: into a pkgstore) are not followed."""
+    if os.path.islink(path) or not os.path.isdir(path):
+        return 0
+    seen = set()
+    total = 0
+    for dir, dirs, files in os.walk(path):
+        for leaf in files:
+            try:
+                st = os.lstat(os.path.join(dir, leaf))
+            except OSError:
+                continue
+            if st.st_ino not in seen:
+                seen.add(st.st_ino)
+                total += st.st_blocks * 512
+    return total
+
+def remove_pkg(pkg):
+    if os.path.islink(pkg):
+        os.remove(pkg)    # The pkgstore cleans up after its own pkgs
+    elif os.path.isdir(pkg):
+        shutil.rmtree(pkg)
+
+def evict(state, list_runs, budget):
+    """Removes prebuilt pkgs no run uses, oldest first, until those
+    left take no more than budget bytes.  Pkgs now used by a run are
+    dropped from state (but kept on disk).
+    list_runs: () -> [run]
+        Lists the run directories (see find_runs()).  Called again for
+        each pkg, under its use lock, just before removing it: a run
+        may have been set up with it meanwhile.
+    budget:
+        Bytes; None = no limit
+    Returns: [pkg] removed"""
+    used = used_pkgs(list_runs())
+    for pkg in list(state.keys()):
+        if pkg_key(pkg) in used or not os.path.lexists(pkg):
+            del state[pkg]
+    if budget is None:
+        return []
+
+    sizes = dict((pkg, disk_usage(pkg)) for pkg in state)
+    total = sum(sizes.values())
+    removed = list()
+    for pkg in sorted(state, key=lambda pkg: state[pkg]['built']):
+        if total <= budget:
+            break
+        with ectl.setup.pkg_use_lock(pkg):
+            if pkg_key(pkg) not in used_pkgs(list_runs()):
+                print('Evicting prebuilt pkg {} ({:.1f} GB)'.format(pkg, sizes[pkg] * 1e-9))
+                remove_pkg(pkg)
+                removed.append(pkg)
+        total -= sizes[pkg]
+        del state[pkg]
+    return removed
+
+# ---------------------------------------------------------
+def build_target(config, target, jobs=None, python='python3', pythonpath=None, extra_cmake_args=[]):
+    """Builds one target pkg, just as `ectl setup` would."""
+    print('Prebuilding {} for {}'.format(target.pkg, ', '.join(target.runs)))
+    pkgstore = None
+    pkg_prefix = target.pkg
+    if config.pkgstore is not None:
+        pkgstore = ectl.pkgstore.PkgStore(config.pkgstore)
+        pkg_prefix = pkgstore.link(target.pkg_hash, target.pkg, ectl_root=config.ectl)
+    ectl.setup.build_pkg(target.rd, target.rundeck_R, target.src, target.build, target.pkg,
+        pkg_prefix, config, pkgstore=pkgstore,
+        pkg_hash=target.pkg_hash if pkgstore is not None else None,
+        jobs=jobs, python=python, pythonpath=pythonpath, extra_cmake_args=extra_cmake_args)
+    return ectl.setup.good_pkg_dir(target.pkg)
+
+def prebuild_once(config, max_builds=1, jobs=None, budget=None, hash_deps=False, **kwargs):
+    """One pass: finds the pkgs active runs need, and builds those
+    missing.
+    max_builds:
+        Most pkgs to build at once.  Pkgs sharing a build directory are
+        built one after the other.
+    jobs:
+        make -j for each build
+    budget:
+        Disk space (bytes) unused prebuilt pkgs may take; None = no limit
+    kwargs:
+        Passed to build_target()
+    Returns: [Target] built"""
+
+    def list_runs():
+        return find_runs(config.runs, config.workspace)
+    runs = list_runs()
+    state = read_state(config.workspace)
+    evict(state, list_runs, budget)
+    write_state(config.workspace, state)
+
+    todo = [t for t in find_targets(config, runs, hash_deps=hash_deps)
+        if not ectl.setup.good_pkg_dir(t.pkg)]
+    if len(todo) == 0:
+        print('All pkgs are up to date')
+        return []
+
+    # One chain of builds per build directory
+    chains = collections.OrderedDict()
+    for target in todo:
+        chains.setdefault(target.build, []).append(target)
+
+    def build_chain(chain):
+        built = list()
+        for target in chain:
+            try:
+                if build_target(config, target, jobs=jobs, **kwargs):
+                    built.append(target)
+            except Exception:
+                print('Prebuilding {} failed:'.format(target.pkg))
+                traceback.print_exc()
+        return built
+
+    built = list()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_builds) as executor:
+        for chain_built in executor.map(build_chain, list(chains.values())):
+            built += chain_built
+
+    for target in built:
+        state[target.pkg] = {'built': time.time(), 'runs': target.runs}
+    evict(state, list_runs, budget)
+    write_state(config.workspace, state)
+    return built
+
+def prebuild(ectl_root, watch=None, nice=19, **kwargs):
+    """Prebuilds pkgs for the runs in an ectl root.
+    watch:
+        Poll every this many seconds; None = one pass only.
+    nice:
+        Run builds at this niceness (added to the current one)
+    kwargs:
+        Passed to prebuild_once()"""
+    config = ectl.config.Config(ectl=ectl_root)
+    try:
+        os.makedirs(config.workspace)
+    except OSError:
+        pass
+
+    # Only one prebuild per ectl root
+    lockfile = os.path.join(config.workspace, PREBUILD_LOCK)
+    with open(lockfile, 'a'):
+        pass
+    lock = llnl.util.lock.Lock(lockfile)
+    try:
+        lock.acquire_write(timeout=.05)
+    except llnl.util.lock.LockError:
+        print('Another prebuild is running in {}'.format(config.ectl))
+        return
+
+    try:
+        if nice:
+            os.nice(nice)
+        while True:
+            prebuild_once(config, **kwargs)
+            if watch is None:
+                break
+            time.sleep(watch)
+    finally:
+        lock.release_write()
@@ -0,0 +1,96 @@
+"""Caches the results of slow probes of the environment (running
+`mpirun -version`, `ldd modelexe`, etc.) between launches.
+
+A cached result is reused only while everything it depends on is
+unchanged: the resolved paths and mtimes of the executables involved,
+LD_LIBRARY_PATH and the hostname.  Anything else that could change the
+answer (eg: a system library upgrade) needs explicit invalidation:
+clear() or `ectl run --reprobe`.  Set ECTL_NO_PROBE_CACHE=1 to bypass
+the cache altogether.
+
+Results must be JSON-serializable.
+"""
+from __future__ import print_function
+import os
+import json
+import socket
+from giss import ioutil
+
+# Most probe results to keep
+MAX_ENTRIES = 100
+
+def cache_fname():
+    cache_home = os.environ.get('XDG_CACHE_HOME',
+        os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache_home, 'ectl', 'probes.json')
+
+def enabled():
+    return os.environ.get('ECTL_NO_PROBE_CACHE', '') in ('', '0')
+
+def probe_key(name, exes):
+    """Identifies a probe, and everything its result depends on.
+    exes:
+        Files (executables) the probe runs or inspects."""
+    files = list()
+    for exe in exes:
+        exe = os.path.realpath(exe)
+        try:
+            mtime = os.stat(exe).st_mtime_ns
+        except OSError:
+            mtime = None
+        files.append((exe, mtime))
+    return json.dumps([name, files,
+        os.environ.get('LD_LIBRARY_PATH', ''), socket.gethostname()])
+
+def _load(fname):
+    try:
+        with open(fname, 'r') as fin:
+            return json.load(fin)
+    except (IOError, ValueError):
+        return dict()
+
+def _save(cache, fname):
+    try:
+        os.makedirs(os.path.dirname(fname))
+    except OSError:
+        pass
+    try:
+        with ioutil.AtomicOverwrite(fname) as fout:
+            json.dump(cache, fout.out, indent=1)
+            fout.commit()
+    except (IOError, OSError):
+        pass    # Read-only or full cache dir: the cache is only an optimization
+
+def cached(name, exes, probe, fname=None):
+    """Returns the result of probe(), cached under name.
+    exes:
+        Files the probe depends on; the cache entry is invalid if any
+        of them changes.
+    probe: () -> result
+        Runs the probe.  If it raises, nothing is cached."""
+    if not enabled():
+        return probe()
+
+    fname = fname or cache_fname()
+    key = probe_key(name, exes)
+    cache = _load(fname)
+    if key in cache:
+        return cache[key]
+
+    result = probe()
+
+    cache = _load(fname)    # Might have changed while we probed
+    cache[key] = result
+    # Forget the oldest entries (JSON objects keep their order)
+    for old_key in list(cache.keys())[:-MAX_ENTRIES]:
+        del cache[old_key]
+    _save(cache, fname)
+    return result
+
+def clear(fname=None):
+    """Forgets all cached probe results."""
+    fname = fname or cache_fname()
+    try:
+        os.remove(fname)
+    except OSError:
+        pass
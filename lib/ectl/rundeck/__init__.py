@@ -1,6 +1,8 @@
 from __future__ import print_function
 from ectl.rundeck import legacy
+from ectl.rundeck import diskcache
 import collections
+import io
 import os
 import sys
 from ectl import pathutil
@@ -209,12 +211,17 @@ class FileParams(BaseParams):
         """Writes param.rval for params of type FILE"""
         good = True
 
-        for param in self.values():
-            if param.rval is None:
-                try:
-                    param.rval = pathutil.search_or_download_file(param.name, param.value, file_path, download_dir=download_dir)
-                except Exception as e:
-                    good = False
+        # Missing files are downloaded together, each once
+        params = [param for param in self.values() if param.rval is None]
+        resolved = pathutil.search_or_download_files(
+            [(param.name, param.value) for param in params],
+            file_path, download_dir=download_dir)
+        for param in params:
+            rval = resolved[param.value]
+            if isinstance(rval, Exception):
+                good = False
+            else:
+                param.rval = rval
 
         if not good:
             raise Exception('Problem downloading at least one file')
@@ -394,24 +401,30 @@ class Rundeck(object):
             repr(self.params.inputz_cold), \
         ))
 
-    def write_I(self, fname):
-        with open(fname, 'w') as out:
-            out.write(self.preamble[0].raw)    # First line of preamble
-            out.write('\n')
+    def format_I(self):
+        """Returns the contents of the I file for this rundeck."""
+        out = io.StringIO()
+        out.write(self.preamble[0].raw)    # First line of preamble
+        out.write('\n')
 
-            out.write('&&PARAMETERS\n')
-            out.write('\n'.join('{}={}'.format(p.name, p.value)
-                for p in self.params.params.values()))
-            out.write('\n')
+        out.write('&&PARAMETERS\n')
+        out.write('\n'.join('{}={}'.format(p.name, p.value)
+            for p in self.params.params.values()))
+        out.write('\n')
 
-            out.write('\n'.join('_file_{}={}'.format(p.name, p.rval)
-                for p in self.params.files.values()))
-            out.write('\n&&END_PARAMETERS\n')
+        out.write('\n'.join('_file_{}={}'.format(p.name, p.rval)
+            for p in self.params.files.values()))
+        out.write('\n&&END_PARAMETERS\n')
 
-            out.write('\n&INPUTZ\n')
-            out.write('\n'.join('{}={},'.format(p.name, p.value)
-                for p in self.params.inputz.values()))
-            out.write('\n/\n\n')
+        out.write('\n&INPUTZ\n')
+        out.write('\n'.join('{}={},'.format(p.name, p.value)
+            for p in self.params.inputz.values()))
+        out.write('\n/\n\n')
+        return out.getvalue()
+
+    def write_I(self, fname):
+        with open(fname, 'w') as out:
+            out.write(self.format_I())
 
 # We don't need to write .R files; we only read .R and write I
 # But this was a really clever way to write out exactly what was originally read.
@@ -485,7 +498,11 @@ class Rundeck(object):
 #                out.write(raw)
 
 # ----------------------------------------------------
-def load(fname, modele_root=None, template_path=None):
+def load(fname, modele_root=None, template_path=None, cache=True):
+    """Loads a rundeck (.R file), returns a Rundeck.
+    cache:
+        Use the on-disk cache of parsed rundecks, if the rundeck
+        belongs to a run.  See ectl.rundeck.diskcache."""
 
     if modele_root is None:
         if template_path is None:
@@ -502,23 +519,32 @@ def load(fname, modele_root=None, template_path=None):
     dirname,leafname = os.path.split(fname)
     template_path = [dirname] + template_path
 
-    # Create a blank rundeck
-    rd = Rundeck(modele_root=modele_root)
-
-    root,ext = os.path.splitext(leafname)
-    fin = legacy.preprocessor(fname, template_path)
-    legacy_rundeck = legacy.LegacyRundeck(fin)    # Auto-closes
-    rd.add_legacy(legacy_rundeck)
+    def parse(deps):
+        # Create a blank rundeck
+        rd = Rundeck(modele_root=modele_root)
 
+        fin = legacy.preprocessor(fname, template_path, deps=deps)
+        legacy_rundeck = legacy.LegacyRundeck(fin)    # Auto-closes
+        rd.add_legacy(legacy_rundeck)
+        return rd
 
-    return rd
+    if not cache:
+        return parse(list())
+    return diskcache.cached(fname, ('R', modele_root, template_path),
+        template_path, parse)
 # ----------------------------------------------------
-def load_I(fname):
+def load_I(fname, cache=True):
     """Loads an I-file, returns a RunDeck"""
-    rd = Rundeck()
-    fin = legacy.preprocessor(fname, [])
-    lrd = legacy.LegacyRundeck(fin)    # Auto-closes
-    rd.add_legacy(lrd, is_rundeck=False)
-    return rd
+    fname = os.path.abspath(fname)
+    def parse(deps):
+        rd = Rundeck()
+        fin = legacy.preprocessor(fname, [], deps=deps)
+        lrd = legacy.LegacyRundeck(fin)    # Auto-closes
+        rd.add_legacy(lrd, is_rundeck=False)
+        return rd
+
+    if not cache:
+        return parse(list())
+    return diskcache.cached(fname, ('I',), [], parse)
 # ----------------------------------------------------------------------
 
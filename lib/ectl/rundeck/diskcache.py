@@ -0,0 +1,136 @@
+"""Caches parsed rundecks on disk, so loading the same rundeck again
+(eg: once per `ectl run`, `ectl setup` of an existing run) costs a
+few stat() calls and an unpickle instead of a full parse.
+
+Only rundecks that belong to a run are cached: <run>/I and
+<run>/config/*.R.  The cache lives in <run>/.rundeck_cache.
+
+A cache entry records every file read while parsing (the rundeck and
+everything it #includes), and every directory searched for includes.
+It is used only while all of them are unchanged (size, mtime, inode);
+a new file in an earlier template directory, which could shadow an
+include, changes that directory's mtime.  Set ECTL_NO_RUNDECK_CACHE=1
+to bypass the cache altogether.
+"""
+from __future__ import print_function
+import os
+import time
+import pickle
+import hashlib
+import tempfile
+
+CACHE_DIR = '.rundeck_cache'
+
+# Increment when the pickled classes change incompatibly
+VERSION = 1
+
+# Files modified this recently (seconds) are not trusted: they could be
+# changed again within the same mtime tick.  (See ectl.srcdir)
+RACY_SECONDS = 2.
+
+def enabled():
+    return os.environ.get('ECTL_NO_RUNDECK_CACHE', '') in ('', '0')
+
+def run_of(fname):
+    """Returns the run directory a rundeck file belongs to, or None."""
+    dir = os.path.dirname(os.path.abspath(fname))
+    if os.path.basename(dir) == 'config':
+        dir = os.path.dirname(dir)
+    if os.path.isdir(os.path.join(dir, 'config')):
+        return dir
+    return None
+
+def cache_fname(fname, key):
+    run = run_of(fname)
+    if run is None:
+        return None
+    digest = hashlib.md5(repr(key).encode()).hexdigest()[:16]
+    return os.path.join(run, CACHE_DIR,
+        '%s-%s.pickle' % (os.path.basename(fname), digest))
+
+def stat_key(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime_ns, st.st_ino)
+
+def stat_deps(paths):
+    return [(path, stat_key(path)) for path in paths]
+
+def _load(cfname, key):
+    """Returns the cached value, or None if missing or out of date."""
+    try:
+        with open(cfname, 'rb') as fin:
+            header = pickle.load(fin)
+            version, key0, deps = header
+            if version != VERSION or key0 != key:
+                return None
+            if stat_deps(path for path,_ in deps) != deps:
+                return None
+            return pickle.load(fin)
+    except Exception:
+        # Missing, corrupt or unreadable: just parse again
+        return None
+
+def _save(cfname, key, deps, rd):
+    dir = os.path.dirname(cfname)
+    try:
+        os.makedirs(dir)
+    except OSError:
+        pass
+
+    try:
+        fd, tmp = tempfile.mkstemp(dir=dir, prefix='.tmp')
+    except OSError:
+        return    # Read-only run directory
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            pickle.dump((VERSION, key, deps), out, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(rd, out, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cfname)
+    except Exception:
+        # Disk full, unpicklable rundeck, etc.: the cache is only an
+        # optimization
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+def cached(fname, key, search_path, parse):
+    """Returns parse(deps), from the cache if possible.
+    fname:
+        Absolute name of the rundeck file.
+    key:
+        Everything (besides files) the result depends on.  Must be
+        comparable and have a stable repr().
+    search_path: [dir]
+        Directories searched for #include files.
+    parse: ([] -> Rundeck)
+        Parses the rundeck, appending names of all files read to its
+        argument."""
+    key = (fname, key)
+    cfname = cache_fname(fname, key) if enabled() else None
+    if cfname is None:
+        return parse(list())
+
+    rd = _load(cfname, key)
+    if rd is not None:
+        return rd
+
+    files = list()
+    rd = parse(files)
+
+    paths = list()
+    for path in list(search_path) + files:
+        path = os.path.abspath(path)
+        if path not in paths:
+            paths.append(path)
+    deps = stat_deps(paths)
+
+    now_ns = int(time.time() * 1e9)
+    racy_ns = int(RACY_SECONDS * 1e9)
+    if all(st is None or abs(now_ns - st[1]) > racy_ns for _,st in deps):
+        # Save before returning: callers modify the Rundeck
+        _save(cfname, key, deps, rd)
+    return rd
@@ -3,6 +3,10 @@ import io
 import re
 import os
 import sys
+from ectl import pathutil
+
+# C-style comments: /* ... */
+ccommentRE = re.compile(r'/\*.*?\*/', re.DOTALL)
 
 class Line(object):
     __slots__ = ['source', 'source_lineno', 'lineno', 'isection', \
@@ -28,11 +32,21 @@ class Line(object):
 
         # Remove C-style comments too
         # http://stackoverflow.com/questions/2319019/using-regex-to-remove-comments-from-source-files
-        line = re.sub(re.compile('/\*.*?\*/',re.DOTALL ) ,'' ,line)
+        if '/*' in line:
+            line = ccommentRE.sub('', line)
 
         line = line.strip()
         return line
 
+    # Compact pickling (see ectl.rundeck.diskcache)
+    def __getstate__(self):
+        return (self.source, self.source_lineno, self.lineno, self.isection,
+            self.divider, self.raw, self.parsed, self.param)
+
+    def __setstate__(self, state):
+        (self.source, self.source_lineno, self.lineno, self.isection,
+            self.divider, self.raw, self.parsed, self.param) = state
+
     def __repr__(self):
         return repr(self.raw)
 
@@ -40,35 +54,42 @@ class Line(object):
         return '(%s, %s): %s' % (self.source, self.lineno, self.raw)
 
 def find_in_path(fname, search_path):
-    for path in search_path:
-        candidate = os.path.join(path, fname)
-        if os.path.exists(candidate):
-            return candidate
-    raise ValueError('File not found in path: %s' % fname)
+    """search_path: [dir] or pathutil.PathIndex"""
+    if not isinstance(search_path, pathutil.PathIndex):
+        search_path = pathutil.PathIndex(search_path)
+    candidate = search_path.find(fname)
+    if candidate is None:
+        raise ValueError('File not found in path: %s' % fname)
+    return candidate
 
-includeRE = re.compile('\s*#include\s*"(.*?)"\s*(!\s*)?')
+includeRE = re.compile(r'\s*#include\s*"(.*?)"\s*(!\s*)?')
 
-def preprocessor(fname, search_path):
+def preprocessor(fname, search_path, deps=None):
     """Load a fully preprocessed rundeck from the templates directory.
-    Works as a generator, producing one line at a time."""
-    try:
-        with open(fname, 'r') as fin:
-            source_lineno = 0
-            while True:
-                line = next(fin)
-                match = includeRE.match(line)
-                if match is None:
-                    yield Line(fname, source_lineno, line)
-                    source_lineno += 1
-                else:
-                    leaf1 = match.group(1)
-                    fname1 = find_in_path(leaf1, search_path)
-                    yield Line(fname, source_lineno, '! ---------- BEGIN #include %s\n' % fname1.encode())
-                    for line in preprocessor(fname1, search_path):
-                        yield line
-                    yield Line(fname, source_lineno, '! ---------- END #include %s\n' % fname1.encode())
-    except EOFError:
-        pass
+    Works as a generator, producing one line at a time.
+    search_path: [dir] or pathutil.PathIndex
+        Where to look for #include files.
+    deps: list (OUT)
+        If given, the name of every file read is appended to it."""
+    # Index the path once for all includes, however deeply nested
+    if not isinstance(search_path, pathutil.PathIndex):
+        search_path = pathutil.PathIndex(search_path)
+    if deps is not None:
+        deps.append(fname)
+    with open(fname, 'r') as fin:
+        source_lineno = 0
+        for line in fin:
+            match = includeRE.match(line)
+            if match is None:
+                yield Line(fname, source_lineno, line)
+                source_lineno += 1
+            else:
+                leaf1 = match.group(1)
+                fname1 = find_in_path(leaf1, search_path)
+                yield Line(fname, source_lineno, '! ---------- BEGIN #include %s\n' % fname1.encode())
+                for line in preprocessor(fname1, search_path, deps=deps):
+                    yield line
+                yield Line(fname, source_lineno, '! ---------- END #include %s\n' % fname1.encode())
 
 
 sectionRE = re.compile(r'\s*((Preamble):?|(Preprocessor\s+Options):?|(Run\s+Options):?|(Object\s+modules):?|(Components):?|(Component\s+Options):?|(Data\s+input\s+files):?|(Label\s+and\s+Namelist).*|(&&PARAMETERS)|(&INPUTZ))\s*')
@@ -113,6 +134,9 @@ def sectionalize(fin):
 # ----------------------------------------------------------
 # Parsers for the different sections
 # Must return parsed-line.  None if line is to be disregarded
+# (With sectionalize(), these are the original regex-per-line pipeline.
+# LegacyRundeck parses with the single-pass _parse_line() instead; they
+# are kept for the conformance checks in tests/test_legacy.py)
 class Parser(object):
     pass
 
@@ -220,42 +244,185 @@ class Section(list):
             if line.parsed is not None:
                 yield line
 
+# ----------------------------------------------------------
+# Single-pass parser: the same results as sectionalize() plus the
+# Parser classes above, but with plain string operations, and
+# remembering the parsed value of every line seen before.  (Rundecks
+# and I files loaded in one process share most of their lines.)
+# A cold parse is only modestly faster than the regex pipeline (see
+# tests/bench_rundeck.py): most of its time is the per-line Python
+# overhead, which no tokenizer avoids.  The 10x target is met only by
+# the memo, ie for lines seen before.
+
+# First characters of section dividers (see sectionRE)
+_divider_initials = frozenset('PROCDL&')
+
+def _remove_comments(raw):
+    """Same as Line.remove_comments()"""
+    exp = raw.find('!')
+    line = raw if exp < 0 else raw[:exp]
+    if '/*' in line:
+        line = ccommentRE.sub('', line)
+    return line.strip()
+
+# The section parsers below take the raw line.  Lines without C-style
+# comments are parsed by one regex, which also skips ! comments.
+
+rawDefineRE = re.compile(r'\s*#define\s+([^\s!]+)(?:\s+([^!]*))?')
+def _parse_define(raw):
+    """Same as PreprocessorOptions"""
+    if '/*' in raw:
+        raw = _remove_comments(raw)
+    match = rawDefineRE.match(raw)
+    if match is None:
+        return None
+    value = match.group(2)
+    if value is not None:
+        value = value.rstrip()
+    return match.group(1), (value or None)
+
+rawKeyEqValueRE = re.compile(r'\s*([^=\s!]*)\s*=([^!]*)')
+def _parse_key_eq_value(raw):
+    """Same as KeyEqValue"""
+    if '/*' in raw:
+        raw = _remove_comments(raw)
+    match = rawKeyEqValueRE.match(raw)
+    if match is None:
+        return None
+    return match.group(1), match.group(2).strip()
+
+def _parse_component_options(raw):
+    """Same as ComponentOptions"""
+    kv = _parse_key_eq_value(raw)
+    if kv is None:
+        return None
+    scomp,options = kv
+    component = scomp[5:] if scomp.startswith('OPTS_') else scomp
+
+    parsed_options = []
+    for opt in options.split(' '):
+        if len(opt) == 0: continue
+        words = opt.split('=')
+        if len(words) != 2:
+            raise ValueError('Bad component option {0}'.format(opt))
+        parsed_options.append((words[0].strip(), words[1].strip()))
+    return component, parsed_options
+
+def _parse_namelist(raw):
+    """Same as NameList"""
+    eqs = _remove_comments(raw).split('=')
+    ret = list()
+    prev = eqs[0]
+    comma = prev.rfind(',')
+    for x in eqs[1:]:
+        key = prev if comma < 0 else prev[comma+1:]
+        comma = x.rfind(',')
+        ret.append((key.strip(), (x if comma < 0 else x[:comma]).strip()))
+        prev = x
+    return ret
+
+def _parse_words(raw):
+    """Same as WordList"""
+    ret = [word.strip() for word in _remove_comments(raw).split(' ')]
+    ret = [word for word in ret if len(word) > 0]
+    return ret if len(ret) > 0 else None
+
+# Parser of each section; None means the line itself (CopyLines)
+_fast_parsers = (None, _parse_define, _parse_key_eq_value, _parse_words,
+    _parse_words, _parse_component_options, _parse_key_eq_value, None,
+    _parse_key_eq_value, _parse_namelist)
+
+# Parsed value of blank and comment-only lines, by section
+_blank_parsed = tuple(None if parser is None else parser('')
+    for parser in _fast_parsers)
+
+# What to do with a (memoized) parsed line
+_DIVIDER = 0        # Start a new section
+_SHARED = 1         # Use parsed as-is (None or tuple of str)
+_COPY_LIST = 2      # Use a copy of parsed
+_COPY_OPTIONS = 3   # (component, [options]): copy the list
+_SELF = 4           # The parsed value is the line itself
+
+# (isection, raw) --> (what to do, isection of line, parsed)
+_memo = dict()
+MEMO_MAX = 1<<16
+
+def _parse_line(isection, raw):
+    """Parses one line (not memoized).
+    Returns: (what to do, isection of line, parsed)"""
+    stripped = raw.lstrip()
+    if len(stripped) > 0 and stripped[0] in _divider_initials:
+        match = sectionRE.match(raw)
+        if match is not None:
+            groups = match.groups()[1:]
+            for inew,group in enumerate(groups):
+                if group is not None:
+                    return _DIVIDER, inew, None
+            raise ValueError('Could not find next section for "%s"' % raw)
+
+    parser = _fast_parsers[isection]
+    if parser is None:
+        return _SELF, isection, None
+    if len(stripped) == 0 or stripped[0] == '!':
+        parsed = _blank_parsed[isection]
+    else:
+        parsed = parser(raw)
+    if isinstance(parsed, list):
+        return _COPY_LIST, isection, parsed
+    if parser is _parse_component_options and parsed is not None:
+        return _COPY_OPTIONS, isection, parsed
+    return _SHARED, isection, parsed
+
+section_names = ['preamble', 'Preprocessor Options', 'Run Options',
+    'Object Modules', 'Components', 'Component Options', 'Data input files',
+    'Label and Namelist', 'Parameters', 'InputZ']
+
 class LegacyRundeck(object):
     def __init__(self, fin):
+        """fin:
+            Lines (legacy.Line) of the rundeck, as from preprocessor()"""
         self.lines = list()        # Raw lines in the rundeck
 
-        section_parsers = [
-            ('preamble', CopyLines()),
-            ('Preprocessor Options', PreprocessorOptions()),
-            ('Run Options', KeyEqValue()),
-            ('Object Modules', WordList()),
-            ('Components', WordList()),
-            ('Component Options', ComponentOptions()),
-            ('Data input files', KeyEqValue()),
-            ('Label and Namelist', CopyLines()),
-            ('Parameters', KeyEqValue()),
-            ('InputZ', NameList())
-        ]
-
         # Initialize sections
         self.sections_list = list()
         self.sections = dict()
-        for isection,(name,parser) in enumerate(section_parsers):
+        for isection,name in enumerate(section_names):
             section = Section(isection, name)  # list with a name
             self.sections_list.append(section)
             self.sections[name] = section
 
-        # Fill in the sections
-        fin = sectionalize(fin)
-        for line in fin:
-            if line.divider:
-                line_tuple = (line, None)
-            else:
-                parser = section_parsers[line.isection][1]
-                line.parsed = parser(line)
-            self.lines.append(line)
-            self.sections_list[line.isection].append(line)
+        self._parse(fin)
+
+    def _parse(self, fin):
+        if len(_memo) > MEMO_MAX:
+            _memo.clear()
+        lines = self.lines
+        sections_list = self.sections_list
+        memo_get = _memo.get    # Local names are faster in this loop
+        SHARED, COPY_LIST, SELF, DIVIDER = _SHARED, _COPY_LIST, _SELF, _DIVIDER
 
+        isection = 0
+        for lineno,line in enumerate(fin, 1):
+            key = (isection, line.raw)
+            memoized = memo_get(key)
+            if memoized is None:
+                memoized = _memo[key] = _parse_line(isection, line.raw)
+            todo,isection,parsed = memoized
+
+            line.lineno = lineno
+            line.isection = isection
+            if todo == SHARED:
+                line.parsed = parsed
+            elif todo == COPY_LIST:
+                line.parsed = list(parsed)    # Don't share memoized lists
+            elif todo == SELF:
+                line.parsed = line
+            elif todo == DIVIDER:
+                line.divider = True
+            else:
+                line.parsed = (parsed[0], list(parsed[1]))
+            lines.append(line)
+            sections_list[isection].append(line)
 
     def __repr__(self):
         out = list()
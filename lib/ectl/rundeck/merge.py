@@ -0,0 +1,145 @@
+"""Three-way merge of flattened rundecks, used by `ectl setup` to apply
+upstream (template) changes to a user's rundeck.R.
+
+The merge is line-wise, like diff3 / `git merge`, with two refinements
+that know about rundeck structure:
+
+  * Rundecks are merged section by section (Preamble, Run Options,
+    &&PARAMETERS, ...), so changes never align across sections.
+
+  * In sections of one-setting-per-line (#defines, parameters, input
+    files), a region changed on both sides is resolved line by line
+    when neither side added or removed lines: eg, the user changes
+    KOCEAN while upstream changes the line below it.
+
+Conflicts are written with git-style markers.
+"""
+import difflib
+from ectl.rundeck import legacy
+
+# Section indices (see legacy.sectionRE)
+PREPROCESSOR_OPTIONS = 1
+RUN_OPTIONS = 2
+DATA_INPUT_FILES = 6
+PARAMETERS = 8
+
+# Sections whose lines are independent settings
+_setting_sections = frozenset((PREPROCESSOR_OPTIONS, RUN_OPTIONS, DATA_INPUT_FILES, PARAMETERS))
+
+OURS_MARKER = '<<<<<<< '
+BASE_MARKER = '||||||| '
+SEP_MARKER = '=======\n'
+THEIRS_MARKER = '>>>>>>> '
+
+def has_conflicts(lines):
+    """Determines whether a file still contains conflict markers."""
+    return any(line.startswith(OURS_MARKER) or line.startswith(THEIRS_MARKER)
+        for line in lines)
+
+def _matches(a, b):
+    """Returns {index in a: index in b} for lines a and b have in common."""
+    ret = dict()
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    for i,j,n in matcher.get_matching_blocks():
+        for k in range(n):
+            ret[i+k] = j+k
+    return ret
+
+def merge3(base, ours, theirs, labels=('ours', 'base', 'theirs'), by_line=False):
+    """Three-way merge of lists of lines.
+    by_line:
+        Resolve regions changed on both sides line by line, when
+        possible.
+    Returns: (merged lines, number of conflicts)"""
+    if ours == theirs or theirs == base:
+        return list(ours), 0
+    if ours == base:
+        return list(theirs), 0
+
+    omap = _matches(base, ours)
+    tmap = _matches(base, theirs)
+
+    merged = list()
+    nconflicts = 0
+    ib, io, it = 0, 0, 0
+    while True:
+        # Next base line kept by both sides: the end of a changed region
+        jb = ib
+        while jb < len(base) and not (jb in omap and jb in tmap):
+            jb += 1
+        if jb < len(base):
+            jo, jt = omap[jb], tmap[jb]
+        else:
+            jo, jt = len(ours), len(theirs)
+
+        b, o, t = base[ib:jb], ours[io:jo], theirs[it:jt]
+        if o == t or t == b:
+            merged += o
+        elif o == b:
+            merged += t
+        elif by_line and len(b) == len(o) == len(t):
+            for bline, oline, tline in zip(b, o, t):
+                if oline == tline or tline == bline:
+                    merged.append(oline)
+                elif oline == bline:
+                    merged.append(tline)
+                else:
+                    merged += _conflict([bline], [oline], [tline], labels)
+                    nconflicts += 1
+        else:
+            merged += _conflict(b, o, t, labels)
+            nconflicts += 1
+
+        if jb == len(base):
+            break
+        merged.append(base[jb])
+        ib, io, it = jb+1, jo+1, jt+1
+
+    return merged, nconflicts
+
+def _conflict(b, o, t, labels):
+    def ended(lines):
+        # Markers must start on their own line
+        if len(lines) > 0 and not lines[-1].endswith('\n'):
+            return lines[:-1] + [lines[-1] + '\n']
+        return lines
+    return ([OURS_MARKER + labels[0] + '\n'] + ended(o)
+        + [BASE_MARKER + labels[1] + '\n'] + ended(b)
+        + [SEP_MARKER] + ended(t)
+        + [THEIRS_MARKER + labels[2] + '\n'])
+
+def sections(lines):
+    """Splits a rundeck into its sections.
+    Returns: [(isection, [line])]
+        isection is None for the lines before the first section."""
+    ret = [(None, list())]
+    for line in lines:
+        match = legacy.sectionRE.match(line)
+        if match is not None:
+            groups = match.groups()[1:]
+            isection = next(i for i,group in enumerate(groups) if group is not None)
+            ret.append((isection, list()))
+        ret[-1][1].append(line)
+    return ret
+
+def merge_rundecks(base, ours, theirs, labels=('user', 'base', 'upstream')):
+    """Three-way merge of rundecks, given as lists of lines.
+    Returns: (merged lines, number of conflicts)"""
+    if ours == theirs or theirs == base:
+        return list(ours), 0
+    if ours == base:
+        return list(theirs), 0
+
+    bsecs, osecs, tsecs = sections(base), sections(ours), sections(theirs)
+    keys = [isection for isection,_ in bsecs]
+    if keys != [isection for isection,_ in osecs] or keys != [isection for isection,_ in tsecs]:
+        # Sections were added, removed or reordered: merge the whole thing
+        return merge3(base, ours, theirs, labels=labels)
+
+    merged = list()
+    nconflicts = 0
+    for (isection,b), (_,o), (_,t) in zip(bsecs, osecs, tsecs):
+        m, n = merge3(b, o, t, labels=labels, by_line=(isection in _setting_sections))
+        merged += m
+        nconflicts += n
+    return merged, nconflicts
@@ -15,7 +15,6 @@ import copy
 import subprocess
 import signal
 import time
-import netCDF4
 
 # TODO: Be careful not to leave around zero-length files when downloading
 
@@ -80,42 +79,77 @@ class FollowLinks(object):
         out.write('%sbuild:   %s\n' % (prefix, self.build))
         out.write('%spkg:     %s\n' % (prefix, self.pkg))
 
-def make_rundir(rd, rundir, idir=None):
-    """idir:
-        Write the I file to this directory, and symlink to rundir"""
+def _replace_symlink(target, link):
+    """Points link at target, never leaving link missing."""
+    tmp = '%s.tmp%d' % (link, os.getpid())
+    os.symlink(target, tmp)
+    os.replace(tmp, link)
 
-    ret = True
+def make_rundir(rd, rundir, idir=None):
+    """Creates the symlinks to input files, and the I file, in a run
+    directory.  Links and files already correct are left untouched; so
+    re-running on an existing run costs one scandir() plus a readlink()
+    per input file.
+    idir:
+        Write the I file to this directory, and symlink to rundir
+    Returns: (nskipped, nchanged)
+        Number of links / files left alone, and (re)written."""
 
     # ------- Make the rundir
     try:
         os.makedirs(rundir)
     except OSError:
         pass
-    try:
-        os.remove(os.path.join(rundir, 'I'))
-    except OSError:
-        pass
 
-    # -------- Remove old symlinks
-    for label in rd.params.files.keys():
-        try:
-            os.remove(os.path.join(rundir, label))
-        except OSError:
-            pass
+    # -------- Current state of the rundir, in one pass
+    # {name: symlink target, or None for non-symlinks}
+    existing = dict()
+    with os.scandir(rundir) as entries:
+        for entry in entries:
+            existing[entry.name] = os.readlink(entry.path) if entry.is_symlink() else None
+
+    nskipped = 0
+    nchanged = 0
 
     # -------- Link data files
     for label, param in rd.params.files.items():
         fname = param.rval
         if fname is None:
             raise ValueError('param with null rval: {} {}'.format(type(param), param))
-        os.symlink(fname, os.path.join(rundir, label))
+        if label in existing:
+            if existing[label] == fname:
+                nskipped += 1
+                continue
+            _replace_symlink(fname, os.path.join(rundir, label))
+        else:
+            os.symlink(fname, os.path.join(rundir, label))
+        nchanged += 1
 
     # Write them out to the I file
-    if idir is not None:
-        rd.write_I(os.path.join(idir, 'I'))
-        os.symlink(os.path.join(idir, 'I'), os.path.join(rundir, 'I'))
+    I_text = rd.format_I()
+    I_fname = os.path.join(idir if idir is not None else rundir, 'I')
+    I_unchanged = False
+    if idir is None and 'I' in existing and existing['I'] is None:
+        with open(I_fname, 'r') as fin:
+            I_unchanged = (fin.read() == I_text)
+    if I_unchanged:
+        nskipped += 1
     else:
-        rd.write_I(os.path.join(rundir, 'I'))
+        # A running job never sees a partial or missing I file
+        with ioutil.AtomicOverwrite(I_fname) as fout:
+            fout.out.write(I_text)
+            fout.commit()
+        nchanged += 1
+
+    if idir is not None:
+        if existing.get('I') == I_fname:
+            nskipped += 1
+        else:
+            _replace_symlink(I_fname, os.path.join(rundir, 'I'))
+            nchanged += 1
+
+    print('{}: {} links/files unchanged, {} updated'.format(rundir, nskipped, nchanged))
+    return nskipped, nchanged
 
 
 def read_launch_txt(run):
@@ -265,6 +299,7 @@ def rsf_status(rsf, kdisk):
     if not os.path.exists(rsf):
         return RsfStatus(rsf, kdisk, RSF_MISSING, None)
 
+    import netCDF4    # Slow to import; only needed here
     nc = None
     try:
         nc = netCDF4.Dataset(rsf, 'r')
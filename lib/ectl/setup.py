@@ -1,7 +1,10 @@
 from __future__ import print_function
 import multiprocessing
+import concurrent.futures
+import contextlib
 import os
 import hashlib
+import json
 import argparse
 import llnl.util.tty as tty
 import ectl.util
@@ -10,34 +13,65 @@ import ectl.cmd
 import ectl.cdlparams
 from ectl import pathutil,rundir,xhash,srcdir,launchers
 import ectl.config
+import ectl.pkgstore
+import ectl.buildlock
+import ectl.buildseed
+import ectl.unpack
+import ectl.hooks
+import ectl.timing
+import ectl.buildprof
 import ectl.rundeck
 from ectl.rundeck import legacy
+from ectl.rundeck import merge as rundeck_merge
+from ectl.rundeck import diskcache
 import subprocess
 import base64
 import re
 import datetime
+import time
 import sys
 from spack.util import executable
-from giss import pyar, ioutil
-import importlib
-import netCDF4
+from giss import ioutil
 
 MODELE_CONTROL_PYAR = 'modele-control.pyar'
 
-def buildhash(rd, src_dir):
+def buildhash(rd, src_dir, hasher=None):
+    """hasher: xhash.Hasher
+        Optional (memoizing) hasher; the digest does not depend on it."""
+    hasher = hasher or xhash.Hasher()
     hash = hashlib.md5()
-    xhash.update(rd, hash)
+    hasher.update(rd, hash)
     xhash.update(src_dir, hash)    # Source directory
     return hash.hexdigest()
 #    return base64.b32encode(hash.digest()).lower()
 
-def pkghash(rd, src_dir):
+def pkghash(rd, src_dir, workspace=None, deps=False, hasher=None):
+    """workspace:
+        ectl workspace directory, used to cache source file fingerprints.
+    deps:
+        Hash only the sources the rundeck compiles, rather than the
+        entire source directory.
+    hasher: xhash.Hasher
+        Optional (memoizing) hasher; the digest does not depend on it."""
+    hasher = hasher or xhash.Hasher()
     hash = hashlib.md5()
-    xhash.update(rd, hash)
-    srcdir.update_hash(src_dir, hash)
+    hasher.update(rd, hash)
+    manifest = None if workspace is None else srcdir.manifest_fname(workspace, src_dir)
+    if deps:
+        srcdir.update_hash_deps(src_dir, rd.build, hash, manifest=manifest)
+    else:
+        srcdir.update_hash(src_dir, hash, manifest=manifest)
     return hash.hexdigest()
 #    return base64.b32encode(hash.digest()).lower()
 
+def pkg_use_lock(pkg):
+    """Lock held while a run is linked to a pkg; and by prebuild while
+    it evicts the pkg (see ectl.prebuild.evict())."""
+    pkgs_dir,leaf = os.path.split(pkg)
+    return ectl.buildlock.BuildLock(
+        os.path.join(os.path.dirname(pkgs_dir), 'pkg-locks', leaf + '.lock'),
+        what='use of pkg {}'.format(leaf))
+
 def good_pkg_dir(pkg_dir):
     """Determines that a pkg_dir has all binaries needed to run."""
     for file in ('lib/libmodele.so', 'bin/modelexe'):
@@ -50,7 +84,7 @@ def set_link(src, dst):
     """Like doing ln -s src dst"""
     print('set_link', src, dst)
     if os.path.islink(dst):
-        if os.path.abspath(os.path.realpath(dst)) == os.path.abspath(src):
+        if os.path.realpath(dst) == os.path.realpath(src):
             return
         os.remove(dst)
     src_rel = os.path.relpath(src, start=os.path.split(dst)[0])
@@ -72,7 +106,314 @@ def read_cmake_cache(fname):
 
     return vars
 
-def setup(run, rundeck=None, src=None, pkgbuild=False, rebuild=False, jobs=None, unpack=True, python='python3', pythonpath=None, extra_cmake_args=[], build=True):
+# Kept in a run's config/ repo by `ectl setup`, so managing the rundeck
+# needs no git commands when nothing changed:
+#   upstream: The flattened rundeck last merged in (the merge base)
+#   committed: config_digest() of what was last committed (or None)
+MERGE_STATE = os.path.join('.git', 'ectl-merge.json')
+
+def flatten_rundeck(rundeck, template_path):
+    """Returns a rundeck with its #includes expanded, as [line]."""
+    return [line.raw for line in legacy.preprocessor(rundeck, template_path)]
+
+def config_digest(config_dir):
+    """Digest of the files in config/ that setup commits."""
+    hash = hashlib.md5()
+    leaves = ['rundeck.R'] + sorted(x for x in os.listdir(config_dir) if x.endswith('.cdl'))
+    for leaf in leaves:
+        with open(os.path.join(config_dir, leaf), 'rb') as fin:
+            contents = fin.read()
+        hash.update('{}:{}:'.format(leaf, len(contents)).encode())
+        hash.update(contents)
+    return hash.hexdigest()
+
+def read_merge_state(config_dir):
+    try:
+        with open(os.path.join(config_dir, MERGE_STATE), 'r') as fin:
+            return json.load(fin)
+    except (IOError, ValueError):
+        return None
+
+def write_merge_state(config_dir, upstream, committed):
+    with ioutil.AtomicOverwrite(os.path.join(config_dir, MERGE_STATE)) as fout:
+        json.dump({'upstream': upstream, 'committed': committed}, fout.out)
+        fout.commit()
+
+def merge_upstream(config_dir, user, rundeck, template_path, git):
+    """Merges upstream changes to a rundeck into the user's rundeck.R,
+    in memory; nothing is written.
+    user: [line]
+        Contents of config_dir/rundeck.R
+    Returns: (upstream, merged, nconflicts)
+        merged: [line]; None if the rundeck is unchanged upstream"""
+    state = read_merge_state(config_dir)
+    if state is None:
+        # Set up by an older ectl; the merge base is on the upstream branch
+        base = subprocess.check_output(git.exe + ['show', 'upstream:rundeck.R'],
+            cwd=config_dir, universal_newlines=True).splitlines(True)
+    else:
+        base = state['upstream']
+
+    upstream = flatten_rundeck(rundeck, template_path)
+    if upstream == base:
+        return upstream, None, 0
+    merged, nconflicts = rundeck_merge.merge_rundecks(base, user, upstream)
+    return upstream, merged, nconflicts
+
+def merge_rundeck(rundeck, template_path, git):
+    """Merges upstream changes to a rundeck (eg: from an updated
+    template) into the user's rundeck.R.  Runs in config/.
+    Git is used only to record changes, if there are any.
+    Returns: Number of conflicts written to rundeck.R"""
+    with open('rundeck.R', 'r') as fin:
+        user = fin.readlines()
+    if rundeck_merge.has_conflicts(user):
+        raise ValueError('rundeck.R has unresolved conflicts')
+
+    state = read_merge_state('.')
+    committed = None if state is None else state['committed']
+
+    # ----- Check in changes from user
+    if config_digest('.') != committed:
+        cdls = [x for x in os.listdir('.') if x.endswith('.cdl')]
+        if len(cdls) > 0:
+            git('add', *cdls)
+        git('commit', '-a', '-m', 'Changes from user', echo=sys.stdout, fail_on_error=False)
+
+    # ----- Merge changes from upstream
+    upstream, merged, nconflicts = merge_upstream('.', user, rundeck, template_path, git)
+    if merged is None:
+        print('Rundeck {0} unchanged upstream'.format(rundeck))
+    else:
+        print('Merged changes from {0}: {1} conflict(s)'.format(rundeck, nconflicts))
+        if merged != user:
+            with ioutil.AtomicOverwrite('rundeck.R') as fout:
+                fout.out.writelines(merged)
+                fout.commit()
+            if nconflicts == 0:
+                git('commit', '-a', '-m', 'Merged changes from {0}'.format(rundeck),
+                    echo=sys.stdout, fail_on_error=False)
+
+    write_merge_state('.', upstream, config_digest('.') if nconflicts == 0 else None)
+    return nconflicts
+
+# Records what `ectl setup` last set up a run from (in the run dir)
+SETUP_FINGERPRINT = '.setup_fingerprint.json'
+
+def setup_inputs(rundeck, src, src_digest, config_dir, build, pkg, pkg_prefix, options):
+    """Everything setup's results depend on, besides the output files
+    themselves.
+    src_digest:
+        Hash of the rundeck and source tree (see pkghash())
+    Returns: JSON-compatible dict"""
+    file_path = ectl.paths.default_file
+    inputs = {
+        'rundeck' : rundeck,
+        'src' : src,
+        'src_digest' : src_digest,
+        'config' : config_digest(config_dir),
+        # .nc files not made from a .cdl (eg: declaring setup scripts)
+        'config_nc' : [(leaf, diskcache.stat_key(os.path.join(config_dir, leaf)))
+            for leaf in sorted(os.listdir(config_dir))
+            if leaf.endswith('.nc') and not os.path.exists(os.path.join(config_dir, leaf[:-3] + '.cdl'))],
+        'build' : build,
+        'pkg' : pkg,
+        'pkg_prefix' : pkg_prefix,
+        # A new file on the path could change how input files resolve
+        'file_path' : [(dir, diskcache.stat_key(dir)) for dir in file_path],
+        'download_dir' : os.environ.get('MODELE_ORIGIN_DIR'),
+        'options' : options}
+    return json.loads(json.dumps(inputs))    # Tuples become lists
+
+def read_setup_fingerprint(run):
+    try:
+        with open(os.path.join(run, SETUP_FINGERPRINT), 'r') as fin:
+            return json.load(fin)
+    except (IOError, ValueError):
+        return None
+
+def write_setup_fingerprint(run, fingerprint, outputs):
+    fingerprint = dict(fingerprint)
+    fingerprint['outputs'] = outputs
+    with ioutil.AtomicOverwrite(os.path.join(run, SETUP_FINGERPRINT)) as fout:
+        json.dump(fingerprint, fout.out, indent=1)
+        fout.commit()
+
+def clear_setup_fingerprint(run):
+    try:
+        os.remove(os.path.join(run, SETUP_FINGERPRINT))
+    except OSError:
+        pass
+
+def needs_setup(old, new, pkg):
+    """Determines whether setup must run again, given the fingerprint
+    of the last (successful) setup.
+    Returns: Why setup is needed; or None if the run is up to date."""
+    if old is None:
+        return 'not set up before'
+    for key in sorted(new['inputs']):
+        if old['inputs'].get(key) != new['inputs'][key]:
+            return '{} changed'.format(key)
+    if new['build']:
+        if not old['build']:
+            return 'not built yet'
+        if not good_pkg_dir(pkg):
+            return 'pkg {} is not built'.format(pkg)
+    for fname in old['outputs']:
+        if not os.path.exists(fname):
+            return '{} is missing'.format(fname)
+    return None
+
+def build_pkg(rd, rundeck_R, src, build, pkg, pkg_prefix, config, pkgstore=None, pkg_hash=None, rebuild=False, jobs=None, unpack=True, python='python3', pythonpath=None, extra_cmake_args=[], jobserver=None, profile_build=False, timeline=None):
+    """Builds and installs a pkg, unless another process did so while
+    we waited for the build lock.  Uses only absolute paths (and does
+    not change directory); so it may run in a thread.
+    rundeck_R:
+        The (merged) rundeck to configure the build with.
+    pkg_prefix:
+        Where the pkg is installed (pkg, or its place in pkgstore)
+    timeline: ectl.timing.Timeline
+        Records how long each step takes."""
+    if timeline is None:
+        timeline = ectl.timing.Timeline()
+    was_good = good_pkg_dir(pkg)
+
+    # Only one process builds a given build directory at a time.
+    # Others wait, then use what it built.
+    build_lock = ectl.buildlock.BuildLock(build + '.lock', progress=build + '.progress')
+    # Keep `ectl pkgstore --gc` from removing the pkg while it is installed
+    pkg_lock = pkgstore.pkg_lock(pkg_hash) if pkgstore is not None else contextlib.nullcontext()
+    lock_start = time.time()
+    with build_lock, pkg_lock:
+        timeline.add('lock', lock_start, time.time(), after=['hash'])
+        if good_pkg_dir(pkg) and (not rebuild) and (build_lock.waited or not was_good):
+            print('Using pkg just built by another process: %s' % pkg)
+            return
+
+        # Unpack CMake build files if a modele-control.pyar file exists
+        # Only files whose contents changed are written (see ectl.unpack)
+        # if MODELE_CONTROL_PYAR does not exist, this might be an older branch
+        # that had the build files already unpack.  Proceed under that assumption...
+        modele_control_pyar = os.path.join(src, MODELE_CONTROL_PYAR)
+        if unpack and os.path.exists(modele_control_pyar):
+            with timeline.step('unpack', after=['lock']):
+                print('Adding files from modele-control.pyar')
+                print('      ', os.path.realpath(modele_control_pyar))
+                ntouched, nfiles = ectl.unpack.unpack_archive(modele_control_pyar, src,
+                    manifest=ectl.unpack.manifest_fname(config.workspace, src))
+                print('    {} of {} files changed'.format(ntouched, nfiles))
+
+        if jobs is None:
+            # number of jobs spack has to build with.
+            jobs = multiprocessing.cpu_count()
+
+        # Create the build dir if it doesn't already exist;
+        # start from a copy of the most similar build, if any.
+        build_info = ectl.buildseed.build_info(rd.build, src)
+        seed_info = None
+        from_scratch = not os.path.isdir(build)
+        if from_scratch:
+            with timeline.step('seed', after=['lock', 'unpack']):
+                seed_info = ectl.buildseed.seed_build(config.builds, build, build_info)
+        if not os.path.isdir(build):
+            os.makedirs(build)
+
+
+        # Only run CMake if no Makefile.  (If Makefile is out
+        # of date, CMake will automatically re-run with 'make'
+        # command)
+        cmake = read_cmake_cache(os.path.join(build, 'CMakeCache.txt'))
+        run_cmake = ('CMAKE_INSTALL_PREFIX:PATH' not in cmake) \
+            or (cmake['CMAKE_INSTALL_PREFIX:PATH'] != pkg_prefix) \
+            or (not os.path.exists(os.path.join(build, 'Makefile'))) \
+            or (seed_info is not None) \
+            or rebuild
+        if run_cmake:
+            print('============ CMake')
+
+            # Read the shebang out of setup.py to get around 80-char limit
+            modele_setup_py = os.path.join(src, 'modele-setup.py')
+            env = dict(os.environ)
+            cmd = [python]   # From args
+            if pythonpath is not None:
+                env['PYTHONPATH'] = pythonpath
+
+            try:
+                cmd += [modele_setup_py,
+                    '-DRUNDECK=%s' % rundeck_R,
+                    '-DRUN=%s' % rundeck_R,    # Compatibility with old builds
+                    '-DCMAKE_INSTALL_PREFIX=%s' % pkg_prefix,
+                    src]
+                cmd += extra_cmake_args
+                print('setup calling', cmd)
+                with timeline.step('cmake', after=['lock', 'unpack', 'seed']):
+                    subprocess.check_call(cmd, env=env, cwd=build)
+            except OSError as err:
+                sys.stderr.write(' '.join(cmd) + '\n')
+                sys.stderr.write('%s\n' % err)
+                raise ValueError('Problem running %s.  Have you run spack setup on your source directory?' % os.path.join(src, 'modele-setup.py'))
+
+        # Now that we have a makefile, run make!
+        print('============ Make')
+        if pkgstore is not None:
+            # Don't install over files shared with other pkgs
+            pkgstore.unshare(pkg_hash)
+        make_args = ectl.buildprof.make_args(build) if profile_build else []
+        make_start = time.time()
+        if jobserver is None:
+            ectl.buildlock.run_make(['make', 'install', '-j%d' % jobs] + make_args,
+                progress=build_lock.progress, cwd=build)
+        else:
+            with jobserver.slot():
+                ectl.buildlock.run_make(['make', 'install'] + make_args,
+                    progress=build_lock.progress, cwd=build,
+                    env=jobserver.env(), pass_fds=jobserver.fds)
+        make_seconds = time.time() - make_start
+        if profile_build:
+            ectl.buildprof.report(build)
+        timeline.add('make', make_start, make_start + make_seconds,
+            after=['lock', 'unpack', 'seed', 'cmake'])
+
+        # Record what this build is, for seeding later builds
+        old_info = ectl.buildseed.read_build_info(build)
+        if seed_info is not None:
+            ectl.buildseed.report_saved(seed_info, make_seconds)
+            build_info['seeded_from'] = seed_info['build']
+            build_info['full_make_seconds'] = seed_info.get('full_make_seconds')
+        elif from_scratch:
+            build_info['full_make_seconds'] = make_seconds
+        elif old_info is not None:
+            build_info['full_make_seconds'] = old_info.get('full_make_seconds')
+        ectl.buildseed.write_build_info(build, build_info)
+        if pkgstore is not None:
+            pkgstore.dedup(pkg_hash)
+
+def setup(*args, **kwargs):
+    """Sets up a run; see _setup() for arguments.
+    timing: bool
+        Print how long each step took, and the critical path."""
+    timing = kwargs.pop('timing', False)
+    timeline = ectl.timing.Timeline()
+    try:
+        _setup(timeline, *args, **kwargs)
+    finally:
+        if timing:
+            timeline.report()
+
+def _setup(timeline, run, rundeck=None, src=None, pkgbuild=False, rebuild=False, jobs=None, unpack=True, python='python3', pythonpath=None, extra_cmake_args=[], build=True, hash_deps=False, jobserver=None, profile_build=False, reuse_pkg=False):
+    """timeline: ectl.timing.Timeline
+        Records how long each step takes.
+    jobserver: ectl.jobserver.JobServer
+        Run make under this (shared) jobserver, rather than with -j<jobs>.
+    reuse_pkg: bool
+        Use the pkg as it is if it is good, even for a new run (eg: for
+        a sweep, once the first run of a build has built it).
+    profile_build: bool
+        Record how long make spent on each target (see ectl.buildprof).
+
+    The build starts (in a thread) as soon as the build and pkg are
+    known; input files are resolved and the run directory made while
+    it runs."""
 
     # Move parameters to different name to maintain SSA coding style below.
     args_run = run
@@ -81,6 +422,7 @@ def setup(run, rundeck=None, src=None, pkgbuild=False, rebuild=False, jobs=None,
     args_pkgbuild = pkgbuild
     args_rebuild = rebuild
     args_jobs = jobs
+    args_build = build
 
     args_run = os.path.abspath(args_run)
 
@@ -93,6 +435,8 @@ def setup(run, rundeck=None, src=None, pkgbuild=False, rebuild=False, jobs=None,
     print('    runs:   %s' % config.runs)
     print('    builds: %s' % config.builds)
     print('    pkgs:   %s' % config.pkgs)
+    if config.pkgstore is not None:
+        print('    pkgstore: %s' % config.pkgstore)
 
     # Get src, build and pkg directories the last time setup was run.
     # (None if they don't exist)
@@ -133,6 +477,7 @@ def setup(run, rundeck=None, src=None, pkgbuild=False, rebuild=False, jobs=None,
     src = new_src or old.src
     if src is None:
         raise ValueError('No source directory specified!')
+    src = os.path.abspath(src)    # The build runs while we change directory
     if (status.status > launchers.INITIAL) and (old.src is not None) and (src != old.src):
         raise ValueError('Cannot change src (to %s)' % src)
 
@@ -141,6 +486,7 @@ def setup(run, rundeck=None, src=None, pkgbuild=False, rebuild=False, jobs=None,
 
     # ===========================================
     # Construct/merge the rundeck
+    merge_start = time.time()
     git = executable.which('git')
 
     # ----- Create the rundeck repo (if it doesn't already exist)
@@ -167,15 +513,16 @@ def setup(run, rundeck=None, src=None, pkgbuild=False, rebuild=False, jobs=None,
 
             # Copy the rundeck from original location (templates?)
             print('$ <generating {0}>'.format(rundeck_R))
+            upstream = flatten_rundeck(rundeck, template_path)
             with open(rundeck_R, 'w') as fout:
-                for line in legacy.preprocessor(rundeck, template_path):
-                    fout.write(line.raw)
+                fout.writelines(upstream)
 
             git('add', 'rundeck.R', echo=sys.stdout)
             git('commit', '-a', '-m', 'Initial commit from {0}'.format(rundeck), echo=sys.stdout)
 
             # Put it on the user branch (where we normally will reside)
             git('checkout', '-b', 'user', echo=sys.stdout)
+            write_merge_state('.', upstream, config_digest('.'))
 
     else:
         # Update/merge the rundeck
@@ -183,28 +530,8 @@ def setup(run, rundeck=None, src=None, pkgbuild=False, rebuild=False, jobs=None,
 
         with ectl.util.working_dir(config_dir):
             try:
-                # ----- Check in changes from user
-                git('checkout', 'user', echo=sys.stdout)    # Exception on the first command
-
-                # Add all .cdl files
-                cdls = [x for x in os.listdir('.') if x.endswith('.cdl')]
-                if len(cdls) > 0:
-                    git('add', *cdls)
-
-                # Check in changes from user
-                git('commit', '-a', '-m', 'Changes from user', echo=sys.stdout, fail_on_error=False)
-
-                # Check in changes from upstream
-                git('checkout', 'upstream', echo=sys.stdout)
-                # Copy the rundeck from original location (templates?)
-                with open(rundeck_R, 'w') as fout:
-                    for line in legacy.preprocessor(rundeck, template_path):
-                        fout.write(line.raw)
-                git('commit', '-a', '-m', 'Changes from upstream', echo=sys.stdout, fail_on_error=False)
-
-                # Merge upstream changes into user
-                git('checkout', 'user', echo=sys.stdout)
-                git('merge', 'upstream', '-m', 'Merged changes', echo=sys.stdout)    # Will raise if merge needs help
+                if merge_rundeck(rundeck, template_path, git) > 0:
+                    raise ValueError('Conflicts merging {0} into rundeck.R'.format(rundeck))
             except:
                 print('Error merging rundeck; do you have unresolved conflicts?')
 
@@ -224,12 +551,16 @@ def setup(run, rundeck=None, src=None, pkgbuild=False, rebuild=False, jobs=None,
 
                 sys.exit(1)
     print('========= END Rundeck Management')
+    timeline.add('merge', merge_start, time.time())
 
+    hash_start = time.time()
     rd = ectl.rundeck.load(rundeck_R, modele_root=src)
+    # Remembers sub-digests of rd, which does not change from here on
+    hasher = xhash.Hasher(memo=True)
     # =====================================
 
     # ------ Determine build; cannot change
-    build_hash = buildhash(rd, src)
+    build_hash = buildhash(rd, src, hasher=hasher)
     build = os.path.join(config.builds, build_hash)
     if (status.status > launchers.INITIAL) and (old.build is not None) and (build != old.build):
         raise ValueError('Cannot change build to %s', build)
@@ -238,144 +569,129 @@ def setup(run, rundeck=None, src=None, pkgbuild=False, rebuild=False, jobs=None,
     pkgbuild = args_pkgbuild or old.pkgbuild
     if pkgbuild:
         pkg = os.path.join(config.pkgs, 'pkg-' + os.path.split(build)[1])
+        # Not covered by the pkg name; needed to tell if setup is up to date
+        src_digest = pkghash(rd, src, workspace=config.workspace, deps=hash_deps, hasher=hasher)
     else:
-        pkg_hash = pkghash(rd, src)
+        pkg_hash = pkghash(rd, src, workspace=config.workspace, deps=hash_deps, hasher=hasher)
         pkg = os.path.join(config.pkgs, pkg_hash)
-
-    print('-------- New Setup:')
-    print('    rundeck: %s' % rundeck)
-    print('    src:     %s' % src)
-    print('    build:   %s' % build)
-    print('    pkg:     %s' % pkg)
-
-    # ------------- Set directory symlinks
-    set_link(rundeck, os.path.join(args_run, 'upstream.R'))
-    set_link(rundeck_R, os.path.join(args_run, 'rundeck.R'))
-    set_link(src, os.path.join(args_run, 'src'))
-    set_link(build, os.path.join(args_run, 'build'))
-    set_link(pkg, os.path.join(args_run, 'pkg'))
-
-
-    # ------------------ Download input files
-    with ioutil.pushd(args_run):
-        download_dir = os.environ['MODELE_ORIGIN_DIR']
-        good = ectl.cdlparams.resolve_cdls_in_dir(os.path.join(args_run, 'config'), download_dir=download_dir)
-
-        rd.params.files.resolve(
-            file_path=ectl.paths.default_file,
-            download_dir=download_dir)
-
-        if not good:
-            raise Exception('Problem resolving one or more input filesnames')
-
-
-    # ---------- Create rundir (including input files, now downloaded)
-    # (Just so the user can see what it will be; this is
-    # re-done in launch.py)
-    print('xxxxxxxxxxxxxxxxxx rundir ',args_run)
-    rundir.make_rundir(rd, args_run)
-
-    # ---- Create data file symlinks and I file
-
-    # Initial calls to `ectl setup` should not build; because the user
-    # will likely need to edit `rundeck.R`
-    if not build:
+        src_digest = pkg_hash
+
+    # (Holding the pkg's use lock until the run links to it, so
+    # prebuild cannot evict the pkg meanwhile)
+    with pkg_use_lock(pkg):
+        # ------ Use the shared pkg store, if configured
+        # pkg_prefix is where the pkg is actually installed.
+        pkgstore = None
+        pkg_prefix = pkg
+        if (config.pkgstore is not None) and (not pkgbuild):
+            if os.path.isdir(pkg) and (not os.path.islink(pkg)) and good_pkg_dir(pkg):
+                print('Keeping local pkg (built before pkgstore was configured)')
+            else:
+                pkgstore = ectl.pkgstore.PkgStore(config.pkgstore)
+                pkg_prefix = pkgstore.link(pkg_hash, pkg, ectl_root=config.ectl)
+
+        timeline.add('hash', hash_start, time.time(), after=['merge'])
+
+        print('-------- New Setup:')
+        print('    rundeck: %s' % rundeck)
+        print('    src:     %s' % src)
+        print('    build:   %s' % build)
+        print('    pkg:     %s' % pkg)
+
+        # ------------- Set directory symlinks
+        set_link(rundeck, os.path.join(args_run, 'upstream.R'))
+        set_link(rundeck_R, os.path.join(args_run, 'rundeck.R'))
+        set_link(src, os.path.join(args_run, 'src'))
+        set_link(build, os.path.join(args_run, 'build'))
+        set_link(pkg, os.path.join(args_run, 'pkg'))
+
+
+    # ------------- Nothing to do if nothing changed since the last setup
+    fingerprint = {
+        'inputs' : setup_inputs(rundeck, src, src_digest, config_dir, build, pkg, pkg_prefix,
+            [pkgbuild, unpack, python, pythonpath, extra_cmake_args]),
+        'build' : args_build}
+    why = needs_setup(read_setup_fingerprint(args_run), fingerprint, pkg)
+    if args_rebuild:
+        why = '--rebuild'
+    if why is None:
+        print('Setup is up to date; nothing to do')
         return
-
-    # ================ Part 2: The Build
+    print('Setting up: {}'.format(why))
+    clear_setup_fingerprint(args_run)
 
     # ------ Re-build only if our pkg is not good
-    if args_rebuild or pkgbuild or (not good_pkg_dir(pkg)) or (old.pkg is None):
+    # (A good pkg from the shared store was built by someone else; use it.)
+    # The build runs in a thread, while input files are resolved.
+    must_build = args_rebuild or pkgbuild or (not good_pkg_dir(pkg)) \
+        or (old.pkg is None and pkgstore is None and not reuse_pkg)
+    # (Not a `with` block: if the inputs fail, that must be reported
+    # now, not after the build finishes.)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    try:
+        build_future = None
+        if args_build and must_build:
+            build_future = executor.submit(build_pkg, rd, rundeck_R, src, build, pkg, pkg_prefix, config,
+                pkgstore=pkgstore, pkg_hash=pkg_hash if pkgstore is not None else None,
+                rebuild=args_rebuild, jobs=args_jobs, unpack=unpack, python=python,
+                pythonpath=pythonpath, extra_cmake_args=extra_cmake_args, jobserver=jobserver,
+                profile_build=profile_build, timeline=timeline)
 
         try:
+            # ------------------ Download input files
+            with timeline.step('inputs', after=['hash']):
+                with ioutil.pushd(args_run):
+                    download_dir = os.environ['MODELE_ORIGIN_DIR']
+                    file_path = pathutil.PathIndex(ectl.paths.default_file,
+                        index_file=pathutil.index_fname(config.workspace))
+                    good = ectl.cdlparams.resolve_cdls_in_dir(os.path.join(args_run, 'config'),
+                        download_dir=download_dir, search_path=file_path)
+
+                    rd.params.files.resolve(
+                        file_path=file_path,
+                        download_dir=download_dir)
+
+                    if not good:
+                        raise Exception('Problem resolving one or more input filesnames')
+
+
+            # ---------- Create rundir (including input files, now downloaded)
+            # (Just so the user can see what it will be; this is
+            # re-done in launch.py)
+            with timeline.step('rundir', after=['inputs']):
+                rundir.make_rundir(rd, args_run)
+        except Exception as e:
+            if build_future is not None:
+                tty.error(str(e))
+                if not build_future.done():
+                    print('Waiting for the build to finish before exiting...')
+                build_error = build_future.exception()
+                if build_error is not None:
+                    tty.error('The build failed too: {}'.format(build_error))
+            raise
+
+        outputs = [os.path.join(args_run, 'I')] \
+            + [param.rval for param in rd.params.files.values()] \
+            + [os.path.splitext(os.path.join(config_dir, x))[0] + '.nc'
+                for x in os.listdir(config_dir) if x.endswith('.cdl')]
+
+        # Initial calls to `ectl setup` should not build; because the user
+        # will likely need to edit `rundeck.R`
+        if not args_build:
+            write_setup_fingerprint(args_run, fingerprint, outputs)
+            return
 
-            # Unpack CMake build files if a modele-control.pyar file exists
-            # Do not overwrite existing build files
-            with ectl.util.working_dir(src):
-                # if MODELE_CONTROL_PYAR does not exist, this might be an older branch
-                # that had the build files already unpack.  Proceed under that assumption...
-                if unpack and os.path.exists(MODELE_CONTROL_PYAR):
-                    print('Adding files from modele-control.pyar')
-                    print('      ', os.path.realpath(MODELE_CONTROL_PYAR))
-                    with open(MODELE_CONTROL_PYAR) as fin:
-                        pyar.unpack_archive(fin, '.')
-
-                if args_jobs is None:
-                    # number of jobs spack has to build with.
-                    jobs = multiprocessing.cpu_count()
-                else:
-                    jobs = args_jobs
-
-                # Create the build dir if it doesn't already exist
-                if not os.path.isdir(build):
-                    os.makedirs(build)
-                os.chdir(build)
-
-
-                # Only run CMake if no Makefile.  (If Makefile is out
-                # of date, CMake will automatically re-run with 'make'
-                # command)
-                print('xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx', pkg)
-                cmake = read_cmake_cache(os.path.join(pkg, 'CMakeCache.txt'))
-                run_cmake = ('CMAKE_INSTALL_PREFIX:PATH' not in cmake) \
-                    or (cmake['CMAKE_INSTALL_PREFIX:PATH'] != pkg) \
-                    or (not os.path.exists('Makefile')) \
-                    or args_rebuild
-                if run_cmake:
-                    print('============ CMake')
-
-                    # Read the shebang out of setup.py to get around 80-char limit
-                    modele_setup_py = os.path.join(src, 'modele-setup.py')
-                    env = dict(os.environ)
-                    cmd = [python]   # From args
-                    if pythonpath is not None:
-                        env['PYTHONPATH'] = pythonpath
-
-                    try:
-                        cmd += [modele_setup_py,
-                            '-DRUNDECK=%s' % rundeck_R,
-                            '-DRUN=%s' % rundeck_R,    # Compatibility with old builds
-                            '-DCMAKE_INSTALL_PREFIX=%s' % pkg,
-                            src]
-                        cmd += extra_cmake_args
-                        print('setup calling', cmd)
-                        subprocess.check_call(cmd, env=env)
-                    except OSError as err:
-                        sys.stderr.write(' '.join(cmd) + '\n')
-                        sys.stderr.write('%s\n' % err)
-                        raise ValueError('Problem running %s.  Have you run spack setup on your source directory?' % os.path.join(src, 'modele-setup.py'))
-
-                # Now that we have a makefile, run make!
-                print('============ Make')
-                subprocess.check_call(['make', 'install', '-j%d' % jobs])
-        finally:
-            if False:
-                # Remove files from modele-control.pyar
-                if os.path.exists(MODELE_CONTROL_PYAR):
-                    print('Removing files from modele-control.pyar')
-                    with open(MODELE_CONTROL_PYAR) as fin:
-                        for fname in pyar.list_archive(fin):
-                            # print('Removing %s' % fname)
-                            try:
-                                os.remove(fname)
-                            except OSError:
-                                pass
-
+        # ------------------ Join the build
+        if build_future is not None:
+            if not build_future.done():
+                print('Waiting for the build to finish...')
+            build_future.result()    # Re-raises any build error
+    finally:
+        executor.shutdown(wait=True)
 
     # ---- Run setup scripts...
-    for fname in os.listdir(os.path.join(args_run, 'config')):
-        if not fname.endswith('.nc'):
-            continue
-
-        # Obtain list of setup functions we need to call
-        setup_fns = list()
-        with netCDF4.Dataset(os.path.join(args_run, 'config', fname), 'r') as nc:
-            setups = nc.variables['setups']
-            for attr in setups.ncattrs():
-                path = getattr(setups, attr).split('.')
-                module = importlib.import_module('.'.join(path[:-1]))
-                setup_fns.append(getattr(module, path[-1]))
-
-        with ioutil.pushd(args_run):
-            for setup_fn in setup_fns:
-                setup_fn(args_run, rd)
+    with timeline.step('hooks', after=['rundir', 'make', 'lock']):
+        ectl.hooks.run_hooks(
+            ectl.hooks.list_hooks(os.path.join(args_run, 'config')), args_run, rd)
+
+    write_setup_fingerprint(args_run, fingerprint, outputs)
@@ -1,9 +1,21 @@
 import os
 import re
+import json
+import hashlib
+import time
+import concurrent.futures
 from ectl import xhash
+from giss import ioutil
 
 badRE = re.compile(r"\.git|\..*|doc|aux|init_cond|tests|pyext|pylib|decks|\.DS_Store|\.#.*|a\.out|.*\.o|modele-setup\.py|.*~|.*\.nc")
 
+# Size of binary chunks read when fingerprinting a file
+CHUNK_SIZE = 1 << 20
+
+# Files modified this recently (seconds) are not trusted in the
+# manifest: they could be changed again within the same mtime tick.
+RACY_SECONDS = 2.
+
 def list_src_files(src_dir):
     # Add build files in top-level ModelE directory (above model/)
     modele_control = os.path.join(src_dir, 'modele-control.pyar')
@@ -19,16 +31,221 @@ def list_src_files(src_dir):
                     yield os.path.join(root, file)
 
 
-def update_hash(src_dir, hash):
-    """Hashes an entire ModelE source directory"""
-    src_files = sorted(list_src_files(src_dir))
-    for file in src_files:
-        fname = os.path.join(src_dir, file)
-        with open(fname) as fin:
+def file_digest(fname):
+    """md5 of a file's contents, read in binary chunks."""
+    hash = hashlib.md5()
+    with open(fname, 'rb') as fin:
+        while True:
+            buf = fin.read(CHUNK_SIZE)
+            if not buf:
+                break
+            hash.update(buf)
+    return hash.hexdigest()
+
+def manifest_fname(workspace, src_dir):
+    """Name of the fingerprint manifest for a source directory,
+    stored in the ectl workspace."""
+    key = hashlib.md5(os.path.realpath(src_dir).encode()).hexdigest()
+    return os.path.join(workspace, 'srcdirs', key + '.json')
+
+def load_manifest(fname):
+    """Reads a manifest: {relpath : (size, mtime_ns, inode, digest)}"""
+    try:
+        with open(fname, 'r') as fin:
+            return {k : tuple(v) for k,v in json.load(fin).items()}
+    except (IOError, ValueError):
+        return dict()
+
+def save_manifest(manifest, fname):
+    try:
+        os.makedirs(os.path.split(fname)[0])
+    except OSError:
+        pass
+    with ioutil.AtomicOverwrite(fname) as fout:
+        json.dump(manifest, fout.out)
+        fout.commit()
+
+def fingerprint(src_dir, manifest=None, jobs=None):
+    """Computes the digest of every source file in a ModelE source directory.
+
+    manifest: str
+        Name of the fingerprint manifest file.  Files whose
+        (size, mtime_ns, inode) matches the manifest are not re-read.
+        If None, every file is re-read.
+    jobs: int
+        Number of threads used to hash changed files.
+    Returns: [(relpath, digest)], sorted by relpath."""
+
+    old = dict() if manifest is None else load_manifest(manifest)
+
+    now_ns = int(time.time() * 1e9)
+    racy_ns = int(RACY_SECONDS * 1e9)
+    new = dict()
+    digests = dict()
+    stale = list()
+    for fname in list_src_files(src_dir):
+        relpath = os.path.relpath(fname, src_dir)
+        st = os.stat(fname)
+        stat_key = (st.st_size, st.st_mtime_ns, st.st_ino)
+        entry = old.get(relpath)
+        if entry is not None and tuple(entry[:3]) == stat_key:
+            digests[relpath] = entry[3]
+            new[relpath] = entry
+        else:
+            stale.append((relpath, stat_key))
+
+    # Hash changed files in parallel (hashlib releases the GIL)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs or 8) as pool:
+        futures = [(relpath, stat_key,
+            pool.submit(file_digest, os.path.join(src_dir, relpath)))
+            for relpath,stat_key in stale]
+        for relpath,stat_key,future in futures:
             try:
-                code = fin.read()
-                xhash.update(code, hash)
+                digest = future.result()
             except:
-                print('Error hashing file %s' % fname)
+                print('Error hashing file %s' % os.path.join(src_dir, relpath))
                 raise
+            digests[relpath] = digest
+            if now_ns - stat_key[1] > racy_ns:
+                new[relpath] = stat_key + (digest,)
+
+    if manifest is not None and (len(stale) > 0 or len(new) != len(old)):
+        save_manifest(new, manifest)
+
+    return sorted(digests.items())
+
+# ------------------------------------------------------------
+# Dependency-aware hashing: only the sources a rundeck compiles
+
+FORTRAN_EXTS = ('.f', '.F', '.f90', '.F90')
+INCLUDE_EXTS = ('.h', '.inc')
+
+fmoduleRE = re.compile(r'^\s*module\s+(\w+)\s*(?:!.*)?$', re.IGNORECASE|re.MULTILINE)
+fuseRE = re.compile(r'^\s*use\s*(?:,\s*\w+\s*)?(?:::)?\s*(\w+)', re.IGNORECASE|re.MULTILINE)
+fincludeRE = re.compile(r'^\s*#?\s*include\s*[\'"]([^\'"]+)[\'"]', re.IGNORECASE|re.MULTILINE)
+
+def scan_fortran(fname):
+    """Scans a Fortran source or include file for dependencies.
+    Returns: (modules defined, modules used, files included)
+        All module names are lower-case."""
+    with open(fname, 'rb') as fin:
+        code = fin.read().decode('latin-1')
+    modules = sorted(set(x.lower() for x in fmoduleRE.findall(code)))
+    uses = sorted(set(x.lower() for x in fuseRE.findall(code)))
+    includes = sorted(set(fincludeRE.findall(code)))
+    return modules, uses, includes
+
+def _is_code(relpath):
+    return os.path.splitext(relpath)[1] in FORTRAN_EXTS + INCLUDE_EXTS
+
+def dependency_closure(src_dir, build, digests, scans):
+    """Determines the source files a rundeck's build depends on.
+
+    build: ectl.rundeck.Build
+        Object modules, components and defines from the rundeck
+    digests: {relpath : digest}
+        Output of fingerprint()
+    scans: {digest : (modules, uses, includes)}
+        Cache of scan_fortran() results; updated in place.
+    Returns: set(relpath)
+
+    Preprocessor conditionals are not evaluated: every #include and
+    USE is followed, so the closure is a superset of what is compiled.
+    (The defines themselves are part of the rundeck hash.)"""
+
+    model = 'model' + os.sep
+
+    def scan(relpath):
+        digest = digests[relpath]
+        if digest not in scans:
+            scans[digest] = scan_fortran(os.path.join(src_dir, relpath))
+        return scans[digest]
+
+    # Index of Fortran modules and include files
+    module_files = dict()
+    leaf_files = dict()
+    for relpath in digests:
+        if not (relpath.startswith(model) and _is_code(relpath)):
+            continue
+        leaf_files.setdefault(os.path.basename(relpath), list()).append(relpath)
+        if os.path.splitext(relpath)[1] in FORTRAN_EXTS:
+            for module in scan(relpath)[0]:
+                module_files.setdefault(module, list()).append(relpath)
+
+    # Build system files (outside model/, or non-code at the top of
+    # model/) are always part of the package
+    closure = set(relpath for relpath in digests
+        if not relpath.startswith(model) or
+        (os.path.dirname(relpath) == 'model' and not _is_code(relpath)))
+
+    # Object Modules: model/<name>.<ext>
+    todo = list()
+    for src in build.sources:
+        for ext in FORTRAN_EXTS:
+            relpath = os.path.join('model', src + ext)
+            if relpath in digests:
+                todo.append(relpath)
+
+    # Components: everything in model/<component>/
+    for component in build.components:
+        prefix = os.path.join('model', component) + os.sep
+        for relpath in digests:
+            if relpath.startswith(prefix):
+                if _is_code(relpath):
+                    todo.append(relpath)
+                else:
+                    closure.add(relpath)
+
+    # Follow #include and USE
+    while len(todo) > 0:
+        relpath = todo.pop()
+        if relpath in closure:
+            continue
+        closure.add(relpath)
+
+        modules, uses, includes = scan(relpath)
+        for module in uses:
+            todo += module_files.get(module, [])
+        for include in includes:
+            # Look next to the including file, then anywhere in model/
+            candidate = os.path.normpath(os.path.join(os.path.dirname(relpath), include))
+            if candidate in digests:
+                todo.append(candidate)
+            else:
+                todo += leaf_files.get(os.path.basename(include), [])
+
+    return closure
+
+def deps_fname(manifest):
+    """Name of the scan_fortran() cache kept next to a manifest."""
+    return os.path.splitext(manifest)[0] + '-deps.json'
+
+def update_hash_deps(src_dir, build, hash, manifest=None):
+    """Hashes only the part of a ModelE source directory that a
+    rundeck's build depends on (see dependency_closure())."""
+    digests = dict(fingerprint(src_dir, manifest=manifest))
+
+    scans = dict()
+    if manifest is not None:
+        scans = load_manifest(deps_fname(manifest))
+    nscans = len(scans)
+
+    closure = dependency_closure(src_dir, build, digests, scans)
+
+    if manifest is not None and len(scans) != nscans:
+        # Drop scans of file versions that no longer exist
+        live = set(digests.values())
+        save_manifest({k:v for k,v in scans.items() if k in live}, deps_fname(manifest))
+
+    for relpath in sorted(closure):
+        xhash.update(relpath, hash)
+        xhash.update(digests[relpath], hash)
 
+def update_hash(src_dir, hash, manifest=None):
+    """Hashes an entire ModelE source directory.
+    manifest:
+        Fingerprint manifest used to avoid re-reading unchanged files
+        (see fingerprint()).  The result is the same with or without it."""
+    for relpath,digest in fingerprint(src_dir, manifest=manifest):
+        xhash.update(relpath, hash)
+        xhash.update(digest, hash)
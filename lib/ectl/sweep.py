@@ -0,0 +1,217 @@
+"""Sets up ensembles of runs that differ only in their parameters.
+
+A sweep starts from a base run (already set up, at least with
+--nobuild) and a parameter table, one run per row:
+
+    run      DTsrc   U00a    KOCEAN
+    dt900    900.    0.55    1
+    dt450    450.    0.55    1
+
+Columns may be separated by whitespace or commas; lines starting with #
+are ignored.  Each run gets a copy of the base run's config/ directory,
+with the row's values appended to the &&PARAMETERS or &INPUTZ section
+of its rundeck.R.  Runs are then set up by a pool of processes, building
+each distinct build only once; every make shares a single jobserver, so
+the sweep as a whole never runs more than `jobs` compiles at once.
+"""
+from __future__ import print_function
+import os
+import re
+import sys
+import shutil
+import collections
+import multiprocessing
+import traceback
+import ectl.rundeck
+import ectl.jobserver
+import ectl.setup
+from ectl import rundir
+
+# Marks rundeck lines written by sweep; replaced when the sweep is re-run
+SWEEP_MARK = '! ectl sweep'
+
+endParametersRE = re.compile(r'\s*&&END_PARAMETERS', re.IGNORECASE)
+inputzRE = re.compile(r'\s*&INPUTZ', re.IGNORECASE)
+istartRE = re.compile(r'\s*ISTART\s*=', re.IGNORECASE)
+endNamelistRE = re.compile(r'\s*/\s*$')
+
+def read_table(fname):
+    """Reads a parameter table.
+    Returns: [(run name, OrderedDict(param -> value)), ...]"""
+    with open(fname, 'r') as fin:
+        lines = [line.strip() for line in fin]
+    lines = [line for line in lines if len(line) > 0 and not line.startswith('#')]
+    if len(lines) == 0:
+        raise ValueError('Empty parameter table: %s' % fname)
+
+    def split(line):
+        if ',' in lines[0]:
+            return [x.strip() for x in line.split(',')]
+        return line.split()
+
+    header = split(lines[0])
+    rows = list()
+    for lineno,line in enumerate(lines[1:]):
+        words = split(line)
+        if len(words) != len(header):
+            raise ValueError('%s: row %d has %d columns, header has %d' %
+                (fname, lineno+1, len(words), len(header)))
+        rows.append((words[0], collections.OrderedDict(zip(header[1:], words[1:]))))
+    return rows
+
+def override_rundeck(rundeck_R, params, inputz):
+    """Sets parameters in a rundeck.R, replacing values set by an
+    earlier sweep.
+    params, inputz: {name : value}
+        Values for the &&PARAMETERS and &INPUTZ sections, as they would
+        be written in the rundeck."""
+
+    with open(rundeck_R, 'r') as fin:
+        lines = [line for line in fin if not line.rstrip().endswith(SWEEP_MARK)]
+
+    # INPUTZ values go before ISTART; values after it are for cold starts.
+    iinputz = None
+    for i,line in enumerate(lines):
+        if inputzRE.match(line):
+            iinputz = i
+        elif iinputz is not None and (
+            istartRE.match(line.partition('!')[0]) or endNamelistRE.match(line)):
+            iinputz = i
+            break
+    if len(inputz) > 0:
+        if iinputz is None:
+            raise ValueError('No &INPUTZ namelist in %s' % rundeck_R)
+        lines[iinputz:iinputz] = [' %s=%s,    %s\n' % (name, value, SWEEP_MARK)
+            for name,value in inputz.items()]
+
+    iend = next((i for i,line in enumerate(lines) if endParametersRE.match(line)), None)
+    if len(params) > 0:
+        if iend is None:
+            raise ValueError('No &&END_PARAMETERS in %s' % rundeck_R)
+        lines[iend:iend] = ['%s=%s    %s\n' % (name, value, SWEEP_MARK)
+            for name,value in params.items()]
+
+    with open(rundeck_R, 'w') as out:
+        out.write(''.join(lines))
+
+def generate_runs(base, table, runs_dir):
+    """Creates run directories for a sweep from a base run.
+    Returns: [run directory, ...]"""
+    base = rundir.FollowLinks(base)
+    if base.rundeck is None or base.src is None:
+        raise ValueError('Base run %s has not been set up' % base.run)
+
+    base_config = os.path.join(base.run, 'config')
+    rd = ectl.rundeck.load(os.path.join(base_config, 'rundeck.R'), modele_root=base.src)
+    namelist_params = set(rd.params.inputz.keys()) | set(rd.params.inputz_cold.keys())
+
+    runs = list()
+    for name,values in read_table(table):
+        run = os.path.join(runs_dir, name)
+        config_dir = os.path.join(run, 'config')
+        if not os.path.exists(config_dir):
+            print('Creating run %s' % run)
+            shutil.copytree(base_config, config_dir, symlinks=True)
+
+        params = collections.OrderedDict()
+        inputz = collections.OrderedDict()
+        for pname,value in values.items():
+            if pname.upper() in namelist_params:
+                inputz[pname.upper()] = value
+            else:
+                params[pname] = value
+        override_rundeck(os.path.join(config_dir, 'rundeck.R'), params, inputz)
+        runs.append(run)
+    return runs
+
+# ----------------------------------------------------------
+# State shared with pool workers (inherited through fork)
+_jobserver = None
+_setup_kwargs = None
+
+def _setup_run(job):
+    """Sets up one run in a pool worker, logging to <run>/setup.log.
+    job: (run, reuse_pkg)
+    Returns: (run, error message or None)"""
+    run, reuse_pkg = job
+    log = os.path.join(run, 'setup.log')
+    with open(log, 'w') as out:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(out.fileno(), 1)
+        os.dup2(out.fileno(), 2)
+        try:
+            ectl.setup.setup(run, jobserver=_jobserver, reuse_pkg=reuse_pkg, **_setup_kwargs)
+            return run, None
+        except BaseException:
+            traceback.print_exc()
+            return run, 'setup failed; see %s' % log
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+
+def build_groups(runs, src):
+    """Groups runs by build hash (of their rundecks, before setup merges
+    them with upstream changes; close enough to order the builds)."""
+    groups = collections.OrderedDict()
+    for run in runs:
+        rd = ectl.rundeck.load(os.path.join(run, 'config', 'rundeck.R'), modele_root=src)
+        groups.setdefault(ectl.setup.buildhash(rd, src), []).append(run)
+    return groups
+
+def sweep(base, table, runs_dir=None, procs=None, jobs=None, **kwargs):
+    """Creates and sets up all runs of a sweep.
+    base:
+        Base run directory
+    table:
+        Name of parameter table file
+    runs_dir:
+        Where to put the runs (default: next to the base run)
+    procs:
+        Number of runs to set up at once
+    jobs:
+        Total number of compile jobs, across all builds
+    kwargs:
+        Passed on to ectl.setup.setup()
+    Returns: [(run, error message), ...] for runs that failed"""
+    global _jobserver, _setup_kwargs
+
+    base = os.path.abspath(base)
+    if runs_dir is None:
+        runs_dir = os.path.dirname(base)
+    ncpu = multiprocessing.cpu_count()
+    procs = procs or min(ncpu, 8)
+    jobs = jobs or ncpu
+
+    old = rundir.FollowLinks(base)
+    runs = generate_runs(base, table, runs_dir)
+    groups = build_groups(runs, old.src)
+    print('Sweep: %d runs, %d distinct builds' % (len(runs), len(groups)))
+
+    _jobserver = ectl.jobserver.JobServer(jobs)
+    _setup_kwargs = dict(kwargs, rundeck=old.rundeck, src=old.src)
+    try:
+        # Build each distinct build once, then set up the rest; they
+        # find their pkg already built, and use it without running make.
+        leaders = [(group[0], False) for group in groups.values()]
+        followers = [(run, True) for group in groups.values() for run in group[1:]]
+
+        failed = list()
+        ctx = multiprocessing.get_context('fork')
+        for phase in (leaders, followers):
+            if len(phase) == 0:
+                continue
+            pool = ctx.Pool(min(procs, len(phase)), maxtasksperchild=1)
+            try:
+                for run,err in pool.imap_unordered(_setup_run, phase):
+                    print('    %s: %s' % (run, err or 'OK'))
+                    if err is not None:
+                        failed.append((run, err))
+            finally:
+                pool.close()
+                pool.join()
+    finally:
+        _jobserver.close()
+        _jobserver = None
+
+    return failed
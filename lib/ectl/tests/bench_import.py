@@ -0,0 +1,46 @@
+"""Measures how long `ectl <command>` spends importing modules,
+using the output of `python -X importtime`.
+
+Usage: python -m ectl.tests.bench_import [command ...]
+(Defaults to all commands.)
+"""
+from __future__ import print_function
+import subprocess
+import sys
+import os
+import ectl.cmd
+
+def import_times(module):
+    """Imports module in a fresh interpreter.
+    Returns: [(cumulative microseconds, module name)] for the modules
+        imported at top level, largest first."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(sys.path)
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+        stderr=subprocess.PIPE, env=env, universal_newlines=True)
+    ret = list()
+    for line in proc.stderr.split('\n'):
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative, name = line[len('import time:'):].split('|')
+        if not cumulative.strip().isdigit():
+            continue    # Header line
+        # Only top-level imports; their times include their children's
+        if name.startswith('  ') or name.strip() == 'site':
+            continue
+        ret.append((int(cumulative), name.strip()))
+    ret.sort(reverse=True)
+    return ret
+
+def main(cmds):
+    if len(cmds) == 0:
+        cmds = ectl.cmd.commands
+
+    for cmd in cmds:
+        times = import_times('ectl.cmd.' + cmd)
+        total = sum(t for t,_ in times)
+        print('%-14s %7.1f ms   (%s)' % (cmd, total*1e-3,
+            ', '.join('%s %.1f' % (name, t*1e-3) for t,name in times[:3])))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
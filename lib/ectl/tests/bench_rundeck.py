@@ -0,0 +1,73 @@
+"""Benchmarks parsing of legacy rundecks: the original regex-per-line
+pipeline vs. the single-pass parser, cold (nothing memoized) and warm
+(lines seen before, as when loading many rundecks of a sweep); and a
+full rundeck.load() parsed cold vs. from the on-disk cache.
+
+The cold speedup is the one that counts for a single `ectl` command;
+the warm one comes from the memo, not from faster parsing.
+
+Usage: python -m ectl.tests.bench_rundeck [rundeck.R ...]
+(Defaults to the rundecks in this directory.)
+"""
+from __future__ import print_function
+from ectl import rundeck
+from ectl.rundeck import legacy
+from ectl.tests import test_legacy
+import tempfile
+import shutil
+import timeit
+import time
+import sys
+import os
+
+srcdir = os.path.dirname(os.path.abspath(__file__))
+
+def main(fnames):
+    if len(fnames) == 0:
+        fnames = [os.path.join(srcdir, x) for x in ('rundeck1a.R', 'rundeck2.R')]
+
+    for fname in fnames:
+        raws = [line.raw for line in legacy.preprocessor(fname, [os.path.dirname(fname)])]
+        def lines():
+            return iter([legacy.Line(fname, i, raw) for i,raw in enumerate(raws)])
+
+        def cold():
+            legacy._memo.clear()
+            legacy.LegacyRundeck(lines())
+
+        number = 200
+        def bench(fn):
+            return min(timeit.repeat(fn, number=number, repeat=5)) / number
+        overhead = bench(lines)
+        regex = bench(lambda: test_legacy.reference_rundeck(lines())) - overhead
+        tcold = bench(cold) - overhead
+        twarm = bench(lambda: legacy.LegacyRundeck(lines())) - overhead
+
+        print('%s (%d lines)' % (fname, len(raws)))
+        print('    regex pipeline  %8.1f us' % (regex*1e6))
+        print('    single-pass     %8.1f us  (%.1fx cold)' % (tcold*1e6, regex/tcold))
+        print('    memo hits       %8.1f us  (%.1fx; lines seen before)' % (twarm*1e6, regex/twarm))
+
+        # Whole load(), as the first thing a new `ectl` process does
+        tmp = tempfile.mkdtemp()
+        try:
+            config = os.path.join(tmp, 'config')
+            os.mkdir(config)
+            rundeck_R = os.path.join(config, 'rundeck.R')
+            shutil.copy(fname, rundeck_R)
+            t = time.time() - 10.
+            for x in (rundeck_R, config):
+                os.utime(x, (t,t))
+            def load_cold():
+                legacy._memo.clear()
+                rundeck.load(rundeck_R, template_path=[], cache=False)
+            rundeck.load(rundeck_R, template_path=[])    # Fill the cache
+            tload = bench(load_cold)
+            tcached = bench(lambda: rundeck.load(rundeck_R, template_path=[]))
+        finally:
+            shutil.rmtree(tmp)
+        print('    load()          %8.1f us' % (tload*1e6))
+        print('    load(), cached  %8.1f us  (%.1fx)' % (tcached*1e6, tload/tcached))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
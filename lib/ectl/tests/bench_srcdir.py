@@ -0,0 +1,58 @@
+"""Benchmark of ModelE source directory hashing, cold vs. warm manifest.
+
+Usage: python -m ectl.tests.bench_srcdir [nfiles]
+"""
+from __future__ import print_function
+from ectl import srcdir
+import hashlib
+import tempfile
+import shutil
+import time
+import sys
+import os
+
+def make_tree(src_dir, nfiles):
+    """Creates a synthetic ModelE-like source tree."""
+    with open(os.path.join(src_dir, 'CMakeLists.txt'), 'w') as out:
+        out.write('project(modele)\n')
+    for i in range(nfiles):
+        subdir = os.path.join(src_dir, 'model', 'comp%02d' % (i % 50))
+        if not os.path.isdir(subdir):
+            os.makedirs(subdir)
+        with open(os.path.join(subdir, 'FILE%04d.F90' % i), 'w') as out:
+            out.write(('      subroutine s%d\n' % i) * (20 + i % 200))
+
+def timed_hash(src_dir, manifest):
+    hash = hashlib.md5()
+    t0 = time.time()
+    srcdir.update_hash(src_dir, hash, manifest=manifest)
+    return time.time() - t0, hash.hexdigest()
+
+def main(nfiles=5000):
+    tmp = tempfile.mkdtemp()
+    try:
+        src_dir = os.path.join(tmp, 'modelE')
+        os.makedirs(src_dir)
+        make_tree(src_dir, nfiles)
+        # Put files outside the "racy" window so they enter the manifest
+        past = time.time() - 10.
+        for root, dirs, files in os.walk(src_dir):
+            for file in files:
+                os.utime(os.path.join(root, file), (past, past))
+        manifest = srcdir.manifest_fname(tmp, src_dir)
+
+        tfull, hfull = timed_hash(src_dir, None)
+        tcold, hcold = timed_hash(src_dir, manifest)
+        twarm, hwarm = timed_hash(src_dir, manifest)
+
+        print('files: %d' % nfiles)
+        print('full:  %8.3f s  %s' % (tfull, hfull))
+        print('cold:  %8.3f s  %s' % (tcold, hcold))
+        print('warm:  %8.3f s  %s' % (twarm, hwarm))
+        if not (hfull == hcold == hwarm):
+            raise ValueError('Manifest hash differs from full rehash')
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
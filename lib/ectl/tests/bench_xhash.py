@@ -0,0 +1,38 @@
+"""Micro-benchmarks of rundeck hashing.
+
+Usage: python -m ectl.tests.bench_xhash [rundeck.R ...]
+(Defaults to the rundecks in this directory.)
+"""
+from __future__ import print_function
+from ectl import xhash,rundeck
+import timeit
+import sys
+import os
+
+srcdir = os.path.dirname(os.path.abspath(__file__))
+
+def bench(label, fn, number):
+    t = min(timeit.repeat(fn, number=number, repeat=5)) / number
+    print('    %-36s %8.1f us' % (label, t*1e6))
+
+def main(fnames):
+    if len(fnames) == 0:
+        fnames = [os.path.join(srcdir, x) for x in ('rundeck1a.R', 'rundeck2.R')]
+
+    for fname in fnames:
+        rd = rundeck.load(fname)
+        print(fname)
+
+        memo_md5 = xhash.Hasher(memo=True)
+        memo_md5.hexdigest(rd)
+        memo_blake2b = xhash.Hasher('blake2b', merkle=True, memo=True)
+        memo_blake2b.hexdigest(rd)
+
+        number = 200
+        bench('xhash.hexdigest (md5)', lambda: xhash.hexdigest(rd), number)
+        bench('Hasher(blake2b, merkle)', lambda: xhash.Hasher('blake2b', merkle=True).hexdigest(rd), number)
+        bench('Hasher(md5, memo) warm', lambda: memo_md5.hexdigest(rd), number)
+        bench('Hasher(blake2b, merkle, memo) warm', lambda: memo_blake2b.hexdigest(rd), number)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,83 @@
+from ectl import buildlock
+import multiprocessing
+import unittest
+import tempfile
+import shutil
+import os
+import io
+
+# Fake `make install`: counts its runs, reports progress, then installs a pkg
+FAKE_MAKE = """#!/bin/sh
+echo run >>{tmp}/make_count
+for pct in 10 50 90; do
+    echo "[ $pct%] Building Fortran object MODELE.f.o"
+    sleep 0.3
+done
+mkdir -p {tmp}/pkg/bin
+touch {tmp}/pkg/bin/modelexe
+echo "Install the project..."
+"""
+
+def good_pkg(tmp):
+    return os.path.exists(os.path.join(tmp, 'pkg', 'bin', 'modelexe'))
+
+def setup_like(tmp, ilog):
+    """What ectl.setup.setup() does around make."""
+    out = io.StringIO()
+    lock = buildlock.BuildLock(os.path.join(tmp, 'build.lock'),
+        progress=os.path.join(tmp, 'build.progress'), poll=.1, timeout=60, out=out)
+    was_good = good_pkg(tmp)
+    with lock:
+        if not (good_pkg(tmp) and (lock.waited or not was_good)):
+            buildlock.run_make([os.path.join(tmp, 'make')], progress=lock.progress, out=out)
+    with open(os.path.join(tmp, 'log%d' % ilog), 'w') as fout:
+        fout.write(out.getvalue())
+
+class TestBuildLock(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        make = os.path.join(self.tmp, 'make')
+        with open(make, 'w') as out:
+            out.write(FAKE_MAKE.format(tmp=self.tmp))
+        os.chmod(make, 0o755)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_build_once(self):
+        """Concurrent setups run make only once."""
+        procs = [multiprocessing.Process(target=setup_like, args=(self.tmp, i))
+            for i in range(4)]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+            self.assertEqual(proc.exitcode, 0)
+
+        self.assertTrue(good_pkg(self.tmp))
+        with open(os.path.join(self.tmp, 'make_count')) as fin:
+            self.assertEqual(len(fin.readlines()), 1)
+
+        # Waiters saw the builder's progress
+        logs = list()
+        for i in range(len(procs)):
+            with open(os.path.join(self.tmp, 'log%d' % i)) as fin:
+                logs.append(fin.read())
+        waiters = [x for x in logs if 'waiting' in x]
+        self.assertEqual(len(waiters), len(procs)-1)
+        self.assertTrue(any('%]' in x for x in waiters))
+
+    def test_make_fails(self):
+        with open(os.path.join(self.tmp, 'make'), 'w') as out:
+            out.write('#!/bin/sh\necho "[ 5%] Building"\nexit 2\n')
+        progress = os.path.join(self.tmp, 'build.progress')
+        with self.assertRaises(Exception):
+            buildlock.run_make([os.path.join(self.tmp, 'make')],
+                progress=progress, out=io.StringIO())
+        with open(progress) as fin:
+            self.assertIn('exit status 2', fin.read())
+
+
+if __name__ == "__main__":
+    unittest.main()
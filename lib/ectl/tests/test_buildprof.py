@@ -0,0 +1,79 @@
+from ectl import buildprof
+from spack.util import executable
+from unittest import mock
+import unittest
+import sys
+import subprocess
+import tempfile
+import shutil
+import io
+import os
+
+# Recursive make, as in CMake-generated builds
+MAKEFILE = """all:
+\t$(MAKE) -f build.mk
+"""
+
+BUILD_MK = """m.o: m.f a.o b.o
+\t./fc -c m.f -o m.o
+a.o: a.f
+\t./fc -c a.f -o a.o
+b.o: b.f
+\t./fc -c b.f -o b.o
+"""
+
+# Fake compiler: takes as long as its source file says
+FC = """#!/bin/sh
+sleep `cat $2`
+touch $4
+"""
+
+@unittest.skipIf(executable.which('make') is None, 'make not found')
+class TestBuildProf(unittest.TestCase):
+
+    def setUp(self):
+        self.build = tempfile.mkdtemp()
+        for leaf,text in (('Makefile', MAKEFILE), ('build.mk', BUILD_MK), ('fc', FC),
+            ('a.f', '.6'), ('b.f', '.1'), ('m.f', '.2')):
+            with open(os.path.join(self.build, leaf), 'w') as out:
+                out.write(text)
+        os.chmod(os.path.join(self.build, 'fc'), 0o755)
+
+    def tearDown(self):
+        shutil.rmtree(self.build)
+
+    def test_profile(self):
+        subprocess.check_call(['make', '-s', '-j2'] + buildprof.make_args(self.build),
+            cwd=self.build)
+        jobs = buildprof.read_profile(self.build)
+        self.assertEqual(['a.o', 'b.o', 'm.o'],
+            sorted(buildprof.compiled_file(job['cmd']) for job in jobs))
+
+        tl = buildprof.timeline(jobs, self.build)
+        self.assertEqual(['a.o', 'm.o'], tl.critical_path())
+
+        out = io.StringIO()
+        buildprof.report(self.build, out=out)
+        lines = out.getvalue().split('\n')
+        self.assertIn('3 commands (3 compiles)', lines[1])
+        self.assertEqual(['a.o', 'm.o', 'b.o'], [line.split()[1] for line in lines[3:6]])
+        self.assertTrue(lines[6].startswith('Critical path: 2 commands'))
+
+        # A new profile replaces the old one
+        buildprof.make_args(self.build)
+        self.assertFalse(os.path.exists(os.path.join(self.build, buildprof.PROFILE)))
+
+    def test_python_path(self):
+        # A Spack-style interpreter path: too long for a #! line, with spaces
+        bindir = os.path.join(self.build, 'opt spack', 'x' * 200, 'bin')
+        os.makedirs(bindir)
+        python = os.path.join(bindir, 'python3')
+        os.symlink(sys.executable, python)
+        with mock.patch('sys.executable', python):
+            args = buildprof.make_args(self.build)
+        subprocess.check_call(['make', '-s', '-j2'] + args, cwd=self.build)
+        self.assertEqual(3, len(buildprof.read_profile(self.build)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+from ectl import buildseed
+import unittest
+import tempfile
+import shutil
+import os
+
+def make_info(src, sources, **defines):
+    return {'src' : src, 'sources' : sorted(sources),
+        'components' : {'shared' : {}}, 'defines' : defines}
+
+class TestBuildSeed(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.builds = os.path.join(self.tmp, 'builds')
+        self.src = os.path.join(self.tmp, 'modelE')
+        os.makedirs(self.src)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def add_build(self, name, info):
+        build = os.path.join(self.builds, name)
+        os.makedirs(os.path.join(build, 'CMakeFiles'))
+        with open(os.path.join(build, 'CMakeCache.txt'), 'w') as out:
+            out.write('CMAKE_CACHEFILE_DIR:INTERNAL=%s\n' % build)
+        with open(os.path.join(build, 'CMakeFiles', 'MODELE.f.o'), 'wb') as out:
+            out.write(b'\0\1' + build.encode())
+        os.utime(os.path.join(build, 'CMakeCache.txt'), (1e9, 1e9))
+        info = dict(info)
+        info['full_make_seconds'] = 100.
+        buildseed.write_build_info(build, info)
+        return build
+
+    def test_nearest(self):
+        sources = ['MODELE', 'ATMDYN', 'RAD_DRV']
+        b1 = self.add_build('b1', make_info(self.src, sources, NTRACERS='1', USE_ENT='YES'))
+        self.add_build('b2', make_info(self.src, sources[:1], NTRACERS='5'))
+        self.add_build('b3', make_info('/elsewhere', sources, NTRACERS='1', USE_ENT='YES'))
+
+        info = make_info(self.src, sources, NTRACERS='2', USE_ENT='YES')
+        build, sim, _ = buildseed.nearest_build(self.builds, info)
+        self.assertEqual(b1, build)
+        self.assertTrue(0 < sim < 1)
+
+    def test_seed(self):
+        info = make_info(self.src, ['MODELE'], NTRACERS='1')
+        seed = self.add_build('b1', info)
+        build = os.path.join(self.builds, 'b2')
+
+        seed_info = buildseed.seed_build(self.builds,
+            build, make_info(self.src, ['MODELE'], NTRACERS='2'), min_similarity=0.)
+        self.assertEqual(seed, seed_info['build'])
+        self.assertEqual(100., seed_info['full_make_seconds'])
+
+        # Text files relocated, with mtimes kept; binaries left alone
+        cache = os.path.join(build, 'CMakeCache.txt')
+        with open(cache) as fin:
+            self.assertEqual('CMAKE_CACHEFILE_DIR:INTERNAL=%s\n' % build, fin.read())
+        self.assertEqual(1e9, os.path.getmtime(cache))
+        with open(os.path.join(build, 'CMakeFiles', 'MODELE.f.o'), 'rb') as fin:
+            self.assertEqual(b'\0\1' + seed.encode(), fin.read())
+        self.assertIsNone(buildseed.read_build_info(build))
+
+        # The seed is untouched
+        with open(os.path.join(seed, 'CMakeCache.txt')) as fin:
+            self.assertIn(seed, fin.read())
+
+    def test_no_seed(self):
+        self.add_build('b1', make_info(self.src, ['MODELE'], NTRACERS='1'))
+        build = os.path.join(self.builds, 'b2')
+        self.assertIsNone(buildseed.seed_build(self.builds,
+            build, make_info(self.src, ['ATMDYN'], NTRACERS='2')))
+        self.assertFalse(os.path.exists(build))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,416 @@
+from ectl import download, pathutil
+import http.server
+import http.client
+import functools
+import urllib.parse
+import collections
+import multiprocessing
+import time
+import hashlib
+import socket
+import ssl
+import threading
+import unittest
+import tempfile
+import shutil
+import io
+import os
+from unittest import mock
+
+class Handler(http.server.SimpleHTTPRequestHandler):
+    """Serves files like the NCCS portal, counting connections and GETs.
+    Files have ETags, and may be requested by Range.  The first `drops`
+    responses send only `drop_after` bytes, then drop the connection.
+    Each file takes `delay` seconds to send.  Directories are listed by
+    http.server, as the portal lists them."""
+    protocol_version = 'HTTP/1.1'    # Keep-alive
+    nconnections = 0
+    drops = 0
+    drop_after = 0
+    ranges = list()
+    gets = collections.Counter()
+    delay = 0.
+
+    def setup(self):
+        Handler.nconnections += 1
+        super().setup()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        fname = self.translate_path(self.path)
+        Handler.gets[urllib.parse.unquote(self.path)] += 1
+        if not os.path.isfile(fname):
+            return super().do_GET()
+        time.sleep(Handler.delay)
+        with open(fname, 'rb') as fin:
+            data = fin.read()
+        etag = '"{}"'.format(hashlib.md5(data).hexdigest())
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        start = 0
+        range = self.headers.get('Range')
+        Handler.ranges.append(range)
+        if range is not None and self.headers.get('If-Range') == etag:
+            start = int(range[6:-1])
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, len(data)-1, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(data) - start))
+        self.end_headers()
+
+        if Handler.drops > 0:
+            Handler.drops -= 1
+            self.wfile.write(data[start:start+Handler.drop_after])
+            self.wfile.flush()
+            self.connection.shutdown(socket.SHUT_RDWR)
+            self.close_connection = True
+        else:
+            self.wfile.write(data[start:])
+
+class TestDownload(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.portal = os.path.join(self.tmp, 'portal')
+        self.download_dir = os.path.join(self.tmp, 'downloads')
+        os.makedirs(os.path.join(self.portal, 'cdl'))
+        self.files = {
+            'GIC.E046D3M20A.1DEC1955.ext.nc' : os.urandom(3 * download.BLOCK_SIZE // 2),
+            'OST_144x90.1876-1885avg.HadISST1.1' : b'sst',
+            os.path.join('cdl', 'ocean.nc') : b'',
+        }
+        for sval,data in self.files.items():
+            with open(os.path.join(self.portal, sval), 'wb') as out:
+                out.write(data)
+
+        Handler.nconnections = 0
+        Handler.drops = 0
+        Handler.ranges = list()
+        Handler.gets = collections.Counter()
+        Handler.delay = 0.
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+            functools.partial(Handler, directory=self.portal))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = 'http://127.0.0.1:{}/'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp)
+
+    def download(self, svals, **kwargs):
+        out = io.StringIO()
+        results = download.download_files(svals, self.download_dir,
+            base_url=self.base_url, out=out, **kwargs)
+        return results, out.getvalue()
+
+    def test_download_files(self):
+        svals = sorted(self.files) + ['missing.nc']
+        results, out = self.download(svals, max_workers=2)
+
+        for sval,data in self.files.items():
+            self.assertEqual(os.path.join(self.download_dir, sval), results[sval])
+            with open(results[sval], 'rb') as fin:
+                self.assertEqual(data, fin.read())
+        self.assertIsInstance(results['missing.nc'], IOError)
+        self.assertIn('missing.nc: Failed to download missing.nc: HTTP 404', out)
+        self.assertIn('Downloaded 3/4 files', out)
+        self.assertIn('; 1 failed', out)
+        self.assertEqual([], [x for x in os.listdir(self.download_dir) if x.endswith('.tmp')])
+
+        # Connections are kept open between files
+        self.assertLessEqual(Handler.nconnections, 2)
+
+    def test_failure_midway(self):
+        # An unexpected error while reading leaves the connection
+        # half-read; the next file gets a new one
+        svals = ['GIC.E046D3M20A.1DEC1955.ext.nc', 'OST_144x90.1876-1885avg.HadISST1.1']
+        readinto = http.client.HTTPResponse.readinto
+        calls = [0]
+        def failing_readinto(resp, buf):
+            calls[0] += 1
+            if calls[0] == 1:
+                raise ValueError('boom')
+            return readinto(resp, buf)
+        with mock.patch('http.client.HTTPResponse.readinto', failing_readinto):
+            results, out = self.download(svals, max_workers=1)
+        self.assertIsInstance(results[svals[0]], ValueError)
+        self.assertEqual(os.path.join(self.download_dir, svals[1]), results[svals[1]])
+        self.assertIn('Downloaded 1/2 files', out)
+        self.assertIn('; 1 failed', out)
+
+    def test_resume_ssl(self):
+        # Over HTTPS, a dropped connection shows up as an SSL error
+        sval = 'GIC.E046D3M20A.1DEC1955.ext.nc'
+        readinto = http.client.HTTPResponse.readinto
+        calls = [0]
+        def dropping_readinto(resp, buf):
+            calls[0] += 1
+            if calls[0] == 2:
+                raise ssl.SSLEOFError(8, 'EOF occurred in violation of protocol')
+            return readinto(resp, buf)
+        with mock.patch('http.client.HTTPResponse.readinto', dropping_readinto):
+            results, out = self.download([sval])
+        with open(results[sval], 'rb') as fin:
+            self.assertEqual(self.files[sval], fin.read())
+        self.assertIsNone(Handler.ranges[0])
+        self.assertTrue(Handler.ranges[1].startswith('bytes='))
+        self.assertEqual(2, Handler.nconnections)
+
+    def test_directory(self):
+        members = {
+            'ocean.nc' : b'',
+            'a b.nc' : b'ab',
+            os.path.join('sub', 'x.nc') : os.urandom(1000),
+        }
+        portal_cdl = os.path.join(self.portal, 'cdl')
+        os.makedirs(os.path.join(portal_cdl, 'sub'))
+        for name,data in members.items():
+            with open(os.path.join(portal_cdl, name), 'wb') as out:
+                out.write(data)
+        cdl = os.path.join(self.download_dir, 'cdl')
+        def check():
+            for name,data in members.items():
+                with open(os.path.join(cdl, name), 'rb') as fin:
+                    self.assertEqual(data, fin.read())
+
+        # Interrupted: nothing in place yet
+        Handler.drops = 1
+        Handler.drop_after = 1
+        old = download.RETRIES
+        download.RETRIES = 0
+        try:
+            results, out = self.download(['cdl'], labels={'cdl': 'CDLDIR'}, max_workers=1)
+        finally:
+            download.RETRIES = old
+        self.assertIsInstance(results['cdl'], Exception)
+        self.assertFalse(os.path.exists(cdl))
+        self.assertTrue(os.path.isdir(cdl + '.tmp'))
+
+        # Finished; the listing was read once per directory
+        Handler.gets.clear()
+        results, out = self.download(['cdl'], labels={'cdl': 'CDLDIR'})
+        self.assertEqual(cdl, results['cdl'])
+        self.assertFalse(os.path.exists(cdl + '.tmp'))
+        check()
+        self.assertIn('CDLDIR: Downloaded directory cdl', out)
+        self.assertEqual(1, Handler.gets['/cdl/'])
+        self.assertEqual(1, Handler.gets['/cdl/sub/'])
+        for name in members:
+            self.assertEqual(1, Handler.gets['/cdl/' + name])
+
+        # Only changed members are downloaded again
+        members['a b.nc'] = b'new'
+        with open(os.path.join(portal_cdl, 'a b.nc'), 'wb') as out:
+            out.write(members['a b.nc'])
+        progress = download.Progress(1, out=io.StringIO())
+        nfiles, nbytes, nsame = download.fetch_dir(download.ConnectionPool(),
+            download.url_of('cdl', self.base_url) + '/', cdl, progress)
+        self.assertEqual((1, 3, 2), (nfiles, nbytes, nsame))
+        check()
+
+    def test_parse_listing(self):
+        # As listed by Apache
+        html = """<h1>Index of /GISS_modelE/modelE_input_data/cdl</h1>
+<table><tr><th><a href="?C=N;O=D">Name</a></th><th><a href="?C=M;O=A">Last modified</a></th></tr>
+<tr><td><a href="/GISS_modelE/modelE_input_data/">Parent Directory</a></td></tr>
+<tr><td><a href="ocean.nc">ocean.nc</a></td><td>2016-05-02 10:00</td></tr>
+<tr><td><a href="a%20b.nc">a b.nc</a></td></tr>
+<tr><td><A HREF='sub/'>sub/</A></td></tr>
+<tr><td><a href="http://elsewhere.org/x.nc">x.nc</a></td></tr>
+</table>"""
+        self.assertEqual([('ocean.nc', False), ('a b.nc', False), ('sub', True)],
+            download.parse_listing(html, 'https://portal.nccs.nasa.gov/GISS_modelE/modelE_input_data/cdl/'))
+
+    def test_search_or_download_files(self):
+        local = os.path.join(self.tmp, 'local')
+        os.makedirs(local)
+        open(os.path.join(local, 'OST_144x90.1876-1885avg.HadISST1.1'), 'w').close()
+
+        old = download.BASE_URL
+        download.BASE_URL = self.base_url
+        try:
+            results = pathutil.search_or_download_files([
+                ('OSST', 'OST_144x90.1876-1885avg.HadISST1.1'),
+                ('GIC', 'GIC.E046D3M20A.1DEC1955.ext.nc'),
+                ('AIC', 'GIC.E046D3M20A.1DEC1955.ext.nc')],
+                [local], download_dir=self.download_dir)
+        finally:
+            download.BASE_URL = old
+        self.assertEqual({
+            'OST_144x90.1876-1885avg.HadISST1.1' : os.path.join(local, 'OST_144x90.1876-1885avg.HadISST1.1'),
+            'GIC.E046D3M20A.1DEC1955.ext.nc' : os.path.join(self.download_dir, 'GIC.E046D3M20A.1DEC1955.ext.nc')},
+            results)
+
+    def test_resume(self):
+        sval = 'GIC.E046D3M20A.1DEC1955.ext.nc'
+        fname = os.path.join(self.download_dir, sval)
+        data = self.files[sval]
+
+        # Connection drops twice; resumed each time
+        Handler.drops = 2
+        Handler.drop_after = 1000
+        results, out = self.download([sval])
+        self.assertEqual(fname, results[sval])
+        with open(fname, 'rb') as fin:
+            self.assertEqual(data, fin.read())
+        self.assertEqual([None, 'bytes=1000-', 'bytes=2000-'], Handler.ranges)
+        self.assertEqual(['GIC.E046D3M20A.1DEC1955.ext.nc', 'GIC.E046D3M20A.1DEC1955.ext.nc.ectlsum'],
+            sorted(x for x in os.listdir(self.download_dir) if not x.startswith('.')))
+        self.assertTrue(download.check_file(fname))
+
+        # Gave up; a later download picks up where this one stopped
+        os.remove(fname)
+        Handler.ranges = list()
+        Handler.drops = 1
+        old = download.RETRIES
+        download.RETRIES = 0
+        try:
+            results, out = self.download([sval])
+        finally:
+            download.RETRIES = old
+        self.assertIsInstance(results[sval], Exception)
+        self.assertEqual(1000, os.path.getsize(fname + '.tmp'))
+
+        results, out = self.download([sval])
+        with open(fname, 'rb') as fin:
+            self.assertEqual(data, fin.read())
+        self.assertEqual([None, 'bytes=1000-'], Handler.ranges)
+
+    def test_changed_while_partial(self):
+        sval = 'OST_144x90.1876-1885avg.HadISST1.1'
+        fname = os.path.join(self.download_dir, sval)
+        Handler.drops = 1
+        Handler.drop_after = 1
+        old = download.RETRIES
+        download.RETRIES = 0
+        try:
+            self.download([sval])
+        finally:
+            download.RETRIES = old
+        with open(os.path.join(self.portal, sval), 'wb') as out:
+            out.write(b'new sst')
+
+        # ETag changed: the server sends it all again
+        results, out = self.download([sval])
+        with open(fname, 'rb') as fin:
+            self.assertEqual(b'new sst', fin.read())
+
+    def test_check_file(self):
+        sval = 'OST_144x90.1876-1885avg.HadISST1.1'
+        fname = os.path.join(self.download_dir, sval)
+        self.download([sval])
+        self.assertTrue(download.check_file(fname))
+
+        # Touched, but the same
+        os.utime(fname, (1., 1.))
+        self.assertTrue(download.check_file(fname))
+
+        # Corrupted; downloaded again
+        with open(fname, 'wb') as out:
+            out.write(b'SST')
+        self.assertFalse(download.check_file(fname))
+        old = download.BASE_URL
+        download.BASE_URL = self.base_url
+        try:
+            results = pathutil.search_or_download_files([('OSST', sval)],
+                [self.download_dir], download_dir=self.download_dir)
+        finally:
+            download.BASE_URL = old
+        self.assertEqual(fname, results[sval])
+        with open(fname, 'rb') as fin:
+            self.assertEqual(b'sst', fin.read())
+
+        # Touched in a read-only download directory
+        os.utime(fname, (2., 2.))
+        with mock.patch('ectl.download._write_json', side_effect=PermissionError(13, 'Permission denied')):
+            self.assertTrue(download.check_file(fname))
+
+        # Files not downloaded by ectl are taken as they are
+        self.assertTrue(download.check_file(os.path.join(self.portal, sval)))
+
+    def test_verified_once(self):
+        sval = 'OST_144x90.1876-1885avg.HadISST1.1'
+        fname = os.path.join(self.download_dir, sval)
+        index_file = os.path.join(self.tmp, 'index.json')
+        self.download([sval])
+
+        def resolve():
+            old = download.BASE_URL
+            download.BASE_URL = self.base_url
+            try:
+                index = pathutil.PathIndex([self.download_dir], index_file=index_file)
+                return pathutil.search_or_download_files([('OSST', sval)],
+                    index, download_dir=self.download_dir)[sval]
+            finally:
+                download.BASE_URL = old
+
+        with mock.patch.dict(pathutil._verified, clear=True):
+            self.assertEqual(fname, resolve())
+        # A later process trusts the file on its stat, without the sidecar
+        with mock.patch.dict(pathutil._verified, clear=True):
+            with mock.patch('ectl.download._read_json', wraps=download._read_json) as read_json:
+                self.assertEqual(fname, resolve())
+                self.assertEqual(0, read_json.call_count)
+
+            # ...until the file changes
+            with open(fname, 'wb') as out:
+                out.write(b'SST!')
+            self.assertEqual(fname, resolve())
+        with open(fname, 'rb') as fin:
+            self.assertEqual(b'sst', fin.read())
+
+    def test_concurrent_processes(self):
+        svals = sorted(self.files)
+        Handler.delay = .3
+        old = download.LOCK_POLL
+        download.LOCK_POLL = .05
+        child_out = os.path.join(self.tmp, 'child.txt')
+        def child():
+            with open(child_out, 'w') as out:
+                download.download_files(svals, self.download_dir, base_url=self.base_url, out=out)
+        try:
+            proc = multiprocessing.get_context('fork').Process(target=child)
+            proc.start()
+            results, out = self.download(svals)
+            proc.join()
+        finally:
+            download.LOCK_POLL = old
+        self.assertEqual(0, proc.exitcode)
+        with open(child_out) as fin:
+            out += fin.read()
+
+        # Each file was downloaded once, by one process or the other
+        for sval,data in self.files.items():
+            self.assertEqual(1, Handler.gets['/' + sval])
+            with open(results[sval], 'rb') as fin:
+                self.assertEqual(data, fin.read())
+        self.assertEqual(len(svals), out.count('was downloaded by another process'))
+        hits = [int(x.split(': ')[1].split()[0]) for x in out.split('\n') if x.startswith('Download cache')]
+        self.assertEqual(len(svals), sum(hits))
+
+    def test_dedup(self):
+        for sval in ('a.nc', 'b.nc'):
+            with open(os.path.join(self.portal, sval), 'wb') as out:
+                out.write(b'same')
+        self.download(['a.nc'])
+        results, out = self.download(['b.nc'])
+        a = os.path.join(self.download_dir, 'a.nc')
+        b = results['b.nc']
+        self.assertTrue(os.path.samefile(a, b))
+        self.assertIn('b.nc: b.nc is the same as a.nc; linked', out)
+        self.assertIn('0 hits (downloaded by another process), 1 misses (1 duplicates linked)', out)
+        self.assertTrue(download.check_file(a))
+        self.assertTrue(download.check_file(b))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -14,6 +14,37 @@ class TestHash(unittest.TestCase):
         xhash.update(17, hash)
         xhash.update(('foo', 'bar'), hash)
 
+    def test_md5_compatible(self):
+        """Digests used to name existing build and pkg directories must not change."""
+        self.assertEqual(xhash.hexdigest({'a' : 5, 'b' : 4}), '6353000a95192eb03d889966f54631dd')
+        self.assertEqual(xhash.hexdigest(17), 'bc7be2a704a7361571a4865d39cf426d')
+        self.assertEqual(xhash.hexdigest([1, [2, {'q' : (3,)}]]), 'b098b13500e30cf728880cf824c4dea4')
+
+        hasher = xhash.Hasher(memo=True)
+        obj = {'a' : [1,2,3], 'b' : set(['x', 'y'])}
+        for i in range(2):
+            self.assertEqual(hasher.hexdigest(obj), xhash.hexdigest(obj))
+
+        long_str = u'\u00e9' * (3*xhash.STR_CHUNK + 5)
+        hash = hashlib.md5()
+        hash.update(b'builtinsstr')
+        hash.update(long_str.encode())
+        self.assertEqual(xhash.hexdigest(long_str), hash.hexdigest())
+
+    def test_merkle(self):
+        hasher = xhash.Hasher('blake2b', merkle=True, memo=True)
+        obj = {'a' : [1,2,3], 'b' : set(['x', 'y'])}
+        digest = hasher.hexdigest(obj)
+        self.assertEqual(digest, hasher.hexdigest(obj))
+        self.assertEqual(digest, xhash.Hasher('blake2b', merkle=True).hexdigest(obj))
+        self.assertNotEqual(digest, xhash.Hasher('blake2b', merkle=True).hexdigest({'a' : [1,2]}))
+        self.assertEqual(digest, hasher.digest(obj).hex())
+
+        # Only containers are nodes; scalars are streamed into them
+        inner = hashlib.blake2b(b'builtinslistbuiltinsint2').digest()
+        outer = hashlib.blake2b(b'builtinslistbuiltinsint1' + inner)
+        self.assertEqual(outer.hexdigest(), hasher.hexdigest([1, [2]]))
+
     def test_hash_rundeck(self):
         modele_root = os.path.join(os.environ['HOME'], 'f15', 'modelE')
         hash1a = xhash.hexdigest(rundeck.load(
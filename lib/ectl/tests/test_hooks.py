@@ -0,0 +1,96 @@
+from ectl import hooks
+import unittest
+import tempfile
+import shutil
+import time
+import os
+
+PREFIX = 'ectl.tests.test_hooks.'
+
+def log(name):
+    with open('log', 'a') as out:
+        out.write(name + '\n')
+
+@hooks.declare(inputs=['src'], outputs=['a'])
+def make_a(args_run, rd):
+    log('make_a')
+    with open('src') as fin, open('a', 'w') as out:
+        out.write(fin.read())
+
+@hooks.declare(inputs=lambda args_run, rd: ['a'], outputs=['b'])
+def make_b(args_run, rd):
+    log('make_b')
+    with open('a') as fin, open('b', 'w') as out:
+        out.write(fin.read())
+
+@hooks.declare(after=[PREFIX + 'make_b'])
+def check_b(args_run, rd):
+    log('check_b')
+
+def legacy(args_run, rd):
+    log('legacy')
+
+class TestHooks(unittest.TestCase):
+
+    def setUp(self):
+        self.run = tempfile.mkdtemp()
+        self.write('src', 'hello\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.run)
+
+    def write(self, leaf, text):
+        fname = os.path.join(self.run, leaf)
+        with open(fname, 'w') as out:
+            out.write(text)
+        t = time.time() - 10.
+        os.utime(fname, (t,t))
+
+    def run_hooks(self, *names, **kwargs):
+        log_fname = os.path.join(self.run, 'log')
+        if os.path.exists(log_fname):
+            os.remove(log_fname)
+        hooks.run_hooks([PREFIX + name for name in names], self.run, None, **kwargs)
+        if not os.path.exists(log_fname):
+            return []
+        with open(log_fname) as fin:
+            return fin.read().split()
+
+    def test_dependencies(self):
+        hks = [hooks.Hook(PREFIX + name, self.run, None)
+            for name in ('check_b', 'make_b', 'legacy', 'make_a')]
+        deps = hooks.dependencies(hks)
+        self.assertEqual({PREFIX + 'make_b'}, deps[PREFIX + 'check_b'])
+        self.assertEqual({PREFIX + 'make_a'}, deps[PREFIX + 'make_b'])
+        self.assertEqual({PREFIX + 'check_b', PREFIX + 'make_b'}, deps[PREFIX + 'legacy'])
+        self.assertEqual({PREFIX + 'legacy'}, deps[PREFIX + 'make_a'])
+
+    def test_run_hooks(self):
+        # Listed out of order; run in dependency order
+        self.assertEqual(['make_a', 'make_b', 'check_b'],
+            self.run_hooks('check_b', 'make_b', 'make_a'))
+        with open(os.path.join(self.run, 'b')) as fin:
+            self.assertEqual('hello\n', fin.read())
+
+        # Inputs unchanged: only the hook declaring no outputs runs
+        self.assertEqual(['check_b'], self.run_hooks('check_b', 'make_b', 'make_a'))
+
+        # A changed input re-runs everything downstream of it
+        self.write('src', 'goodbye\n')
+        self.assertEqual(['make_a', 'make_b', 'check_b'],
+            self.run_hooks('make_a', 'make_b', 'check_b', procs=1))
+        with open(os.path.join(self.run, 'b')) as fin:
+            self.assertEqual('goodbye\n', fin.read())
+
+        # ...as does a missing output
+        os.remove(os.path.join(self.run, 'b'))
+        self.assertEqual(['make_b', 'check_b'], self.run_hooks('make_a', 'make_b', 'check_b'))
+
+    def test_undeclared(self):
+        # Undeclared hooks run in listed order, relative to all others
+        self.assertEqual(['legacy', 'make_a', 'make_b', 'check_b'],
+            self.run_hooks('legacy', 'make_b', 'make_a', 'check_b'))
+
+
+if __name__ == "__main__":
+    unittest.main()
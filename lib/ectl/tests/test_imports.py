@@ -0,0 +1,39 @@
+import ectl.cmd
+import subprocess
+import unittest
+import sys
+import os
+
+# Modules too slow to import just to parse a command line
+HEAVY = ('netCDF4', 'numpy', 'scipy', 'ectl.setup', 'ectl.sweep', 'urllib.request')
+
+# Commands that are run often, from scripts and cron
+LIGHT_COMMANDS = ('ps', 'keepalive', 'stop', 'wait', 'env', 'setup', 'sweep')
+
+def loaded(modules):
+    """Imports modules in a fresh interpreter.
+    Returns: The HEAVY modules that got imported along with them."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(sys.path)
+    code = 'import sys\n%s\nprint(" ".join(m for m in %r if m in sys.modules))' % (
+        '\n'.join('import %s' % m for m in modules), HEAVY)
+    out = subprocess.check_output([sys.executable, '-c', code], env=env,
+        universal_newlines=True)
+    return out.split()
+
+class TestImports(unittest.TestCase):
+
+    def test_descriptions(self):
+        """Descriptions read from source match the modules'."""
+        for cmd in ('ps', 'setup', 'env', 'merge'):
+            self.assertEqual(ectl.cmd.get_module(cmd).description,
+                ectl.cmd.get_description(cmd))
+
+    def test_light_commands(self):
+        """Parsing the command line of frequent commands stays fast."""
+        for cmd in LIGHT_COMMANDS:
+            self.assertEqual([], loaded(['ectl.cmd', 'ectl.cmd.' + cmd]), cmd)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+from ectl import jobserver
+import subprocess
+import unittest
+import tempfile
+import shutil
+import os
+
+# Each target logs when it started and ended
+MAKEFILE = """all: {targets}
+%.job:
+\t@python3 -c "import time; print('start', time.time())" >> $@.log
+\t@sleep .3
+\t@python3 -c "import time; print('end', time.time())" >> $@.log
+"""
+
+class TestJobServer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_option(self):
+        self.assertEqual('--jobserver-auth', jobserver.jobserver_option((4, 3)))
+        self.assertEqual('--jobserver-auth', jobserver.jobserver_option((4, 2)))
+        self.assertEqual('--jobserver-fds', jobserver.jobserver_option((4, 1)))
+        self.assertEqual('--jobserver-fds', jobserver.jobserver_option((3, 82)))
+        with self.assertRaises(ValueError):
+            jobserver.jobserver_option((3, 77))
+        with self.assertRaises(ValueError):
+            jobserver.jobserver_option(None)    # Not GNU make
+
+    def test_not_gnu_make(self):
+        fake_make = os.path.join(self.tmp, 'make')
+        with open(fake_make, 'w') as out:
+            out.write('#!/bin/sh\necho "bmake 20200710"\n')
+        os.chmod(fake_make, 0o755)
+        self.assertIsNone(jobserver.make_version(fake_make))
+        with self.assertRaises(ValueError):
+            jobserver.JobServer(2, make=fake_make)
+
+    def test_limit(self):
+        """make runs no more jobs at once than the jobserver allows."""
+        targets = ['t%d.job' % i for i in range(6)]
+        with open(os.path.join(self.tmp, 'Makefile'), 'w') as out:
+            out.write(MAKEFILE.format(targets=' '.join(targets)))
+
+        js = jobserver.JobServer(2)
+        try:
+            self.assertIn(js.option, js.makeflags())
+            with js.slot():
+                subprocess.check_call(['make'], cwd=self.tmp,
+                    env=js.env(), pass_fds=js.fds, stdout=subprocess.DEVNULL)
+        finally:
+            js.close()
+
+        events = list()
+        for target in targets:
+            with open(os.path.join(self.tmp, target + '.log')) as fin:
+                for line in fin:
+                    what, t = line.split()
+                    events.append((float(t), 1 if what == 'start' else -1))
+        running = 0
+        most = 0
+        for t,delta in sorted(events):
+            running += delta
+            most = max(most, running)
+        self.assertLessEqual(most, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+from ectl.rundeck import legacy
+import unittest
+import glob
+import os
+
+srcdir = os.path.dirname(os.path.abspath(__file__))
+
+# Lines that exercise the corners of the legacy parsers
+TRICKY = """Odd first line
+Preamble: still the preamble
+Preprocessor Options
+#define TRACERS_ON     ! comment
+#define  NTRACERS  5   /* C comment */ more
+#define
+#defineX 3
+ #define  USE_ENT
+Run Options
+STOP_ON=1
+A B = 3
+=5
+KEY = a b /* mid */ c  ! trailing
+Object   modules:   ! extra spaces
+MODELE  ATMDYN	TAB  /* gone */ RAD
+Components:
+shared ESMF_Interface solvers
+Component Options:
+OPTS_Ent = ONLINE=YES PS_MODEL=FBB
+OPTS_dd2d = NC_IO=PNETCDF
+Data input files:
+AIC=AIC.RES_F40.D771201.nc  ! comment
+Label and Namelist:  (next 2 lines)
+a label = with equals
+&&PARAMETERS
+X_SDRAG=.002,.0002
+KCOPY=2 ! first
+&&END_PARAMETERS
+ &INPUTZ
+ YEARI=1949,MONTHI=12,DATEI=1,HOURI=0, ! comment
+ KDIAG=12*0,9,
+ ISTART=2,IRANDI=0,
+/
+"""
+
+class Lines(object):
+    """Feeds the same raw lines to the parser more than once."""
+    def __init__(self, text):
+        self.raws = text.splitlines(True)
+    def __call__(self):
+        return iter([legacy.Line('x.R', i, raw) for i,raw in enumerate(self.raws)])
+
+def reference_rundeck(fin):
+    """Parses a rundeck with the original regex-per-line pipeline, for
+    the single-pass parser to conform to."""
+    section_parsers = [legacy.CopyLines(), legacy.PreprocessorOptions(),
+        legacy.KeyEqValue(), legacy.WordList(), legacy.WordList(),
+        legacy.ComponentOptions(), legacy.KeyEqValue(), legacy.CopyLines(),
+        legacy.KeyEqValue(), legacy.NameList()]
+    lrd = legacy.LegacyRundeck([])
+    for line in legacy.sectionalize(fin):
+        if not line.divider:
+            line.parsed = section_parsers[line.isection](line)
+        lrd.lines.append(line)
+        lrd.sections_list[line.isection].append(line)
+    return lrd
+
+def state(lrd):
+    """Everything the parser produces, in comparable form"""
+    lines = [(line.lineno, line.isection, line.divider, line.raw,
+        'SELF' if line.parsed is line else line.parsed) for line in lrd.lines]
+    sections = [(section.name, [line.lineno for line in section]) for section in lrd.sections_list]
+    return lines, sections
+
+class TestLegacy(unittest.TestCase):
+
+    def assertConforms(self, lines):
+        ref = state(reference_rundeck(lines()))
+        legacy._memo.clear()
+        self.assertEqual(ref, state(legacy.LegacyRundeck(lines())))    # Cold
+        self.assertEqual(ref, state(legacy.LegacyRundeck(lines())))    # Memoized
+
+    def test_conformance(self):
+        """The single-pass parser gives the same result as the original."""
+        self.assertConforms(Lines(TRICKY))
+
+        template_dirs = [srcdir]
+        if 'MODELE_ROOT' in os.environ:
+            template_dirs.append(os.path.join(os.environ['MODELE_ROOT'], 'templates'))
+        for dir in template_dirs:
+            for fname in sorted(glob.glob(os.path.join(dir, '*.R'))):
+                with open(fname) as fin:
+                    self.assertConforms(Lines(fin.read()))
+
+    def test_not_shared(self):
+        """Memoized values are not shared between rundecks."""
+        lines = Lines(TRICKY)
+        lrd0 = legacy.LegacyRundeck(lines())
+        for line in lrd0.lines:
+            if isinstance(line.parsed, list):
+                line.parsed.append('junk')
+            elif isinstance(line.parsed, tuple) and isinstance(line.parsed[1], list):
+                line.parsed[1].append('junk')
+        lrd1 = legacy.LegacyRundeck(lines())
+        self.assertEqual(state(reference_rundeck(lines())), state(lrd1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+from ectl.rundeck import merge
+import unittest
+import os
+
+srcdir = os.path.dirname(os.path.abspath(__file__))
+
+def edit(lines, old, new):
+    """Replaces the line starting with old."""
+    ret = list(lines)
+    for i,line in enumerate(ret):
+        if line.startswith(old):
+            ret[i] = new
+            return ret
+    raise ValueError(old)
+
+class TestMerge(unittest.TestCase):
+
+    def setUp(self):
+        with open(os.path.join(srcdir, 'rundeck2.R')) as fin:
+            self.base = fin.readlines()
+
+    def test_merge3(self):
+        base = ['a\n', 'b\n', 'c\n', 'd\n', 'e\n']
+        ours = ['a\n', 'B\n', 'c\n', 'd\n', 'e\n']
+        theirs = ['a\n', 'b\n', 'c\n', 'D\n', 'e\n', 'f\n']
+        self.assertEqual((['a\n', 'B\n', 'c\n', 'D\n', 'e\n', 'f\n'], 0),
+            merge.merge3(base, ours, theirs))
+
+        # Adjacent changes conflict...
+        theirs = ['a\n', 'b\n', 'C\n', 'd\n', 'e\n']
+        ours = ['a\n', 'B\n', 'c\n', 'd\n', 'e\n']
+        merged, nconflicts = merge.merge3(base, ours, theirs)
+        self.assertEqual(1, nconflicts)
+        self.assertTrue(merge.has_conflicts(merged))
+
+        # ...unless resolved line by line
+        self.assertEqual((['a\n', 'B\n', 'C\n', 'd\n', 'e\n'], 0),
+            merge.merge3(base, ours, theirs, by_line=True))
+
+    def test_sections(self):
+        secs = merge.sections(self.base)
+        self.assertEqual(self.base, sum((lines for _,lines in secs), []))
+        self.assertEqual([None, 1, 3, 4, 5, 6, 7, 8, 9], [isection for isection,_ in secs])
+
+    def test_merge_rundecks(self):
+        base = self.base
+
+        # Unchanged upstream
+        ours = edit(base, 'KOCEAN=', 'KOCEAN=1\n')
+        self.assertEqual((ours, 0), merge.merge_rundecks(base, ours, base))
+
+        # Changes to neighbouring lines, and in another section
+        ours = edit(base, 'KOCEAN=', 'KOCEAN=1        ! ocean is computed\n')
+        theirs = edit(base, '!! KOCEAN=1', '!! KOCEAN=1        ! q-flux ocean\n')
+        theirs = edit(theirs, 'OCNML=', 'OCNML=Z1O.B4X5.cor\n')
+        merged, nconflicts = merge.merge_rundecks(base, ours, theirs)
+        self.assertEqual(0, nconflicts)
+        self.assertEqual(edit(theirs, 'KOCEAN=', 'KOCEAN=1        ! ocean is computed\n'), merged)
+
+        # A real conflict
+        theirs = edit(base, 'KOCEAN=', 'KOCEAN=2\n')
+        merged, nconflicts = merge.merge_rundecks(base, ours, theirs)
+        self.assertEqual(1, nconflicts)
+        self.assertTrue(merge.has_conflicts(merged))
+        self.assertFalse(merge.has_conflicts(base))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+from ectl import pathutil
+from ectl.rundeck import legacy
+from unittest import mock
+import unittest
+import tempfile
+import shutil
+import time
+import os
+
+def touch(fname, age=10.):
+    with open(fname, 'w') as out:
+        out.write('x=1\n')
+    age_dir(fname, age)
+
+def age_dir(fname, age=10.):
+    t = time.time() - age
+    os.utime(fname, (t,t))
+
+class TestPathIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.dirs = [os.path.join(self.tmp, x) for x in ('a', 'b', 'missing')]
+        for dir in self.dirs[:2]:
+            os.mkdir(dir)
+        touch(os.path.join(self.dirs[1], 'x.R'))
+        touch(os.path.join(self.dirs[1], 'y.R'))
+        os.symlink('nowhere', os.path.join(self.dirs[0], 'y.R'))
+        os.mkdir(os.path.join(self.dirs[1], 'sub'))
+        touch(os.path.join(self.dirs[1], 'sub', 'z.R'))
+        for dir in self.dirs[:2]:
+            age_dir(dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_find(self):
+        index = pathutil.PathIndex(self.dirs)
+        b = self.dirs[1]
+        self.assertEqual(os.path.join(b, 'x.R'), index.find('x.R'))
+        self.assertEqual(os.path.join(b, 'y.R'), index.find('y.R'))    # Skips dangling link
+        self.assertEqual(os.path.join(b, 'sub', 'z.R'), index.find(os.path.join('sub', 'z.R')))
+        self.assertIsNone(index.find('z.R'))
+        with self.assertRaises(IOError):
+            pathutil.search_file('z.R', index)
+
+        # A new file shadowing an old one is seen by the next index
+        touch(os.path.join(self.dirs[0], 'x.R'))
+        self.assertEqual(os.path.join(b, 'x.R'), index.find('x.R'))
+        self.assertEqual(os.path.join(self.dirs[0], 'x.R'),
+            pathutil.PathIndex(self.dirs).find('x.R'))
+
+    def test_listed_once(self):
+        pathutil.PathIndex(self.dirs)
+        with mock.patch('os.scandir', wraps=os.scandir) as scandir:
+            for _ in range(3):
+                index = pathutil.PathIndex(self.dirs)
+                index.find('x.R')
+            self.assertEqual(0, scandir.call_count)
+
+            age_dir(self.dirs[0], age=5.)
+            pathutil.PathIndex(self.dirs)
+            self.assertEqual(1, scandir.call_count)
+
+    def test_index_file(self):
+        index_file = os.path.join(self.tmp, 'index.json')
+        pathutil.PathIndex(self.dirs, index_file=index_file)
+        self.assertTrue(os.path.exists(index_file))
+
+        # A new process reads the listings instead of the directories
+        with mock.patch.dict(pathutil._listings, clear=True):
+            with mock.patch('os.scandir', wraps=os.scandir) as scandir:
+                index = pathutil.PathIndex(self.dirs, index_file=index_file)
+                self.assertEqual(0, scandir.call_count)
+            self.assertEqual(os.path.join(self.dirs[1], 'x.R'), index.find('x.R'))
+
+        # ...unless the directory changed
+        touch(os.path.join(self.dirs[0], 'x.R'))
+        age_dir(self.dirs[0], age=5.)
+        with mock.patch.dict(pathutil._listings, clear=True):
+            with mock.patch('os.scandir', wraps=os.scandir) as scandir:
+                index = pathutil.PathIndex(self.dirs, index_file=index_file)
+                self.assertEqual(1, scandir.call_count)
+            self.assertEqual(os.path.join(self.dirs[0], 'x.R'), index.find('x.R'))
+
+        # refresh() sees new files
+        touch(os.path.join(self.dirs[0], 'new.R'), age=0.)
+        self.assertIsNone(index.find('new.R'))
+        index.refresh()
+        self.assertEqual(os.path.join(self.dirs[0], 'new.R'), index.find('new.R'))
+
+    def test_includes(self):
+        a,b,_ = self.dirs
+        with open(os.path.join(b, 'main.R'), 'w') as out:
+            out.write('Preamble\n#include "x.R"\n#include "inc.R"\n')
+        with open(os.path.join(b, 'inc.R'), 'w') as out:
+            out.write('#include "x.R"\n')
+        touch(os.path.join(a, 'x.R'))
+        deps = list()
+        lines = list(legacy.preprocessor(os.path.join(b, 'main.R'), self.dirs, deps=deps))
+        self.assertEqual([os.path.join(b, 'main.R'), os.path.join(a, 'x.R'),
+            os.path.join(b, 'inc.R'), os.path.join(a, 'x.R')], deps)
+        self.assertEqual(['Preamble\n', 'x=1\n', 'x=1\n'],
+            [line.raw for line in lines if not line.raw.startswith('!')])
+
+
+if __name__ == "__main__":
+    unittest.main()
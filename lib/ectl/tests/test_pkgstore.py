@@ -0,0 +1,91 @@
+from ectl import pkgstore, prebuild
+from unittest import mock
+import unittest
+import multiprocessing
+import tempfile
+import shutil
+import os
+
+class TestPkgStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = pkgstore.PkgStore(os.path.join(self.tmp, 'store'))
+        self.root = os.path.join(self.tmp, 'root')
+        self.workspace = os.path.join(self.root, 'ectl')
+        os.makedirs(self.workspace)
+        open(os.path.join(self.root, 'ectl.conf'), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def make_pkg(self, pkg_hash):
+        """Links a pkg from the store, and installs it."""
+        local_pkg = os.path.join(self.workspace, 'pkgs', pkg_hash)
+        store_pkg = self.store.link(pkg_hash, local_pkg, ectl_root=self.root)
+        os.makedirs(os.path.join(store_pkg, 'bin'))
+        with open(os.path.join(store_pkg, 'bin', 'modelexe'), 'w') as out:
+            out.write(pkg_hash)
+        return local_pkg
+
+    def test_gc(self):
+        used = self.make_pkg('used')
+        prebuilt = self.make_pkg('prebuilt')
+        self.make_pkg('orphan')
+
+        run = os.path.join(self.root, 'run')
+        os.makedirs(run)
+        os.symlink(used, os.path.join(run, 'pkg'))
+        prebuild.write_state(self.workspace, {prebuilt: {'built': 1., 'runs': [run]}})
+
+        self.assertEqual({'used': 1, 'prebuilt': 1, 'orphan': 0}, dict(self.store.refcounts()))
+        self.assertEqual(['orphan'], self.store.gc(grace=0))
+        self.assertEqual(['prebuilt', 'used'], sorted(os.listdir(self.store.pkgs)))
+
+    def test_dedup(self):
+        a = self.make_pkg('a')
+        b = self.make_pkg('b')
+        with open(os.path.join(a, 'bin', 'modelexe'), 'w') as out:
+            out.write('same')
+        with open(os.path.join(b, 'bin', 'modelexe'), 'w') as out:
+            out.write('same')
+        # Left by a killed run
+        open(os.path.join(b, 'bin', 'modelexe.dedup'), 'w').close()
+
+        self.assertEqual((1, 0, 0), self.store.dedup('a'))
+        # As if another process stored the object after we looked for it
+        with mock.patch('os.path.exists', return_value=False):
+            self.assertEqual((1, 1, 4), self.store.dedup('b'))
+        self.assertTrue(os.path.samefile(
+            os.path.join(a, 'bin', 'modelexe'), os.path.join(b, 'bin', 'modelexe')))
+
+    def test_gc_in_progress(self):
+        self.make_pkg('new')
+        self.make_pkg('installing')
+        self.make_pkg('old')
+
+        # Just linked: kept for a while
+        self.assertEqual([], self.store.gc())
+
+        # Being installed by another process
+        ctx = multiprocessing.get_context('fork')
+        locked = ctx.Event()
+        done = ctx.Event()
+        def install():
+            with self.store.pkg_lock('installing'):
+                locked.set()
+                done.wait(30)
+        proc = ctx.Process(target=install)
+        proc.start()
+        try:
+            self.assertTrue(locked.wait(30))
+            self.assertEqual(['new', 'old'], self.store.gc(grace=0))
+        finally:
+            done.set()
+            proc.join()
+        self.assertEqual(['installing'], os.listdir(self.store.pkgs))
+        self.assertEqual(['installing'], self.store.gc(grace=0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+from ectl import prebuild, rundir
+import ectl.setup
+import unittest
+import types
+import tempfile
+import shutil
+import os
+
+class TestPrebuild(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.pkgs = os.path.join(self.tmp, 'ectl', 'pkgs')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def make_pkg(self, name, nbytes):
+        pkg = os.path.join(self.pkgs, name)
+        os.makedirs(os.path.join(pkg, 'lib'))
+        with open(os.path.join(pkg, 'lib', 'libmodele.so'), 'wb') as out:
+            out.write(b'x' * nbytes)
+        return pkg
+
+    def make_run(self, name, pkg=None):
+        run = os.path.join(self.tmp, name)
+        os.makedirs(os.path.join(run, 'config'))
+        open(os.path.join(run, 'config', 'rundeck.R'), 'w').close()
+        os.symlink(self.tmp, os.path.join(run, 'src'))
+        if pkg is not None:
+            os.symlink(pkg, os.path.join(run, 'pkg'))
+        return run
+
+    def test_parse_size(self):
+        self.assertEqual(100, prebuild.parse_size('100'))
+        self.assertEqual(3*1024**3, prebuild.parse_size('3G'))
+        self.assertEqual(512*1024, prebuild.parse_size('.5mb'))
+
+    def test_find_runs(self):
+        r1 = self.make_run('r1')
+        r2 = self.make_run(os.path.join('exp', 'r2'))
+        self.make_run(os.path.join('r1', 'nested'))
+        self.make_run(os.path.join('ectl', 'builds', 'notarun'))
+        self.assertEqual([os.path.join(self.tmp, 'exp', 'r2'), r1],
+            prebuild.find_runs(self.tmp, os.path.join(self.tmp, 'ectl')))
+
+    def test_merged_rundeck(self):
+        templates = os.path.join(self.tmp, 'templates')
+        os.makedirs(templates)
+        template = os.path.join(templates, 'E1.R')
+        base = ['Preamble\n', 'Object modules:\n', 'A B\n', 'Data input files:\n', 'X=1\n']
+        user = base[:4] + ['X=2\n']
+        with open(template, 'w') as out:
+            out.writelines(base[:2] + ['A B C\n'] + base[3:])    # Pulled upstream
+
+        run = self.make_run('r1')
+        os.symlink(template, os.path.join(run, 'upstream.R'))
+        config_dir = os.path.join(run, 'config')
+        os.makedirs(os.path.join(config_dir, '.git'))
+        ectl.setup.write_merge_state(config_dir, base, None)
+        with open(os.path.join(config_dir, 'rundeck.R'), 'w') as out:
+            out.writelines(user)
+
+        config = types.SimpleNamespace(workspace=os.path.join(self.tmp, 'ectl'))
+        fname = prebuild.merged_rundeck(config, run, rundir.FollowLinks(run), None)
+        with open(fname) as fin:
+            self.assertEqual(base[:2] + ['A B C\n'] + user[3:], fin.readlines())
+        with open(os.path.join(config_dir, 'rundeck.R')) as fin:
+            self.assertEqual(user, fin.readlines())
+
+    def test_evict(self):
+        old = self.make_pkg('old', 1<<20)
+        new = self.make_pkg('new', 1<<20)
+        adopted = self.make_pkg('adopted', 1<<20)
+        runs = [self.make_run('r1', pkg=adopted)]
+        state = {old: {'built': 1.}, new: {'built': 2.}, adopted: {'built': 0.},
+            os.path.join(self.pkgs, 'gone'): {'built': 0.}}
+        def list_runs():
+            return runs
+
+        # No budget: just forget about pkgs runs now use
+        self.assertEqual([], prebuild.evict(state, list_runs, None))
+        self.assertEqual({old, new}, set(state))
+
+        self.assertEqual([], prebuild.evict(state, list_runs, 3<<20))
+        self.assertEqual([old], prebuild.evict(state, list_runs, (3<<20) // 2))
+        self.assertEqual({new}, set(state))
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+        self.assertTrue(os.path.exists(adopted))
+
+        # A run set up with the pkg after evict() first looked
+        def list_runs_late():
+            if len(runs) == 1:
+                runs.append(self.make_run('r2', pkg=new))
+                return runs[:1]
+            return runs
+        self.assertEqual([], prebuild.evict(state, list_runs_late, 0))
+        self.assertEqual({}, state)
+        self.assertTrue(os.path.exists(new))
+
+if __name__ == "__main__":
+    unittest.main()
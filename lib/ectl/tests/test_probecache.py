@@ -0,0 +1,89 @@
+from ectl import probecache, launchers
+import unittest
+import tempfile
+import shutil
+import os
+
+class TestProbeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmp, 'cache', 'probes.json')
+        self.exe = os.path.join(self.tmp, 'mpirun')
+        with open(self.exe, 'w') as out:
+            out.write('#!/bin/sh\n')
+        self.nprobes = 0
+        self.old_environ = dict(os.environ)
+        os.environ.pop('ECTL_NO_PROBE_CACHE', None)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.old_environ)
+        shutil.rmtree(self.tmp)
+
+    def probe(self):
+        self.nprobes += 1
+        return ['openmpi', [3, 1, 2]]
+
+    def cached(self):
+        return probecache.cached('mpi_vendor', [self.exe], self.probe, fname=self.fname)
+
+    def test_cached(self):
+        self.assertEqual(['openmpi', [3,1,2]], self.cached())
+        self.assertEqual(['openmpi', [3,1,2]], self.cached())
+        self.assertEqual(1, self.nprobes)
+
+        # Changing the executable invalidates
+        st = os.stat(self.exe)
+        os.utime(self.exe, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        self.cached()
+        self.assertEqual(2, self.nprobes)
+
+        # So does changing the environment
+        os.environ['LD_LIBRARY_PATH'] = '/opt/other/lib'
+        self.cached()
+        self.assertEqual(3, self.nprobes)
+
+        probecache.clear(fname=self.fname)
+        self.cached()
+        self.assertEqual(4, self.nprobes)
+
+        os.environ['ECTL_NO_PROBE_CACHE'] = '1'
+        self.cached()
+        self.assertEqual(5, self.nprobes)
+
+    def test_failure_not_cached(self):
+        def fail():
+            self.nprobes += 1
+            raise EnvironmentError('Cannot load ELF binary')
+        for _ in range(2):
+            with self.assertRaises(EnvironmentError):
+                probecache.cached('ldd', [self.exe], fail, fname=self.fname)
+        self.assertEqual(2, self.nprobes)
+
+    def test_unwritable(self):
+        # Cache dir cannot be created (works even as root)
+        self.fname = os.path.join(self.exe, 'cache', 'probes.json')
+        self.assertEqual(['openmpi', [3,1,2]], self.cached())
+        self.assertEqual(['openmpi', [3,1,2]], self.cached())
+        self.assertEqual(2, self.nprobes)
+
+    def test_detect_ncores(self):
+        # 2 packages x 2 cores x 2 hyperthreads
+        sysfs = os.path.join(self.tmp, 'cpu')
+        for cpu in range(8):
+            topology = os.path.join(sysfs, 'cpu%d' % cpu, 'topology')
+            os.makedirs(topology)
+            with open(os.path.join(topology, 'physical_package_id'), 'w') as out:
+                out.write('%d\n' % (cpu // 4))
+            with open(os.path.join(topology, 'core_id'), 'w') as out:
+                out.write('%d\n' % (cpu % 2))
+
+        self.assertEqual(4, launchers.detect_ncores(range(8), sysfs=sysfs))
+        self.assertEqual(1, launchers.detect_ncores([0, 2], sysfs=sysfs))
+        self.assertEqual(2, launchers.detect_ncores([0, 4], sysfs=sysfs))
+        self.assertGreater(launchers.detect_ncores(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
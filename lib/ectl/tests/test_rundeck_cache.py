@@ -0,0 +1,143 @@
+from ectl import rundeck
+from ectl.rundeck import legacy, diskcache
+from unittest import mock
+import unittest
+import pickle
+import hashlib
+import tempfile
+import shutil
+import time
+import os
+
+srcdir = os.path.dirname(os.path.abspath(__file__))
+
+def write(fname, text, age=10.):
+    """Writes a file with an mtime in the past (so it is not racy)."""
+    with open(fname, 'w') as out:
+        out.write(text)
+    t = time.time() - age
+    os.utime(fname, (t,t))
+
+def summary(rd):
+    """Everything loaded from a rundeck, in comparable form"""
+    hash = hashlib.md5()
+    rd.update_hash(hash)
+    return (hash.hexdigest(), repr(rd.preamble), repr(rd.params.params),
+        repr(rd.params.files), repr(rd.params.inputz), repr(rd.params.inputz_cold))
+
+class TestRundeckCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.templates = os.path.join(self.tmp, 'templates')
+        self.run = os.path.join(self.tmp, 'run')
+        os.makedirs(self.templates)
+        os.makedirs(os.path.join(self.run, 'config'))
+
+        # A rundeck whose body is #included from the templates
+        with open(os.path.join(srcdir, 'rundeck2.R')) as fin:
+            lines = fin.readlines()
+        write(os.path.join(self.templates, 'body.R'), ''.join(lines[1:]))
+        self.fname = os.path.join(self.run, 'config', 'rundeck.R')
+        write(self.fname, lines[0] + '#include "body.R"\n')
+        t = time.time() - 10.
+        for dir in (self.templates, os.path.join(self.run, 'config')):
+            os.utime(dir, (t,t))
+
+        # Count the times a rundeck is actually parsed
+        self.nparses = 0
+        self.init = legacy.LegacyRundeck.__init__
+        def init(lrd, *args, **kwargs):
+            self.nparses += 1
+            self.init(lrd, *args, **kwargs)
+        legacy.LegacyRundeck.__init__ = init
+
+        self.old_environ = dict(os.environ)
+        os.environ.pop('ECTL_NO_RUNDECK_CACHE', None)
+
+    def tearDown(self):
+        legacy.LegacyRundeck.__init__ = self.init
+        os.environ.clear()
+        os.environ.update(self.old_environ)
+        shutil.rmtree(self.tmp)
+
+    def load(self, **kwargs):
+        return rundeck.load(self.fname, template_path=[self.templates], **kwargs)
+
+    def test_cached(self):
+        rd0 = self.load()
+        rd1 = self.load()
+        self.assertEqual(1, self.nparses)
+        self.assertEqual(summary(rd0), summary(rd1))
+        self.assertIsNot(rd0, rd1)
+        self.assertTrue(os.path.isdir(os.path.join(self.run, diskcache.CACHE_DIR)))
+
+        # Changing an included template invalidates
+        body = os.path.join(self.templates, 'body.R')
+        with open(body) as fin:
+            text = fin.read()
+        write(body, text.replace('KOCEAN=0  ', 'KOCEAN=1  '), age=5.)
+        rd2 = self.load()
+        self.assertEqual(2, self.nparses)
+        self.assertEqual(1, rd2.params.params['kocean'].parsed)
+
+        # So does a new include that shadows the old one
+        write(os.path.join(self.run, 'config', 'body.R'), text, age=4.)
+        t = time.time() - 4.
+        os.utime(os.path.join(self.run, 'config'), (t,t))
+        rd3 = self.load()
+        self.assertEqual(3, self.nparses)
+        self.assertEqual(0, rd3.params.params['kocean'].parsed)
+        self.load()
+        self.assertEqual(3, self.nparses)
+
+    def test_bypass(self):
+        self.load(cache=False)
+        self.load(cache=False)
+        self.assertEqual(2, self.nparses)
+        self.assertFalse(os.path.exists(os.path.join(self.run, diskcache.CACHE_DIR)))
+
+        os.environ['ECTL_NO_RUNDECK_CACHE'] = '1'
+        self.load()
+        self.load()
+        self.assertEqual(4, self.nparses)
+
+    def test_not_cached(self):
+        # Rundecks outside a run are not cached
+        rundeck.load('body.R', template_path=[self.templates])
+        rundeck.load('body.R', template_path=[self.templates])
+        self.assertEqual(2, self.nparses)
+        self.assertEqual(['body.R'], os.listdir(self.templates))
+
+        # Nor are files modified just now
+        with open(self.fname, 'a') as out:
+            out.write('\n')
+        self.load()
+        self.load()
+        self.assertEqual(4, self.nparses)
+
+    def test_unpicklable(self):
+        # Something in the rundeck can't be pickled: load() still works
+        # (just uncached), and leaves no temporary files
+        def dump(obj, out, protocol=None):
+            raise pickle.PicklingError('cannot pickle')
+        with mock.patch('pickle.dump', dump):
+            rd0 = self.load()
+        rd1 = self.load()
+        self.assertEqual(summary(rd0), summary(rd1))
+        self.assertEqual(2, self.nparses)
+        self.assertEqual([], [x for x in os.listdir(os.path.join(self.run, diskcache.CACHE_DIR))
+            if x.startswith('.tmp')])
+
+    def test_load_I(self):
+        fname = os.path.join(self.run, 'I')
+        with open(os.path.join(srcdir, 'rundeck1a.R')) as fin:
+            write(fname, fin.read())
+        rd0 = rundeck.load_I(fname)
+        rd1 = rundeck.load_I(fname)
+        self.assertEqual(summary(rd0), summary(rd1))
+        self.assertEqual(1, self.nparses)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+from ectl import rundeck, rundir
+import unittest
+import tempfile
+import shutil
+import os
+
+srcdir = os.path.dirname(os.path.abspath(__file__))
+
+class TestMakeRundir(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.run = os.path.join(self.tmp, 'run')
+        self.rd = rundeck.load(os.path.join(srcdir, 'rundeck1a.R'), template_path=[])
+        for param in self.rd.params.files.values():
+            param.resolve(os.path.join('/data', param.value))
+        self.nfiles = len(self.rd.params.files)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def assertRundir(self, I_fname):
+        for label, param in self.rd.params.files.items():
+            self.assertEqual(param.rval, os.readlink(os.path.join(self.run, label)))
+        with open(I_fname) as fin:
+            self.assertEqual(self.rd.format_I(), fin.read())
+
+    def test_make_rundir(self):
+        I_fname = os.path.join(self.run, 'I')
+        self.assertEqual((0, self.nfiles+1), rundir.make_rundir(self.rd, self.run))
+        self.assertRundir(I_fname)
+
+        # Nothing changed: nothing touched
+        ino = os.stat(I_fname).st_ino
+        self.assertEqual((self.nfiles+1, 0), rundir.make_rundir(self.rd, self.run))
+        self.assertEqual(ino, os.stat(I_fname).st_ino)
+
+        # One file changed
+        param = next(iter(self.rd.params.files.values()))
+        param.resolve('/other/file.nc')
+        self.assertEqual((self.nfiles-1, 2), rundir.make_rundir(self.rd, self.run))
+        self.assertRundir(I_fname)
+
+        # The I file is replaced by a link to the log directory's
+        log_dir = os.path.join(self.run, 'log01')
+        os.mkdir(log_dir)
+        self.assertEqual((self.nfiles, 2), rundir.make_rundir(self.rd, self.run, idir=log_dir))
+        self.assertEqual(os.path.join(log_dir, 'I'), os.readlink(I_fname))
+        self.assertRundir(I_fname)
+
+        # ...and back again
+        self.assertEqual((self.nfiles, 1), rundir.make_rundir(self.rd, self.run))
+        self.assertFalse(os.path.islink(I_fname))
+        self.assertRundir(I_fname)
+
+
+if __name__ == "__main__":
+    unittest.main()
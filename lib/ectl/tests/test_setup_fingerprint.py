@@ -0,0 +1,73 @@
+import ectl.setup
+import unittest
+import tempfile
+import shutil
+import os
+
+class TestSetupFingerprint(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.run = os.path.join(self.tmp, 'run')
+        self.config = os.path.join(self.run, 'config')
+        self.pkg = os.path.join(self.tmp, 'pkg')
+        os.makedirs(self.config)
+        for fname in ('lib/libmodele.so', 'bin/modelexe'):
+            os.makedirs(os.path.join(self.pkg, os.path.dirname(fname)))
+            open(os.path.join(self.pkg, fname), 'w').close()
+        self.write('rundeck.R', 'KOCEAN=0\n')
+        self.write('I', 'KOCEAN=0\n', dir=self.run)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, leaf, text, dir=None):
+        with open(os.path.join(dir or self.config, leaf), 'w') as out:
+            out.write(text)
+
+    def fingerprint(self, build=True):
+        return {'inputs' : ectl.setup.setup_inputs('E.R', '/src', 'abc', self.config,
+                '/builds/b', self.pkg, self.pkg, [False, True, 'python3', None, []]),
+            'build' : build}
+
+    def needs_setup(self, build=True):
+        return ectl.setup.needs_setup(
+            ectl.setup.read_setup_fingerprint(self.run), self.fingerprint(build), self.pkg)
+
+    def test_needs_setup(self):
+        self.assertEqual('not set up before', self.needs_setup())
+        ectl.setup.write_setup_fingerprint(self.run, self.fingerprint(build=False),
+            [os.path.join(self.run, 'I')])
+        self.assertIsNone(self.needs_setup(build=False))
+        self.assertEqual('not built yet', self.needs_setup())
+
+        ectl.setup.write_setup_fingerprint(self.run, self.fingerprint(),
+            [os.path.join(self.run, 'I')])
+        self.assertIsNone(self.needs_setup())
+        self.assertIsNone(self.needs_setup(build=False))
+
+        # Each input invalidates
+        self.write('rundeck.R', 'KOCEAN=1\n')
+        self.assertEqual('config changed', self.needs_setup())
+        self.write('rundeck.R', 'KOCEAN=0\n')
+        self.assertIsNone(self.needs_setup())
+        self.write('x.cdl', 'netcdf x {}\n')
+        self.assertEqual('config changed', self.needs_setup())
+        os.remove(os.path.join(self.config, 'x.cdl'))
+        self.write('hooks.nc', '')
+        self.assertEqual('config_nc changed', self.needs_setup())
+        os.remove(os.path.join(self.config, 'hooks.nc'))
+
+        # ...and so do missing outputs
+        os.remove(os.path.join(self.pkg, 'bin', 'modelexe'))
+        self.assertIn('is not built', self.needs_setup())
+        self.assertIsNone(self.needs_setup(build=False))
+        os.remove(os.path.join(self.run, 'I'))
+        self.assertIn('is missing', self.needs_setup(build=False))
+
+        ectl.setup.clear_setup_fingerprint(self.run)
+        self.assertEqual('not set up before', self.needs_setup())
+
+
+if __name__ == "__main__":
+    unittest.main()
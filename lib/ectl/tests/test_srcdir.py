@@ -0,0 +1,86 @@
+from ectl import srcdir,rundeck
+import hashlib
+import unittest
+import tempfile
+import shutil
+import time
+import os
+
+def write_file(fname, code):
+    dirname = os.path.dirname(fname)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with open(fname, 'w') as out:
+        out.write(code)
+
+class TestSrcdir(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, 'modelE')
+        model = os.path.join(self.src, 'model')
+        write_file(os.path.join(self.src, 'CMakeLists.txt'), 'project(modele)\n')
+        write_file(os.path.join(model, 'MODELE.F90'),
+            '#include "rundeck_opts.h"\n      program modele\n      use atm_com\n')
+        write_file(os.path.join(model, 'ATM_COM.f'),
+            '      module ATM_COM\n      use, intrinsic :: iso_c_binding\n')
+        write_file(os.path.join(model, 'OCEAN.f'), '      module ocean\n')
+        write_file(os.path.join(model, 'include', 'rundeck_opts.h'), '#define X\n')
+        write_file(os.path.join(model, 'shared', 'CONST.F90'), 'module constant\n')
+        write_file(os.path.join(model, 'Ent', 'ENT.F90'), 'module ent\n')
+
+        self.build = rundeck.Build()
+        self.build.sources = set(['MODELE'])
+        self.build.components = {'shared' : None}
+
+        # Make files old enough to be kept in the manifest
+        past = time.time() - 10.
+        for root, dirs, files in os.walk(self.src):
+            for file in files:
+                os.utime(os.path.join(root, file), (past, past))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def hexdigest(self, fn, *args, **kwargs):
+        hash = hashlib.md5()
+        fn(*args + (hash,), **kwargs)
+        return hash.hexdigest()
+
+    def test_manifest(self):
+        """Hashing with a manifest gives the same answer as a full rehash."""
+        manifest = srcdir.manifest_fname(self.tmp, self.src)
+        full = self.hexdigest(srcdir.update_hash, self.src)
+        self.assertEqual(full, self.hexdigest(srcdir.update_hash, self.src, manifest=manifest))
+        self.assertTrue(os.path.exists(manifest))
+        self.assertEqual(full, self.hexdigest(srcdir.update_hash, self.src, manifest=manifest))
+
+        write_file(os.path.join(self.src, 'model', 'OCEAN.f'), '      module ocean2\n')
+        full2 = self.hexdigest(srcdir.update_hash, self.src)
+        self.assertNotEqual(full, full2)
+        self.assertEqual(full2, self.hexdigest(srcdir.update_hash, self.src, manifest=manifest))
+
+    def test_closure(self):
+        digests = dict(srcdir.fingerprint(self.src))
+        closure = srcdir.dependency_closure(self.src, self.build, digests, dict())
+        self.assertEqual(closure, set(os.path.join(*x) for x in (
+            ('CMakeLists.txt',),
+            ('model', 'MODELE.F90'),
+            ('model', 'ATM_COM.f'),
+            ('model', 'include', 'rundeck_opts.h'),
+            ('model', 'shared', 'CONST.F90'))))
+
+    def test_hash_deps(self):
+        hash0 = self.hexdigest(srcdir.update_hash_deps, self.src, self.build)
+
+        # Unrelated component: no change
+        write_file(os.path.join(self.src, 'model', 'Ent', 'ENT.F90'), 'module ent2\n')
+        self.assertEqual(hash0, self.hexdigest(srcdir.update_hash_deps, self.src, self.build))
+
+        # USEd module: change
+        write_file(os.path.join(self.src, 'model', 'ATM_COM.f'), '      module ATM_COM\n!\n')
+        self.assertNotEqual(hash0, self.hexdigest(srcdir.update_hash_deps, self.src, self.build))
+
+
+if __name__ == "__main__":
+    unittest.main()
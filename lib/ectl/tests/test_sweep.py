@@ -0,0 +1,49 @@
+from ectl import sweep, rundeck
+import collections
+import unittest
+import tempfile
+import shutil
+import os
+
+srcdir = os.path.dirname(os.path.abspath(__file__))
+
+class TestSweep(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_read_table(self):
+        table = os.path.join(self.tmp, 'table.txt')
+        with open(table, 'w') as out:
+            out.write('# A sweep\nrun  KOCEAN  YEARE\n\nr1   0  1950\nr2   1  1960\n')
+        rows = sweep.read_table(table)
+        self.assertEqual(['r1', 'r2'], [name for name,_ in rows])
+        self.assertEqual([('KOCEAN', '1'), ('YEARE', '1960')], list(rows[1][1].items()))
+
+        with open(table, 'w') as out:
+            out.write('run,KOCEAN\nr1,0\nr2\n')
+        with self.assertRaises(ValueError):
+            sweep.read_table(table)
+
+    def test_override_rundeck(self):
+        rundeck_R = os.path.join(self.tmp, 'rundeck.R')
+        shutil.copy(os.path.join(srcdir, 'rundeck1a.R'), rundeck_R)
+
+        for kocean in ('1', '2'):    # Second sweep replaces the first
+            sweep.override_rundeck(rundeck_R,
+                collections.OrderedDict([('KOCEAN', kocean)]),
+                collections.OrderedDict([('YEARE', '1955')]))
+
+        rd = rundeck.load(rundeck_R)
+        self.assertEqual(2, rd.params.params['KOCEAN'].parsed)
+        self.assertEqual('1955', rd.params.inputz['YEARE'].value)
+        self.assertEqual('1960', rd.params.inputz_cold['YEARE'].value)
+        with open(rundeck_R) as fin:
+            self.assertEqual(2, fin.read().count(sweep.SWEEP_MARK))
+
+
+if __name__ == "__main__":
+    unittest.main()
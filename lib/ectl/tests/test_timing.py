@@ -0,0 +1,42 @@
+from ectl import timing
+import unittest
+import io
+
+class TestTiming(unittest.TestCase):
+
+    def test_critical_path(self):
+        tl = timing.Timeline()
+        self.assertEqual([], tl.critical_path())
+
+        tl.add('merge', 0., 1.)
+        tl.add('hash', 1., 2., after=['merge'])
+        tl.add('make', 2., 10., after=['hash', 'cmake'])    # No cmake step
+        tl.add('inputs', 2., 6., after=['hash'])
+        tl.add('rundir', 6., 7., after=['inputs'])
+        tl.add('hooks', 10., 11., after=['rundir', 'make'])
+        self.assertEqual(['merge', 'hash', 'make', 'hooks'], tl.critical_path())
+
+        # Downloads now take longer than the build
+        tl.add('inputs', 2., 12., after=['hash'])
+        tl.add('rundir', 12., 13., after=['inputs'])
+        tl.add('hooks', 13., 14., after=['rundir', 'make'])
+        self.assertEqual(['merge', 'hash', 'inputs', 'rundir', 'hooks'], tl.critical_path())
+
+        out = io.StringIO()
+        tl.report(out=out)
+        lines = out.getvalue().split('\n')
+        self.assertEqual(['merge', 'hash', 'make', 'inputs', 'rundir', 'hooks', 'total'],
+            [line[4:].split()[0] for line in lines[1:-1]])
+        self.assertTrue(lines[4].startswith('  * inputs'))
+        self.assertTrue(lines[3].startswith('    make'))
+
+    def test_step(self):
+        tl = timing.Timeline()
+        with self.assertRaises(ValueError):
+            with tl.step('fails'):
+                raise ValueError()
+        self.assertEqual(['fails'], tl.critical_path())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+from ectl import unpack
+import unittest
+import tempfile
+import shutil
+import time
+import os
+
+class FakePyar(object):
+    """Unpacks a fixed set of members, instead of reading the archive."""
+    def __init__(self, members):
+        self.members = members
+        self.nunpacks = 0
+
+    def unpack_archive(self, fin, dest):
+        self.nunpacks += 1
+        for relpath,contents in self.members.items():
+            fname = os.path.join(dest, relpath)
+            if not os.path.isdir(os.path.dirname(fname)):
+                os.makedirs(os.path.dirname(fname))
+            with open(fname, 'w') as out:
+                out.write(contents)
+
+def age(fname, seconds=10.):
+    t = time.time() - seconds
+    os.utime(fname, (t,t))
+
+class TestUnpack(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, 'modelE')
+        os.makedirs(self.src)
+        self.archive = os.path.join(self.src, 'modele-control.pyar')
+        with open(self.archive, 'w') as out:
+            out.write('archive\n')
+        age(self.archive)
+        self.manifest = os.path.join(self.tmp, 'manifest.json')
+
+        self.pyar = unpack.pyar
+        unpack.pyar = FakePyar({
+            'CMakeLists.txt' : 'project(modelE)\n',
+            os.path.join('cmake', 'modele.cmake') : 'set(X 1)\n'})
+
+    def tearDown(self):
+        unpack.pyar = self.pyar
+        shutil.rmtree(self.tmp)
+
+    def unpack(self):
+        return unpack.unpack_archive(self.archive, self.src, manifest=self.manifest)
+
+    def test_unpack(self):
+        cmake = os.path.join(self.src, 'cmake', 'modele.cmake')
+        lists = os.path.join(self.src, 'CMakeLists.txt')
+        os.makedirs(os.path.dirname(cmake))
+        with open(cmake, 'w') as out:
+            out.write('set(X 1)\n')
+        age(cmake, 100.)
+        mtime = os.stat(cmake).st_mtime_ns
+
+        # Only the missing file is written
+        self.assertEqual((1, 2), self.unpack())
+        self.assertEqual(mtime, os.stat(cmake).st_mtime_ns)
+        with open(lists) as fin:
+            self.assertEqual('project(modelE)\n', fin.read())
+        self.assertEqual(['CMakeLists.txt', 'cmake', 'modele-control.pyar'],
+            sorted(os.listdir(self.src)))
+
+        # Just written, so not trusted yet: compared again
+        self.assertEqual((0, 2), self.unpack())
+        self.assertEqual(2, unpack.pyar.nunpacks)
+
+        # Once settled, the archive is not even unpacked
+        age(lists)
+        self.unpack()
+        self.assertEqual((0, 2), self.unpack())
+        self.assertEqual(3, unpack.pyar.nunpacks)
+
+        # A file changed on disk is restored
+        with open(cmake, 'w') as out:
+            out.write('set(X 2)\n')
+        self.assertEqual((1, 2), self.unpack())
+        with open(cmake) as fin:
+            self.assertEqual('set(X 1)\n', fin.read())
+
+
+if __name__ == "__main__":
+    unittest.main()
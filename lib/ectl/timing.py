@@ -0,0 +1,72 @@
+"""Wall-clock timings of the steps of a task graph (eg: `ectl setup`),
+and the critical path through them."""
+
+from __future__ import print_function
+import sys
+import time
+import threading
+from contextlib import contextmanager
+
+class Timeline(object):
+    """Records when each step started and ended, and which steps it
+    waited for.  Steps may run in different threads."""
+
+    def __init__(self):
+        self.steps = dict()    # name --> (start, end, after)
+        self.order = list()
+        self.lock = threading.Lock()
+
+    def add(self, name, start, end, after=()):
+        with self.lock:
+            if name not in self.steps:
+                self.order.append(name)
+            self.steps[name] = (start, end, tuple(after))
+
+    @contextmanager
+    def step(self, name, after=()):
+        """Times the body of a with statement.
+        after:
+            Steps that had to finish before this one could start."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.time(), after)
+
+    def critical_path(self):
+        """The chain of steps that determined the total time: starting
+        from the step that ended last, each step's latest-ending
+        predecessor.
+        Returns: [name], first to last."""
+        with self.lock:
+            steps = dict(self.steps)
+        if len(steps) == 0:
+            return []
+        name = max(steps, key=lambda x: steps[x][1])
+        path = list()
+        seen = set()
+        while name is not None:
+            path.append(name)
+            seen.add(name)
+            after = [x for x in steps[name][2] if x in steps and x not in seen]
+            name = max(after, key=lambda x: steps[x][1]) if len(after) > 0 else None
+        path.reverse()
+        return path
+
+    def report(self, out=sys.stdout):
+        with self.lock:
+            order = list(self.order)
+            steps = dict(self.steps)
+        if len(order) == 0:
+            return
+        t0 = min(start for start,_,_ in steps.values())
+        t1 = max(end for _,end,_ in steps.values())
+        critical = set(self.critical_path())
+
+        out.write('-------- Timing (* = critical path)\n')
+        for name in order:
+            start, end, _ = steps[name]
+            out.write('  {} {:<12} {:8.1f}s  ({:.1f}s - {:.1f}s)\n'.format(
+                '*' if name in critical else ' ', name, end - start, start - t0, end - t0))
+        out.write('    {:<12} {:8.1f}s\n'.format('total', t1 - t0))
+        out.flush()
@@ -0,0 +1,133 @@
+"""Incremental unpacking of modele-control.pyar (the CMake build files
+for a ModelE source tree).
+
+Unpacking the archive over the source tree on every build bumps the
+mtimes of all its files, which makes CMake regenerate and can cascade
+into large rebuilds.  Here, only files whose contents differ from the
+archive's are written; the rest are not touched.
+
+A manifest (in the ectl workspace) remembers the archive and the
+digests of the files unpacked from it.  While the archive and those
+files are unchanged (size, mtime, inode), nothing is unpacked at all.
+"""
+from __future__ import print_function
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import time
+from ectl import srcdir
+from giss import pyar, ioutil
+
+def manifest_fname(workspace, src_dir):
+    """Name of the unpack manifest for a source directory, stored in
+    the ectl workspace."""
+    key = hashlib.md5(os.path.realpath(src_dir).encode()).hexdigest()
+    return os.path.join(workspace, 'srcdirs', key + '-pyar.json')
+
+def stat_key(fname):
+    try:
+        st = os.stat(fname)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+def load_manifest(fname):
+    """Reads a manifest:
+        {'archive': stat_key, 'files': {relpath: stat_key + [digest]}}"""
+    try:
+        with open(fname, 'r') as fin:
+            return json.load(fin)
+    except (IOError, ValueError):
+        return {'archive': None, 'files': dict()}
+
+def up_to_date(archive, dest, manifest):
+    """Determines whether dest already holds everything in archive,
+    without reading either."""
+    if manifest['archive'] is None or manifest['archive'] != stat_key(archive):
+        return False
+    for relpath,entry in manifest['files'].items():
+        if stat_key(os.path.join(dest, relpath)) != entry[:3]:
+            return False
+    return True
+
+def update_tree(scratch, dest, manifest_files):
+    """Moves files from scratch into dest, where their contents differ.
+    manifest_files: {relpath: stat_key + [digest]}
+        Digests of files in dest, as of the last unpack.
+    Returns: (touched, digests)
+        touched: [relpath] of files written into dest
+        digests: {relpath: digest} of all files in scratch"""
+    touched = list()
+    digests = dict()
+    for root, dirs, files in os.walk(scratch):
+        for file in files:
+            src = os.path.join(root, file)
+            relpath = os.path.relpath(src, scratch)
+            dst = os.path.join(dest, relpath)
+            digest = srcdir.file_digest(src)
+            digests[relpath] = digest
+
+            entry = manifest_files.get(relpath)
+            key = stat_key(dst)
+            if key is None:
+                old_digest = None
+            elif entry is not None and entry[:3] == key:
+                old_digest = entry[3]
+            else:
+                old_digest = srcdir.file_digest(dst)
+            if old_digest == digest:
+                continue
+
+            try:
+                os.makedirs(os.path.dirname(dst))
+            except OSError:
+                pass
+            os.replace(src, dst)
+            os.utime(dst, None)    # Newer than anything built from it
+            touched.append(relpath)
+    return touched, digests
+
+def unpack_archive(archive, dest, manifest=None):
+    """Unpacks a pyar archive into dest, writing only files whose
+    contents differ.
+    manifest: str
+        Name of the manifest file; if None, every file is compared.
+    Returns: (ntouched, nfiles)
+        Number of files written, and number in the archive."""
+    old = {'archive': None, 'files': dict()} if manifest is None else load_manifest(manifest)
+    if up_to_date(archive, dest, old):
+        return 0, len(old['files'])
+
+    archive_key = stat_key(archive)
+
+    # Unpack next to dest, so files can be moved (not copied) into place
+    scratch = tempfile.mkdtemp(dir=dest, prefix='.pyar-')
+    try:
+        with open(archive) as fin:
+            pyar.unpack_archive(fin, scratch)
+        touched, digests = update_tree(scratch, dest, old['files'])
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    if manifest is not None:
+        now_ns = int(time.time() * 1e9)
+        racy_ns = int(srcdir.RACY_SECONDS * 1e9)
+        files = dict()
+        for relpath,digest in digests.items():
+            key = stat_key(os.path.join(dest, relpath))
+            # Don't trust files that could change again within an mtime tick
+            if key is not None and now_ns - key[1] > racy_ns:
+                files[relpath] = key + [digest]
+        trusted = len(files) == len(digests) and now_ns - archive_key[1] > racy_ns
+        new = {'archive': archive_key if trusted else None, 'files': files}
+        try:
+            os.makedirs(os.path.dirname(manifest))
+        except OSError:
+            pass
+        with ioutil.AtomicOverwrite(manifest) as fout:
+            json.dump(new, fout.out)
+            fout.commit()
+
+    return len(touched), len(digests)
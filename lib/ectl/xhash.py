@@ -4,11 +4,19 @@ import types
 
 # TODO: This looks an awful lot like giss.checksum....
 
+# Strings longer than this are encoded and hashed a piece at a time.
+STR_CHUNK = 1 << 16
+
 def _update_int(myint, hash):
     hash.update(str(myint).encode())
 
 def _update_str(mystr, hash):
-    hash.update(mystr.encode())
+    if len(mystr) <= STR_CHUNK:
+        hash.update(mystr.encode())
+    else:
+        # UTF-8 of the pieces == UTF-8 of the whole; avoids one big copy
+        for i in range(0, len(mystr), STR_CHUNK):
+            hash.update(mystr[i:i+STR_CHUNK].encode())
 
 def _update_bytes(mybytestr, hash):
     hash.update(mybytestr)
@@ -36,6 +44,8 @@ update_by_type = { \
     int : _update_int,
     str : _update_str,
     bytes : _update_bytes,
+    bytearray : _update_bytes,
+    memoryview : _update_bytes,
     list : _update_iterable,
     tuple : _update_iterable,
     dict : _update_dict,
@@ -44,25 +54,142 @@ update_by_type = { \
     types.FunctionType : _update_function,
 }
 
+# Types whose hash contribution is worth memoizing
+# (Not tuple: those are mostly temporaries, eg. from dict.items())
+_container_types = (list, dict, set)
 
-def update(obj, hash):
-    """General hash updater that works for everything."""
-    typ = type(obj)
-    hash.update(typ.__module__.encode())
-    hash.update(typ.__name__.encode())
+# Encoded (module, name) of each type seen so far
+_type_tags = dict()
 
+def _type_tag(typ):
     try:
-        updater = update_by_type[typ]
-        updater(obj,hash)
+        return _type_tags[typ]
     except KeyError:
-        try:
-            obj.update_hash(hash)
-        except AttributeError:
-            # Try different collection update methods
-            if isinstance(obj, dict):
-                _update_dict(obj, hash)
-            elif isinstance(obj, set):
-                _update_set(obj, hash)
+        tag = (typ.__module__.encode(), typ.__name__.encode())
+        _type_tags[typ] = tag
+        return tag
+
+class _Sink(object):
+    """Stands in for a hashlib object, remembering which Hasher is
+    in use so that nested update() calls (eg. from an object's
+    update_hash() method) go through the same Hasher."""
+    __slots__ = ('update', 'hasher')
+    def __init__(self, hasher, update):
+        self.hasher = hasher
+        self.update = update
+
+class Hasher(object):
+    """Structural hasher for Python objects.
+
+    hash_type: str
+        Name of hashlib algorithm (eg: 'md5', 'blake2b')
+    merkle: bool
+        If False, objects are hashed as one byte stream; with md5, this
+        gives the same digests as always (used to name build and pkg
+        directories).
+        If True, each container (list, dict, set or object with
+        update_hash()) is hashed to its own digest, and its parent
+        hashes that digest.
+    memo: bool
+        Remember the contribution of each container (by id) the first
+        time it is hashed.  Only use if those objects will not change
+        over the lifetime of this Hasher (eg: a parsed rundeck)."""
+
+    def __init__(self, hash_type='md5', merkle=False, memo=False):
+        self.hash_type = hash_type
+        self.merkle = merkle
+        self.memo = dict() if memo else None
+
+    def new(self):
+        return getattr(hashlib, self.hash_type)()
+
+    def update(self, obj, hash):
+        """Adds obj to an existing hashlib object."""
+        if getattr(hash, 'hasher', None) is not self:
+            hash = _Sink(self, hash.update)
+        self._update(obj, hash)
+
+    def digest(self, obj):
+        if self.merkle:
+            return self._node_digest(obj)
+        hash = self.new()
+        self._stream(obj, _Sink(self, hash.update))
+        return hash.digest()
+
+    def hexdigest(self, obj):
+        return self.digest(obj).hex()
+
+    # ----------------------------------------------------------
+    def _update(self, obj, sink):
+        if self.merkle:
+            # Scalars are streamed into their parent's node
+            if self._memoizable(obj):
+                sink.update(self._node_digest(obj))
+            else:
+                self._stream(obj, sink)
+        elif self.memo is not None and self._memoizable(obj):
+            key = id(obj)
+            try:
+                chunk = self.memo[key][1]
+            except KeyError:
+                chunks = list()
+                self._stream(obj, _Sink(self, chunks.append))
+                chunk = b''.join(chunks)
+                self.memo[key] = (obj, chunk)    # Keep obj alive: id stays unique
+            sink.update(chunk)
+        else:
+            self._stream(obj, sink)
+
+    def _node_digest(self, obj):
+        memoizable = self.memo is not None and self._memoizable(obj)
+        if memoizable:
+            try:
+                return self.memo[id(obj)][1]
+            except KeyError:
+                pass
+        hash = self.new()
+        self._stream(obj, _Sink(self, hash.update))
+        digest = hash.digest()
+        if memoizable:
+            self.memo[id(obj)] = (obj, digest)
+        return digest
+
+    @staticmethod
+    def _memoizable(obj):
+        return isinstance(obj, _container_types) or hasattr(obj, 'update_hash')
+
+    @staticmethod
+    def _stream(obj, sink):
+        """Writes the type of obj, then its contents, to sink."""
+        typ = type(obj)
+        module, name = _type_tag(typ)
+        sink.update(module)
+        sink.update(name)
+
+        updater = update_by_type.get(typ)
+        if updater is not None:
+            updater(obj, sink)
+            return
+
+        update_hash = getattr(obj, 'update_hash', None)
+        if update_hash is not None:
+            update_hash(sink)
+        # Try different collection update methods
+        elif isinstance(obj, dict):
+            _update_dict(obj, sink)
+        elif isinstance(obj, set):
+            _update_set(obj, sink)
+
+# Plain md5-compatible hasher, no memoization
+_default_hasher = Hasher()
+
+def update(obj, hash):
+    """General hash updater that works for everything."""
+    hasher = getattr(hash, 'hasher', None)
+    if hasher is None:
+        hasher = _default_hasher
+        hash = _Sink(hasher, hash.update)
+    hasher._update(obj, hash)
 
 def hexdigest(obj, hash_type='md5'):
     hash = getattr(hashlib, hash_type)()
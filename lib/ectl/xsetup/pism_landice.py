@@ -7,6 +7,7 @@ from modele.constants import SHW,SHI,LHM,RHOI
 import numpy as np
 import giss
 import shutil
+import ectl.hooks
 
 def redo_GIC(GIC0, TOPO, pism_ic, icebin_in, GIC=None):
 
@@ -139,6 +140,18 @@ def redo_GIC(GIC0, TOPO, pism_ic, icebin_in, GIC=None):
             tsn_v[:] = tsn[:]
 
 
+def icebin_files(args_run):
+    """Returns: (pism_ic, icebin_in) named in config/icebin.nc"""
+    with netCDF4.Dataset(os.path.join(args_run, 'config', 'icebin.nc')) as nc:
+        pism_ic = nc.variables['m.greenland.pism'].i
+        icebin_in = nc.variables['m.info'].grid
+    return pism_ic, icebin_in
+
+def xsetup_inputs(args_run, rd):
+    return [rd.params.files['GIC0'].rval, rd.params.files['TOPO'].rval,
+        os.path.join('config', 'icebin.nc')] + list(icebin_files(args_run))
+
+@ectl.hooks.declare(inputs=xsetup_inputs, outputs=['GIC'])
 def xsetup(args_run, rd):
     """args_run:
         Main run directory
@@ -148,9 +161,6 @@ def xsetup(args_run, rd):
     GIC0 = rd.params.files['GIC0'].rval
     TOPO = rd.params.files['TOPO'].rval
 
-    with netCDF4.Dataset(os.path.join('config', 'icebin.nc')) as nc:
-        pism_ic = nc.variables['m.greenland.pism'].i
-        icebin_in = nc.variables['m.info'].grid
-
+    pism_ic, icebin_in = icebin_files(args_run)
     redo_GIC(GIC0, TOPO, pism_ic, icebin_in, GIC=os.path.join(args_run, 'GIC'))
 